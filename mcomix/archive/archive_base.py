@@ -21,6 +21,22 @@ class BaseArchive(object):
     """ True if concurrent calls to extract is supported. """
     support_concurrent_extractions = False
 
+    """ True if members can be read to memory with read(). """
+    support_memory_extraction = False
+
+    """ True if iter_extract can efficiently extract a subset of the
+    members in one pass, even if the archive is not solid. """
+    support_batch_extraction = False
+
+    """ True if members are rendered pages, of which read_preview() can
+    quickly render a low resolution version. """
+    support_preview = False
+
+    """ Attributes holding what is learned while listing the archive, and
+    needed for extraction, see get_listing_state. None if the listing
+    cannot be cached. """
+    _listing_attributes = None
+
     def __init__(self, archive):
         assert isinstance(archive, str), "File should be an Unicode string."
 
@@ -55,6 +71,65 @@ class BaseArchive(object):
         assert isinstance(filename, str) and \
             isinstance(destination_dir, str)
 
+    def read(self, filename):
+        """ Returns the content of the file specified by <filename> as bytes,
+        without writing it to disk. Only supported by archives that set
+        support_memory_extraction. """
+
+        raise NotImplementedError()
+
+    def get_listing_state(self):
+        """ Return what was learned while listing the archive, to be saved
+        by the listing cache, or None if not supported. """
+        if self._listing_attributes is None:
+            return None
+        state = dict((name, getattr(self, name))
+                     for name in self._listing_attributes)
+        state['handler'] = self._get_handler_name()
+        return state
+
+    def set_listing_state(self, contents, state):
+        """ Restore the listing of the archive: <contents> is the list of
+        its files, and <state> was returned by get_listing_state(). The
+        archive can then be extracted without being listed again. Returns
+        False if <state> does not match the archive handler. """
+        if self._listing_attributes is None or \
+           state.get('handler') != self._get_handler_name():
+            return False
+        for name in self._listing_attributes:
+            setattr(self, name, state[name])
+        return True
+
+    def _get_handler_name(self):
+        return '%s.%s' % (self.__class__.__module__, self.__class__.__name__)
+
+    def open_nested(self, filename):
+        """ Returns an archive handler for <filename>, itself an archive,
+        reading it in place instead of extracting it first, or None if that
+        is not supported (the default). """
+
+        return None
+
+    def read_preview(self, filename):
+        """ Returns a quick, low resolution rendering of <filename> as PNG
+        data, to be shown until the file is extracted, and for thumbnails.
+        Only supported by archives that set support_preview. """
+
+        raise NotImplementedError()
+
+    def iter_read(self, entries):
+        """ Generator returning a (filename, content) tuple for each of
+        <entries>, in archive order. Only supported by archives that set
+        support_memory_extraction. """
+        wanted = set(entries)
+        for filename in self.iter_contents():
+            if not filename in wanted:
+                continue
+            yield filename, self.read(filename)
+            wanted.remove(filename)
+            if 0 == len(wanted):
+                break
+
     def iter_extract(self, entries, destination_dir):
         """ Generator to extract <entries> from archive to <destination_dir>. """
         wanted = set(entries)
@@ -77,6 +152,24 @@ class BaseArchive(object):
         in one pass. """
         return False
 
+    def is_encrypted(self):
+        """ Returns True if the archive is known to be encrypted, or a
+        password was asked for its contents. """
+        return self._password is not None
+
+    def can_extract_while_listing(self):
+        """ Returns True if the entries already returned by iter_contents()
+        can be extracted (from another thread) while the listing is still
+        in progress. """
+        return False
+
+    def listing_will_pause(self):
+        """ Returns True if, while iter_contents() is in progress, the next
+        entries may take a while to come, e.g. because a sub-archive must be
+        extracted first: the entries returned so far are worth reporting
+        without waiting for more. """
+        return False
+
     def _replace_invalid_filesystem_chars(self, filename):
         """ Replaces characters in <filename> that cannot be saved to the disk
         with underscore and returns the cleaned-up name. """
@@ -174,12 +267,17 @@ class ExternalExecutableArchive(NonUnicodeArchive):
     # concurrent calls are supported.
     support_concurrent_extractions = True
 
+    # Listing means spawning the external application: worth caching.
+    _listing_attributes = ('unicode_mapping', 'filenames_initialized')
+
     def __init__(self, archive):
         super(ExternalExecutableArchive, self).__init__(archive)
         # Flag to determine if list_contents() has been called
         # This builds the Unicode mapping and is likely required
         # for extracting filenames that have been internally mapped.
         self.filenames_initialized = False
+        # True while iter_contents() is running.
+        self._listing = False
 
     def _get_executable(self):
         """ Returns the executable's name or path. Return None if no executable
@@ -21,13 +21,23 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._archive_root = {}
         self._contents_listed = False
         self._contents = []
+        # Number of sub-archives found, but not opened yet.
+        self._sub_archives_left = 0
+        # Set while the next entries come from sub-archives not opened yet.
+        self._listing_paused = False
         # Assume concurrent extractions are not supported.
         self.support_concurrent_extractions = False
+        # Same for extraction to memory, batch extraction and previews.
+        self.support_memory_extraction = False
+        self.support_batch_extraction = False
+        self.support_preview = False
 
     def _iter_contents(self, archive, root=None):
         self._archive_list.append(archive)
         self._archive_root[archive] = root
         sub_archive_list = []
+        # The last entry is held back, see listing_will_pause.
+        last = None
         for f in archive.iter_contents():
             if archive_tools.is_archive_file(f):
                 # We found a sub-archive, don't try to extract it now, as we
@@ -39,25 +49,22 @@ class RecursiveArchive(archive_base.BaseArchive):
             if root is not None:
                 name = os.path.join(root, name)
             self._entry_mapping[name] = (archive, f)
-            yield name
+            if last is not None:
+                yield last
+            last = name
+        self._sub_archives_left += len(sub_archive_list)
+        if last is not None:
+            self._listing_paused = 0 != self._sub_archives_left
+            yield last
+            self._listing_paused = False
         for f in sub_archive_list:
-            # Extract sub-archive.
-            destination_dir = self._destination_dir
-            if root is not None:
-                destination_dir = os.path.join(destination_dir, root)
-            archive.extract(f, destination_dir)
-            sub_archive_ext = os.path.splitext(f)[1].lower()[1:]
-            sub_archive_path = os.path.join(
-                self._destination_dir, 'sub-archives',
-                '%04u.%s' % (len(self._archive_list), sub_archive_ext
-            ))
-            self._create_directory(os.path.dirname(sub_archive_path))
-            os.rename(os.path.join(destination_dir, f), sub_archive_path)
-            # And open it and list its contents.
-            sub_archive = archive_tools.get_archive_handler(sub_archive_path)
+            self._sub_archives_left -= 1
+            # Read the sub-archive in place if possible: it can
+            # be big, and only some of its pages may be wanted.
+            sub_archive = archive.open_nested(f)
+            if sub_archive is None:
+                sub_archive = self._extract_sub_archive(archive, root, f)
             if sub_archive is None:
-                log.warning('Non-supported archive format: %s',
-                            os.path.basename(sub_archive_path))
                 continue
             sub_root = f
             if root is not None:
@@ -65,6 +72,26 @@ class RecursiveArchive(archive_base.BaseArchive):
             for name in self._iter_contents(sub_archive, sub_root):
                 yield name
 
+    def _extract_sub_archive(self, archive, root, f):
+        """ Extract the sub-archive <f> of <archive>, and return its handler. """
+        destination_dir = self._destination_dir
+        if root is not None:
+            destination_dir = os.path.join(destination_dir, root)
+        archive.extract(f, destination_dir)
+        sub_archive_ext = os.path.splitext(f)[1].lower()[1:]
+        sub_archive_path = os.path.join(
+            self._destination_dir, 'sub-archives',
+            '%04u.%s' % (len(self._archive_list), sub_archive_ext
+        ))
+        self._create_directory(os.path.dirname(sub_archive_path))
+        os.rename(os.path.join(destination_dir, f), sub_archive_path)
+        # And open it.
+        sub_archive = archive_tools.get_archive_handler(sub_archive_path)
+        if sub_archive is None:
+            log.warning('Non-supported archive format: %s',
+                        os.path.basename(sub_archive_path))
+        return sub_archive
+
     def _check_concurrent_extraction_support(self):
         supported = True
         # We need all archives to support concurrent extractions.
@@ -74,6 +101,33 @@ class RecursiveArchive(archive_base.BaseArchive):
                 break
         self.support_concurrent_extractions = supported
 
+    def _check_memory_extraction_support(self):
+        supported = True
+        # We need all archives to support extraction to memory.
+        for archive in self._archive_list:
+            if not archive.support_memory_extraction:
+                supported = False
+                break
+        self.support_memory_extraction = supported
+
+    def _check_batch_extraction_support(self):
+        supported = True
+        # We need all archives to support batch extraction.
+        for archive in self._archive_list:
+            if not archive.support_batch_extraction:
+                supported = False
+                break
+        self.support_batch_extraction = supported
+
+    def _check_preview_support(self):
+        supported = True
+        # We need all archives to support previews.
+        for archive in self._archive_list:
+            if not archive.support_preview:
+                supported = False
+                break
+        self.support_preview = supported
+
     def iter_contents(self):
         if self._contents_listed:
             for f in self._contents:
@@ -86,6 +140,9 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._contents_listed = True
         # We can now check if concurrent extractions are really supported.
         self._check_concurrent_extraction_support()
+        self._check_memory_extraction_support()
+        self._check_batch_extraction_support()
+        self._check_preview_support()
 
     def list_contents(self):
         if self._contents_listed:
@@ -93,7 +150,7 @@ class RecursiveArchive(archive_base.BaseArchive):
         return [f for f in self.iter_contents()]
 
     def extract(self, filename, destination_dir):
-        if not self._contents_listed:
+        if not self._contents_listed and filename not in self._entry_mapping:
             self.list_contents()
         archive, name = self._entry_mapping[filename]
         root = self._archive_root[archive]
@@ -103,6 +160,20 @@ class RecursiveArchive(archive_base.BaseArchive):
                   archive.archive, destination_dir, filename)
         archive.extract(name, destination_dir)
 
+    def read(self, filename):
+        if not self._contents_listed:
+            self.list_contents()
+        archive, name = self._entry_mapping[filename]
+        log.debug('reading from %s: %s', archive.archive, filename)
+        return archive.read(name)
+
+    def read_preview(self, filename):
+        if not self._contents_listed:
+            self.list_contents()
+        archive, name = self._entry_mapping[filename]
+        log.debug('reading preview from %s: %s', archive.archive, filename)
+        return archive.read_preview(name)
+
     def iter_extract(self, entries, destination_dir):
         if not self._contents_listed:
             self.list_contents()
@@ -140,6 +211,53 @@ class RecursiveArchive(archive_base.BaseArchive):
                 return True
         return False
 
+    def is_encrypted(self):
+        # We're encrypted if at least one archive is encrypted.
+        for archive in self._archive_list:
+            if archive.is_encrypted():
+                return True
+        return False
+
+    def get_listing_state(self):
+        if not self._contents_listed or 1 != len(self._archive_list):
+            # Sub-archives need to be extracted anyway.
+            return None
+        return self._main_archive.get_listing_state()
+
+    def set_listing_state(self, contents, state):
+        if not self._main_archive.set_listing_state(contents, state):
+            return False
+        archive = self._main_archive
+        self._archive_list = [archive]
+        self._archive_root = {archive: None}
+        self._entry_mapping = dict((name, (archive, name)) for name in contents)
+        self._contents = list(contents)
+        self._contents_listed = True
+        self._check_concurrent_extraction_support()
+        self._check_memory_extraction_support()
+        self._check_batch_extraction_support()
+        self._check_preview_support()
+        return True
+
+    def can_extract_while_listing(self):
+        if self._listing_paused:
+            # The archives listed so far are used to open the remaining
+            # sub-archives, possibly while their entries are extracted.
+            for archive in self._archive_list:
+                if not archive.support_concurrent_extractions:
+                    return False
+            return True
+        if 1 != len(self._archive_list):
+            # A sub-archive is being listed.
+            return False
+        # Entries of the main archive are listed first.
+        return self._main_archive.can_extract_while_listing()
+
+    def listing_will_pause(self):
+        # Sub-archives must be opened, and possibly
+        # extracted, before their entries can be listed.
+        return self._listing_paused
+
     def close(self):
         for archive in self._archive_list:
             archive.close()
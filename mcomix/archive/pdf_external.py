@@ -3,35 +3,143 @@
 """ PDF handler. """
 
 from mcomix import log
+from mcomix import pdf_dpi_cache
 from mcomix import process
+from mcomix import worker_thread
 from mcomix.archive import archive_base
 
 # FIXME: LooseVersion is deprecated
 from distutils.version import LooseVersion
 import math
 import os
+import queue
 import re
 import subprocess
+import tempfile
+import threading
 
 # Default DPI for rendering.
 PDF_RENDER_DPI_DEF = 72 * 4
 # Maximum DPI for rendering.
 PDF_RENDER_DPI_MAX = 72 * 10
+# DPI for previews, see read_preview().
+PDF_RENDER_DPI_PREVIEW = 72
+# Interval between checks for cancellation while rendering (in seconds).
+PDF_RENDER_POLL_INTERVAL = 0.1
 
 _pdf_possible = None
 _mutool_exec = None
 _mudraw_exec = None
 _mudraw_trace_args = None
+# True if "mutool run" can be used to keep documents open, see PdfRenderer.
+_mutool_run_possible = False
+
+_renderer_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'pdf_renderer.js')
+
+class RendererError(Exception):
+    """ The renderer process died, or could not be started. """
+    pass
+
+class PdfRenderer(object):
+
+    """ A "mutool run" process keeping a PDF document open, to render its
+    pages without starting two processes, each parsing the document, per
+    page. See pdf_renderer.js for the protocol.
+
+    A renderer handles one request at a time. """
+
+    def __init__(self, archive):
+        self._proc = process.popen(_mutool_exec + ['run', _renderer_script, archive],
+                                   stdin=process.PIPE, stdout=process.PIPE)
+        self._replies = queue.Queue()
+        # Replies are read from another thread, so
+        # requests can be cancelled while waiting.
+        reader = threading.Thread(target=self._read_replies,
+                                  name='pdf-renderer')
+        reader.daemon = True
+        reader.start()
+
+    def _read_replies(self):
+        with self._proc.stdout:
+            for line in self._proc.stdout:
+                line = line.strip()
+                if line:
+                    self._replies.put(line.decode('utf-8', 'replace'))
+        # End of output: the process is gone.
+        self._replies.put(None)
+
+    def is_alive(self):
+        return self._proc.poll() is None
+
+    def get_images(self, page_num, token):
+        """ Return the (width, height, matrix) of the images
+        drawn on page <page_num>, like mudraw's trace output. """
+        values = self._request('images %u' % page_num, token).split()
+        images = []
+        for n in range(0, len(values) - 5, 6):
+            images.append((int(values[n]), int(values[n + 1]),
+                           [float(f) for f in values[n + 2:n + 6]]))
+        return images
+
+    def render(self, page_num, dpi, path, token):
+        """ Render page <page_num> at <dpi> to the PNG file <path>. """
+        self._request('render %u %u %s' % (page_num, dpi, path), token)
+
+    def close(self):
+        if self.is_alive():
+            self._proc.kill()
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        self._proc.wait()
+
+    def _request(self, command, token):
+        try:
+            self._proc.stdin.write(command.encode('utf-8', 'surrogateescape') + b'\n')
+            self._proc.stdin.flush()
+        except OSError as ex:
+            raise RendererError(str(ex))
+        while True:
+            try:
+                reply = self._replies.get(timeout=PDF_RENDER_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if token.is_cancelled():
+                    # The only way to stop the current request.
+                    self.close()
+                    token.check()
+        if reply is None:
+            raise RendererError('mutool exited with status %s' % self._proc.wait())
+        status, _, result = reply.partition(' ')
+        if 'ok' != status:
+            raise Exception(result)
+        return result
 
 class PdfArchive(archive_base.BaseArchive):
 
     """ Concurrent calls to extract welcome! """
     support_concurrent_extractions = True
+    # Pages are rendered to a temporary file, then read back.
+    support_memory_extraction = True
+    support_preview = True
+
+    # Listing means running mutool, but there's nothing more to it.
+    _listing_attributes = ()
 
     _fill_image_regex = re.compile(r'^\s*<fill_image\b.*\bmatrix="(?P<matrix>[^"]+)".*\bwidth="(?P<width>\d+)".*\bheight="(?P<height>\d+)".*/>\s*$')
 
     def __init__(self, archive):
         super(PdfArchive, self).__init__(archive)
+        # Idle renderers, and whether they can be used, see _get_renderer().
+        self._renderers = []
+        self._use_renderers = _mutool_run_possible
+        self._closed = False
+        self._renderers_lock = threading.Lock()
+        # Map page number > rendering DPI, loaded on first use.
+        self._dpis = None
+        self._dpis_changed = False
 
     def iter_contents(self):
         proc = subprocess.run(_mutool_exec + ['show', '--', self.archive, 'pages'], stdout=subprocess.PIPE, encoding='utf-8')
@@ -42,34 +150,147 @@ class PdfArchive(archive_base.BaseArchive):
     def extract(self, filename, destination_dir):
         self._create_directory(destination_dir)
         destination_path = os.path.join(destination_dir, filename)
-        page_num = int(filename[0:-4])
-        # Try to find optimal DPI.
+        self._render(int(filename[0:-4]), destination_path)
+
+    def read(self, filename):
+        return self._read(filename)
+
+    def read_preview(self, filename):
+        return self._read(filename, preview=True)
+
+    def close(self):
+        with self._renderers_lock:
+            self._closed = True
+            renderers, self._renderers = self._renderers, []
+            dpis = self._dpis if self._dpis_changed else None
+            self._dpis_changed = False
+        for renderer in renderers:
+            renderer.close()
+        if dpis is not None:
+            pdf_dpi_cache.save(self.archive, dpis)
+
+    def _read(self, filename, preview=False):
+        fd, path = tempfile.mkstemp(suffix='.png', prefix='mcomix.pdf.')
+        os.close(fd)
+        try:
+            self._render(int(filename[0:-4]), path, preview=preview)
+            with open(path, 'rb') as fp:
+                return fp.read()
+        finally:
+            os.unlink(path)
+
+    def _render(self, page_num, path, preview=False):
+        """ Render page <page_num> to the PNG file <path>, at its optimal
+        DPI, or at PDF_RENDER_DPI_PREVIEW if <preview> is True. """
+        # Rendering can take a while: stop early if the
+        # page is no longer wanted (e.g. thumbnails).
+        token = worker_thread.get_current_token()
+        renderer = self._get_renderer()
+        if renderer is not None:
+            try:
+                try:
+                    if preview:
+                        dpi = PDF_RENDER_DPI_PREVIEW
+                    else:
+                        dpi = self._get_dpi(page_num, lambda:
+                                            renderer.get_images(page_num, token))
+                    log.debug('rendering page %u at %u DPI', page_num, dpi)
+                    renderer.render(page_num, dpi, path, token)
+                finally:
+                    self._release_renderer(renderer)
+                return
+            except RendererError as ex:
+                log.warning('! PDF renderer failed, falling back to mudraw: %s', ex)
+                self._use_renderers = False
+        if preview:
+            dpi = PDF_RENDER_DPI_PREVIEW
+        else:
+            dpi = self._get_dpi(page_num, lambda:
+                                self._trace_images(page_num, token))
+        # Render...
+        cmd = _mudraw_exec + ['-r', str(dpi), '-o', path, '--', self.archive, str(page_num)]
+        log.debug('rendering page %u: %s', page_num, ' '.join(cmd))
+        process.run(cmd, token=token)
+
+    def _trace_images(self, page_num, token):
+        """ Same as PdfRenderer.get_images, using mudraw's trace output. """
         cmd = _mudraw_exec + _mudraw_trace_args + ['--', self.archive, str(page_num)]
-        log.debug('finding optimal DPI for %s: %s', filename, ' '.join(cmd))
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, encoding='utf-8')
-        max_size = 0
-        max_dpi = PDF_RENDER_DPI_DEF
-        for line in proc.stdout.splitlines():
+        log.debug('finding optimal DPI for page %u: %s', page_num, ' '.join(cmd))
+        output = process.run(cmd, stdout=process.PIPE, token=token)
+        images = []
+        for line in output.decode('utf-8', 'replace').splitlines():
             match = self._fill_image_regex.match(line)
             if not match:
                 continue
             matrix = [float(f) for f in match.group('matrix').split()]
+            images.append((int(match.group('width')),
+                           int(match.group('height')),
+                           matrix))
+        return images
+
+    def _get_dpi(self, page_num, get_images):
+        """ Return the rendering DPI of page <page_num>, from the persistent
+        cache, or from the images returned by <get_images>() otherwise. """
+        with self._renderers_lock:
+            if self._dpis is None:
+                self._dpis = pdf_dpi_cache.load(self.archive)
+            dpi = self._dpis.get(page_num)
+        if dpi is not None:
+            return dpi
+        dpi = self._get_optimal_dpi(get_images())
+        with self._renderers_lock:
+            self._dpis[page_num] = dpi
+            self._dpis_changed = True
+        return dpi
+
+    @staticmethod
+    def _get_optimal_dpi(images):
+        """ Return the DPI rendering the biggest of <images>, a list of
+        (width, height, matrix) tuples, at its native resolution. """
+        max_size = 0
+        max_dpi = PDF_RENDER_DPI_DEF
+        for width, height, matrix in images:
             for size, coeff1, coeff2 in (
-                (int(match.group('width')), matrix[0], matrix[1]),
-                (int(match.group('height')), matrix[2], matrix[3]),
+                (width, matrix[0], matrix[1]),
+                (height, matrix[2], matrix[3]),
             ):
                 if size < max_size:
                     continue
                 render_size = math.sqrt(coeff1 * coeff1 + coeff2 * coeff2)
+                if 0 == render_size:
+                    continue
                 dpi = int(size * 72 / render_size)
                 if dpi > PDF_RENDER_DPI_MAX:
                     dpi = PDF_RENDER_DPI_MAX
                 max_size = size
                 max_dpi = dpi
-        # Render...
-        cmd = _mudraw_exec + ['-r', str(max_dpi), '-o', destination_path, '--', self.archive, str(page_num)]
-        log.debug('rendering %s: %s', filename, ' '.join(cmd))
-        process.call(cmd)
+        return max_dpi
+
+    def _get_renderer(self):
+        """ Return an idle renderer, starting a new one if needed, or None
+        if they cannot be used. Concurrent extractions each get their
+        own renderer, and renderers are kept until the archive is closed. """
+        if not self._use_renderers:
+            return None
+        with self._renderers_lock:
+            while self._renderers:
+                renderer = self._renderers.pop()
+                if renderer.is_alive():
+                    return renderer
+                renderer.close()
+        try:
+            return PdfRenderer(self.archive)
+        except OSError as ex:
+            log.warning('! Could not start PDF renderer: %s', ex)
+            self._use_renderers = False
+            return None
+
+    def _release_renderer(self, renderer):
+        with self._renderers_lock:
+            if not self._closed and renderer.is_alive():
+                self._renderers.append(renderer)
+                return
+        renderer.close()
 
     @staticmethod
     def is_available():
@@ -77,6 +298,7 @@ class PdfArchive(archive_base.BaseArchive):
         if _pdf_possible is not None:
             return _pdf_possible
         global _mutool_exec, _mudraw_exec, _mudraw_trace_args
+        global _mutool_run_possible
         mutool = process.find_executable(('mutool',))
         _pdf_possible = False
         version = None
@@ -103,6 +325,8 @@ class PdfArchive(archive_base.BaseArchive):
                 _mudraw_exec = [mutool, 'draw']
                 _mudraw_trace_args = ['-F', 'trace']
                 _pdf_possible = True
+                _mutool_run_possible = version >= LooseVersion('1.12') \
+                    and os.path.isfile(_renderer_script)
             else:
                 # Separate mudraw executable.
                 mudraw = process.find_executable(('mudraw',))
@@ -120,6 +344,7 @@ class PdfArchive(archive_base.BaseArchive):
             log.debug('mutool: %s', ' '.join(_mutool_exec))
             log.debug('mudraw: %s', ' '.join(_mudraw_exec))
             log.debug('mudraw trace arguments: %s', ' '.join(_mudraw_trace_args))
+            log.debug('persistent renderer: %s', _mutool_run_possible)
         else:
             log.info('MuPDF not available.')
         return _pdf_possible
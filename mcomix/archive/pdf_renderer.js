@@ -0,0 +1,69 @@
+// pdf_renderer.js - Script for "mutool run", keeping a PDF document open to
+// render its pages on demand, see pdf_external.PdfRenderer.
+//
+// Usage: mutool run pdf_renderer.js DOCUMENT
+//
+// Commands are read from stdin, one per line, and each gets a one line
+// reply on stdout: "ok [RESULT]" or "error MESSAGE".
+//
+//   images PAGE           -> "ok W H A B C D ...": size and transformation
+//                            matrix of each image drawn on PAGE.
+//   render PAGE DPI PATH  -> render PAGE at DPI to the PNG file PATH.
+//
+// Pages are numbered from 1.
+
+var doc;
+if (typeof Document.openDocument == 'function')
+    doc = Document.openDocument(scriptArgs[0]);
+else
+    doc = new Document(scriptArgs[0]);
+
+var rgb;
+if (typeof ColorSpace != 'undefined' && ColorSpace.DeviceRGB)
+    rgb = ColorSpace.DeviceRGB;
+else
+    rgb = DeviceRGB;
+
+// The standard output is not flushed after each line when it is a
+// pipe: padding the replies makes sure they are not held back in the
+// buffer. Blank lines are ignored by the reader.
+var padding = new Array(64 * 1024).join(' ');
+
+function reply(text) {
+    print(text);
+    print(padding);
+}
+
+function images(page) {
+    var found = [];
+    page.run({
+        fillImage: function (image, ctm) {
+            found.push([image.getWidth(), image.getHeight(),
+                        ctm[0], ctm[1], ctm[2], ctm[3]].join(' '));
+        }
+    }, [1, 0, 0, 1, 0, 0]);
+    return found.join(' ');
+}
+
+function render(page, dpi, path) {
+    var zoom = dpi / 72;
+    page.toPixmap([zoom, 0, 0, zoom, 0, 0], rgb, false).saveAsPNG(path);
+    return '';
+}
+
+var line;
+while ((line = readline()) != null) {
+    var args = line.split(' ');
+    try {
+        var page = doc.loadPage(parseInt(args[1]) - 1);
+        if (args[0] == 'images')
+            reply('ok ' + images(page));
+        else if (args[0] == 'render')
+            reply('ok ' + render(page, parseInt(args[2]),
+                                 args.slice(3).join(' ')));
+        else
+            reply('error unknown command: ' + args[0]);
+    } catch (ex) {
+        reply('error ' + String(ex).replace(/\s+/g, ' '));
+    }
+}
@@ -24,6 +24,11 @@ class RarArchive(archive_base.BaseArchive):
     # Nope! Not a good idea...
     support_concurrent_extractions = False
 
+    # Decompressed data is collected through the UCM_PROCESSDATA callback.
+    support_memory_extraction = True
+
+    _listing_attributes = ('_is_solid', '_is_encrypted')
+
     class _OpenMode(object):
         """ Rar open mode """
         RAR_OM_LIST    = 0
@@ -32,6 +37,7 @@ class RarArchive(archive_base.BaseArchive):
     class _ProcessingMode(object):
         """ Rar file processing mode """
         RAR_SKIP       = 0
+        RAR_TEST       = 1
         RAR_EXTRACT    = 2
 
     class _ErrorCode(object):
@@ -103,9 +109,12 @@ class RarArchive(archive_base.BaseArchive):
         self._handle = None
         self._callback_function = None
         self._is_solid = False
+        self._is_encrypted = False
         # Information about the current file will be stored in this structure
         self._headerdata = RarArchive._RARHeaderDataEx()
         self._current_filename = None
+        # Chunks of decompressed data, when reading to memory.
+        self._data = None
 
         # Set up function prototypes.
         # Mandatory since pointers get truncated on x64 otherwise!
@@ -127,6 +136,15 @@ class RarArchive(archive_base.BaseArchive):
     def is_solid(self):
         return self._is_solid
 
+    def is_encrypted(self):
+        return self._is_encrypted or super(RarArchive, self).is_encrypted()
+
+    def get_listing_state(self):
+        if self._is_encrypted:
+            # Do not leak the contents of encrypted archives.
+            return None
+        return super(RarArchive, self).get_listing_state()
+
     def iter_contents(self):
         """ List archive contents. """
         self._close()
@@ -136,6 +154,8 @@ class RarArchive(archive_base.BaseArchive):
                 self._read_header()
                 if 0 != (0x10 & self._headerdata.Flags):
                     self._is_solid = True
+                if 0 != (0x04 & self._headerdata.Flags):
+                    self._is_encrypted = True
                 filename = self._current_filename
                 yield filename
                 # Skip to the next entry if we're still on the same name
@@ -152,6 +172,33 @@ class RarArchive(archive_base.BaseArchive):
 
     def extract(self, filename, destination_dir):
         """ Extract <filename> from the archive to <destination_dir>. """
+        if self._seek(filename):
+            dest = ctypes.c_wchar_p(os.path.join(destination_dir, filename))
+            self._process(dest)
+        # After the method returns, the RAR handler is still open and pointing
+        # to the next archive file. This will improve extraction speed for sequential file reads.
+        # After all files have been extracted, close() should be called to free the handler resources.
+
+    def read(self, filename):
+        """ Decompress <filename> to memory, without writing it to disk. """
+        if not self._seek(filename):
+            raise UnrarException("Couldn't find %s in archive" % filename)
+        # In test mode, unrar decompresses the entry and hands
+        # over the data to the callback, see _callback.
+        self._data = []
+        try:
+            self._process(mode=RarArchive._ProcessingMode.RAR_TEST)
+            return b''.join(self._data)
+        finally:
+            self._data = None
+
+    def close(self):
+        """ Close the archive handle """
+        self._close()
+
+    def _seek(self, filename):
+        """ Move the handle to the header of <filename>. Returns False
+        if the file could not be found. """
         if not self._handle:
             self._open()
         looped = False
@@ -159,10 +206,8 @@ class RarArchive(archive_base.BaseArchive):
             # Check if the current entry matches the requested file.
             if self._current_filename is not None:
                 if (self._current_filename == filename):
-                    # It's the entry we're looking for, extract it.
-                    dest = ctypes.c_wchar_p(os.path.join(destination_dir, filename))
-                    self._process(dest)
-                    break
+                    # It's the entry we're looking for.
+                    return True
                 # Not the right entry, skip it.
                 self._process()
             try:
@@ -175,19 +220,13 @@ class RarArchive(archive_base.BaseArchive):
                 # a second full pass, it probably doesn't even exist in the
                 # archive.
                 if looped:
-                    break
+                    return False
+                looped = True
                 self._open()
-        # After the method returns, the RAR handler is still open and pointing
-        # to the next archive file. This will improve extraction speed for sequential file reads.
-        # After all files have been extracted, close() should be called to free the handler resources.
-
-    def close(self):
-        """ Close the archive handle """
-        self._close()
 
     def _open(self):
         """ Open rar handle for extraction. """
-        self._callback_function = UNRARCALLBACK(self._password_callback)
+        self._callback_function = UNRARCALLBACK(self._callback)
         archivedata = RarArchive._RAROpenArchiveDataEx(ArcNameW=self.archive,
                                                        OpenMode=RarArchive._OpenMode.RAR_OM_EXTRACT,
                                                        Callback=self._callback_function,
@@ -197,6 +236,8 @@ class RarArchive(archive_base.BaseArchive):
         if not handle:
             errormessage = UnrarException.get_error_message(archivedata.OpenResult)
             raise UnrarException("Couldn't open archive: %s" % errormessage)
+        if 0 != (0x80 & archivedata.Flags): # ROADF_ENCHEADERS
+            self._is_encrypted = True
         self._unrar.RARSetCallback(handle, self._callback_function, 0)
         self._handle = handle
 
@@ -219,11 +260,11 @@ class RarArchive(archive_base.BaseArchive):
         self._check_errorcode(errorcode)
         self._current_filename = self._headerdata.FileNameW
 
-    def _process(self, dest=None):
+    def _process(self, dest=None, mode=None):
         """ Process current entry: extract or skip it. """
-        if dest is None:
+        if mode is None and dest is None:
             mode = RarArchive._ProcessingMode.RAR_SKIP
-        else:
+        elif mode is None:
             mode = RarArchive._ProcessingMode.RAR_EXTRACT
         errorcode = self._unrar.RARProcessFileW(self._handle, mode, None, dest)
         self._current_filename = None
@@ -239,9 +280,14 @@ class RarArchive(archive_base.BaseArchive):
             raise UnrarException("Couldn't close archive: %s" % errormessage)
         self._handle = None
 
-    def _password_callback(self, msg, userdata, buffer_address, buffer_size):
-        """ Called by the unrar library in case of missing password. """
-        if msg == 2: # UCM_NEEDPASSWORD
+    def _callback(self, msg, userdata, buffer_address, buffer_size):
+        """ Called by the unrar library in case of missing password,
+        or with decompressed data. """
+        if msg == 1: # UCM_PROCESSDATA
+            if self._data is not None:
+                self._data.append(ctypes.string_at(buffer_address, buffer_size))
+            return 1
+        elif msg == 2: # UCM_NEEDPASSWORD
             self._get_password()
             if not self._password or len(self._password) == 0:
                 # Abort extraction
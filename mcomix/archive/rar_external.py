@@ -4,7 +4,6 @@
 
 import os
 import sys
-import subprocess
 
 from mcomix import log
 from mcomix import process
@@ -18,6 +17,9 @@ class RarArchive(archive_base.ExternalExecutableArchive):
 
     STATE_HEADER, STATE_LISTING = 1, 2
 
+    _listing_attributes = archive_base.ExternalExecutableArchive._listing_attributes + \
+        ('_is_solid', '_is_encrypted', '_contents')
+
     class EncryptedHeader(Exception):
         pass
 
@@ -26,6 +28,7 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         self._is_solid = False
         self._is_encrypted =  False
         self._contents = []
+        self._pending_path = None
 
     def _get_executable(self):
         return self._find_unrar_executable()
@@ -69,9 +72,14 @@ class RarArchive(archive_base.ExternalExecutableArchive):
                 return None
         if self._state == self.STATE_LISTING:
             line = line.lstrip()
+            if not line:
+                # End of the current entry block: its flags are known now,
+                # so it can safely be extracted while listing goes on.
+                filename, self._pending_path = self._pending_path, None
+                return filename
             if line.startswith('Name: '):
-                self._path = line[6:]
-                return self._path
+                self._pending_path = self._path = line[6:]
+                return None
             if line.startswith('Size: '):
                 filesize = int(line[6:])
                 if filesize > 0:
@@ -87,36 +95,61 @@ class RarArchive(archive_base.ExternalExecutableArchive):
     def is_solid(self):
         return self._is_solid
 
+    def is_encrypted(self):
+        return self._is_encrypted or super(RarArchive, self).is_encrypted()
+
+    def get_listing_state(self):
+        if self._is_encrypted:
+            # Do not leak the contents of encrypted archives.
+            return None
+        return super(RarArchive, self).get_listing_state()
+
+    def can_extract_while_listing(self):
+        # The solid flag is part of the listing header.
+        return not self._is_solid
+
     def iter_contents(self):
         if not self._get_executable():
             return
 
-        # We'll try at most 2 times:
-        # - the first time without a password
-        # - a second time with a password if the header is encrypted
-        for retry_count in range(2):
-            #: Indicates which part of the file listing has been read.
-            self._state = self.STATE_HEADER
-            #: Current path while listing contents.
-            self._path = None
-            proc = subprocess.run(
-                self._get_list_arguments(), stdout=process.PIPE, stderr=process.STDOUT,
-                encoding="utf-8",
-                creationflags=process._get_creationflags())
-            try:
-                for line in proc.stdout.splitlines():
-                    filename = self._parse_list_output_line(line.rstrip(os.linesep))
-                    if filename is not None:
-                        yield self._unicode_filename(filename)
-            except self.EncryptedHeader:
-                # The header is encrypted, try again
-                # if it was our first attempt.
-                if 0 == retry_count:
-                    continue
-            # Last and/or successful attempt.
-            break
-
-        self.filenames_initialized = True
+        self._listing = True
+        try:
+            # We'll try at most 2 times:
+            # - the first time without a password
+            # - a second time with a password if the header is encrypted
+            for retry_count in range(2):
+                #: Indicates which part of the file listing has been read.
+                self._state = self.STATE_HEADER
+                #: Current path while listing contents.
+                self._path = None
+                #: Path of the entry being parsed, not yet returned.
+                self._pending_path = None
+                # Stream the listing: entries are returned as soon
+                # as unrar prints them, not once the whole listing is done.
+                proc = process.popen(self._get_list_arguments(), stderr=process.STDOUT)
+                try:
+                    for line in proc.stdout:
+                        line = line.decode('utf-8').rstrip(os.linesep)
+                        filename = self._parse_list_output_line(line)
+                        if filename is not None:
+                            yield self._unicode_filename(filename)
+                    if self._pending_path is not None:
+                        yield self._unicode_filename(self._pending_path)
+                except self.EncryptedHeader:
+                    # The header is encrypted, try again
+                    # if it was our first attempt.
+                    if 0 == retry_count:
+                        continue
+                finally:
+                    proc.stdout.close()
+                    proc.wait()
+                # Last and/or successful attempt.
+                break
+
+            self.filenames_initialized = True
+        finally:
+            # Also reset when the listing is not fully consumed.
+            self._listing = False
 
     def extract(self, filename, destination_dir):
         """ Extract <filename> from the archive to <destination_dir>. """
@@ -126,7 +159,7 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         if not self._get_executable():
             return
 
-        if not self.filenames_initialized:
+        if not self.filenames_initialized and not self._listing:
             self.list_contents()
 
         desired_filename = self._original_filename(filename)
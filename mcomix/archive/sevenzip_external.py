@@ -18,6 +18,12 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
 
     STATE_HEADER, STATE_LISTING, STATE_FOOTER = 1, 2, 3
 
+    # Non-solid archives are extracted in batches, see iter_extract.
+    support_batch_extraction = True
+
+    _listing_attributes = archive_base.ExternalExecutableArchive._listing_attributes + \
+        ('_is_solid', '_is_encrypted', '_contents')
+
     class EncryptedHeader(Exception):
         pass
 
@@ -26,6 +32,7 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         self._is_solid = False
         self._is_encrypted =  False
         self._contents = []
+        self._pending_path = None
 
     def _get_executable(self):
         return SevenZipArchive._find_7z_executable()
@@ -53,6 +60,27 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         args.extend(('--', self.archive))
         return args
 
+    def _get_batch_extract_arguments(self, list_file, destination_dir):
+        args = [self._get_executable(), 'x', '-y', '-bd', '-bb1', '-sccUTF-8',
+                '-o' + destination_dir, '-i@' + list_file]
+        args.append(self._get_password_argument())
+        args.extend(('--', self.archive))
+        return args
+
+    def _write_list_file(self, filenames):
+        """ Write a temporary list file for the -i@ switch with <filenames>,
+        and return its path. The caller is responsible for removing it. """
+        tmplistfile = tempfile.NamedTemporaryFile(prefix='mcomix.7z.', delete=False)
+        try:
+            for filename in filenames:
+                desired_filename = self._original_filename(filename)
+                if isinstance(desired_filename, str):
+                    desired_filename = desired_filename.encode('utf-8')
+                tmplistfile.write(desired_filename + os.linesep.encode('utf-8'))
+        finally:
+            tmplistfile.close()
+        return tmplistfile.name
+
     def _parse_list_output_line(self, line):
         """ Start parsing after the first delimiter (bunch of - characters),
         and end when delimiters appear again. Format:
@@ -77,9 +105,14 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
                 self._is_solid = True
 
         if self._state == self.STATE_LISTING:
+            if not line:
+                # End of the current entry block: its flags are known now,
+                # so it can safely be extracted while listing goes on.
+                filename, self._pending_path = self._pending_path, None
+                return filename
             if line.startswith('Path = '):
-                self._path = line[7:]
-                return self._path
+                self._pending_path = self._path = line[7:]
+                return None
             if line.startswith('Size = '):
                 filesize = int(line[7:])
                 if filesize > 0:
@@ -92,34 +125,61 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
     def is_solid(self):
         return self._is_solid
 
+    def is_encrypted(self):
+        return self._is_encrypted or super(SevenZipArchive, self).is_encrypted()
+
+    def get_listing_state(self):
+        if self._is_encrypted:
+            # Do not leak the contents of encrypted archives.
+            return None
+        return super(SevenZipArchive, self).get_listing_state()
+
+    def can_extract_while_listing(self):
+        # The solid flag is part of the listing header.
+        return not self._is_solid
+
     def iter_contents(self):
         if not self._get_executable():
             return
 
-        # We'll try at most 2 times:
-        # - the first time without a password
-        # - a second time with a password if the header is encrypted
-        for retry_count in range(2):
-            #: Indicates which part of the file listing has been read.
-            self._state = self.STATE_HEADER
-            #: Current path while listing contents.
-            self._path = None
-            proc = subprocess.run(self._get_list_arguments(),
-                stdout=subprocess.PIPE, stderr=process.STDOUT, encoding='utf-8')
-            try:
-                for line in proc.stdout.splitlines():
-                    filename = self._parse_list_output_line(line.rstrip(os.linesep))
-                    if filename is not None:
-                        yield filename
-            except self.EncryptedHeader:
-                # The header is encrypted, try again
-                # if it was our first attempt.
-                if 0 == retry_count:
-                    continue
-            # Last and/or successful attempt.
-            break
-
-        self.filenames_initialized = True
+        self._listing = True
+        try:
+            # We'll try at most 2 times:
+            # - the first time without a password
+            # - a second time with a password if the header is encrypted
+            for retry_count in range(2):
+                #: Indicates which part of the file listing has been read.
+                self._state = self.STATE_HEADER
+                #: Current path while listing contents.
+                self._path = None
+                #: Path of the entry being parsed, not yet returned.
+                self._pending_path = None
+                # Stream the listing: entries are returned as soon
+                # as 7z prints them, not once the whole listing is done.
+                proc = process.popen(self._get_list_arguments(), stderr=process.STDOUT)
+                try:
+                    for line in proc.stdout:
+                        line = line.decode('utf-8').rstrip(os.linesep)
+                        filename = self._parse_list_output_line(line)
+                        if filename is not None:
+                            yield filename
+                    if self._pending_path is not None:
+                        yield self._pending_path
+                except self.EncryptedHeader:
+                    # The header is encrypted, try again
+                    # if it was our first attempt.
+                    if 0 == retry_count:
+                        continue
+                finally:
+                    proc.stdout.close()
+                    proc.wait()
+                # Last and/or successful attempt.
+                break
+
+            self.filenames_initialized = True
+        finally:
+            # Also reset when the listing is not fully consumed.
+            self._listing = False
 
     def extract(self, filename, destination_dir):
         """ Extract <filename> from the archive to <destination_dir>. """
@@ -129,22 +189,15 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         if not self._get_executable():
             return
 
-        if not self.filenames_initialized:
+        if not self.filenames_initialized and not self._listing:
             self.list_contents()
 
-        tmplistfile = tempfile.NamedTemporaryFile(prefix='mcomix.7z.', delete=False)
+        tmplistfile = self._write_list_file((filename,))
         try:
-            desired_filename = self._original_filename(filename)
-            if isinstance(desired_filename, str):
-                desired_filename = desired_filename.encode('utf-8')
-
-            tmplistfile.write(desired_filename + os.linesep.encode('utf-8'))
-            tmplistfile.close()
-
             output = self._create_file(os.path.join(destination_dir, filename))
             try:
                 proc = subprocess.run(
-                    self._get_extract_arguments(list_file=tmplistfile.name),
+                    self._get_extract_arguments(list_file=tmplistfile),
                     stdout=output, stderr=subprocess.PIPE,
                     creationflags=process._get_creationflags())
 
@@ -154,7 +207,7 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
             finally:
                 output.close()
         finally:
-            os.unlink(tmplistfile.name)
+            os.unlink(tmplistfile)
 
     def iter_extract(self, entries, destination_dir):
 
@@ -164,6 +217,11 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         if not self.filenames_initialized:
             self.list_contents()
 
+        if not self._is_solid:
+            for filename in self._iter_extract_batch(entries, destination_dir):
+                yield filename
+            return
+
         proc = process.popen(self._get_extract_arguments())
         try:
             wanted = set(entries)
@@ -183,6 +241,67 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
             proc.stdout.close()
             proc.wait()
 
+    def _iter_extract_batch(self, entries, destination_dir):
+        """ Extract <entries> to <destination_dir> with a single 7z process,
+        yielding each file once it has been written. Entries whose name
+        had to be sanitized are extracted one by one, as 7z would write
+        them under their original name. """
+        wanted = {}
+        for unicode_name in entries:
+            filename = self._original_filename(unicode_name)
+            if isinstance(filename, bytes):
+                filename = filename.decode('utf-8')
+            if filename != unicode_name:
+                self.extract(unicode_name, destination_dir)
+                yield unicode_name
+                continue
+            wanted[filename] = unicode_name
+        if 0 == len(wanted):
+            return
+        self._create_directory(destination_dir)
+        # Original names, as matched by 7z.
+        tmplistfile = self._write_list_file(list(wanted.keys()))
+        try:
+            proc = process.popen(self._get_batch_extract_arguments(
+                tmplistfile, destination_dir))
+            try:
+                # With -bb1, 7z prints the name of each member when starting
+                # to extract it: the previous one is complete at this point.
+                previous = None
+                for line in proc.stdout:
+                    line = line.decode('utf-8').rstrip('\r\n')
+                    if not line.startswith('- '):
+                        continue
+                    unicode_name = wanted.pop(line[2:], None)
+                    if unicode_name is None:
+                        continue
+                    if previous is not None:
+                        yield previous
+                    previous = unicode_name
+            finally:
+                proc.stdout.close()
+                proc.wait()
+            if previous is not None:
+                yield previous
+            elif 0 != proc.returncode:
+                # Nothing was reported: 7z is probably too old to support
+                # -bb1 (needs 15.x), extract the files one by one instead.
+                log.debug('batch extraction of %s failed (%s), '
+                          'falling back to single extractions',
+                          self.archive, proc.returncode)
+                # Keep the archive order, as 7z would.
+                remaining = set(wanted.values())
+                for filename, filesize in self._contents:
+                    if filename in remaining:
+                        self.extract(filename, destination_dir)
+                        yield filename
+                return
+            if 0 != proc.returncode:
+                log.error(_("Extraction of %(archivefile)s might have failed: %(error)s"),
+                          {'archivefile': self.archive, 'error': proc.returncode})
+        finally:
+            os.unlink(tmplistfile)
+
     @staticmethod
     def _find_7z_executable():
         """ Tries to start 7z, and returns either '7z' if
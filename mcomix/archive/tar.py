@@ -4,9 +4,20 @@
 
 import os
 import tarfile
+import threading
 from . import archive_base
+from . import tar_index
 
 class TarArchive(archive_base.NonUnicodeArchive):
+
+    # Members are read from their offset, or from the closest
+    # checkpoint for compressed archives, see read(); each call
+    # is independent.
+    support_concurrent_extractions = True
+
+    # Members are small enough to be handed over in memory.
+    support_memory_extraction = True
+
     def __init__(self, archive):
         super(TarArchive, self).__init__(archive)
         # Track if archive contents have been listed at least one time: this
@@ -14,9 +25,20 @@ class TarArchive(archive_base.NonUnicodeArchive):
         self._contents_listed = False
         self._contents = []
         self.tar = None
+        # Only uncompressed archives support random access.
+        self._is_compressed = True
+        # Map member name > (data offset, size), for regular members.
+        self._index = {}
+        self._fd = None
+        # Uncompressed data of gzip/bzip2 archives, see tar_index.
+        self._stream = None
+        # Protects self.tar: tarfile is not thread-safe.
+        self._tar_lock = threading.Lock()
 
     def is_solid(self):
-        return True
+        if self._stream is not None:
+            return not self._stream.is_random_access()
+        return self._is_compressed
 
     def iter_contents(self):
         if self._contents_listed:
@@ -24,38 +46,138 @@ class TarArchive(archive_base.NonUnicodeArchive):
                 yield name
             return
         # Make sure we start back at the beginning of the tar.
-        self.tar = tarfile.open(self.archive, 'r')
+        self.close()
         self._contents = []
+        self._index = {}
+        compression = tar_index.get_compression(self.archive)
+        if compression is not None:
+            index = tar_index.load_index(self.archive)
+            if index is not None:
+                # Already listed: no need to decompress anything.
+                self._stream, members = index
+                for name, offset, size in members:
+                    yield self._add_member(name, offset, size)
+                self._contents_listed = True
+                return
+            self._stream = tar_index.open_stream(self.archive, compression)
+        tar = self._open()
+        members = []
         while True:
-            info = self.tar.next()
+            with self._tar_lock:
+                info = tar.next()
             if info is None:
                 break
-            name = self._unicode_filename(info.name)
-            self._contents.append(name)
-            yield name
+            offset = None
+            if info.isreg() and not info.issparse():
+                offset = info.offset_data
+            members.append((info.name, offset, info.size))
+            yield self._add_member(info.name, offset, info.size)
+        if self._stream is not None:
+            # Read the end of the data, so all checkpoints are known.
+            while tar.fileobj.read(tar_index.CHUNK_SIZE):
+                pass
+            tar.fileobj.close()
+            tar_index.save_index(self.archive, self._stream, members)
+        else:
+            self.tar = tar
         self._contents_listed = True
 
     def list_contents(self):
         return [f for f in self.iter_contents()]
 
     def extract(self, filename, destination_dir):
-        if not self._contents_listed:
-            self.list_contents()
+        content = self.read(filename)
         new = self._create_file(os.path.join(destination_dir, filename))
-        file_object = self.tar.extractfile(self._original_filename(filename))
-        new.write(file_object.read())
-        file_object.close()
+        new.write(content)
         new.close()
 
+    def read(self, filename):
+        if not self._contents_listed:
+            self.list_contents()
+        if filename in self._index:
+            offset, size = self._index[filename]
+            if self._stream is not None:
+                return self._stream.read(offset, size)
+            return self._pread(offset, size)
+        # Compressed archive, or special member (e.g. hard link).
+        with self._tar_lock:
+            if self.tar is None:
+                self.tar = tarfile.open(self.archive, 'r')
+            file_object = self.tar.extractfile(self._original_filename(filename))
+            try:
+                return file_object.read()
+            finally:
+                file_object.close()
+
+    def iter_read(self, entries):
+        if not self._contents_listed:
+            self.list_contents()
+        if self._stream is None:
+            for f, content in super(TarArchive, self).iter_read(entries):
+                yield f, content
+            return
+        # Decompress the data in one pass.
+        wanted = set(entries)
+        names = [name for name in self._contents
+                 if name in wanted and name in self._index]
+        ranges = [self._index[name] for name in names]
+        for name, content in zip(names, self._stream.iter_read(ranges)):
+            yield name, content
+        # Special members, if any.
+        for name in wanted.difference(names):
+            yield name, self.read(name)
+
     def iter_extract(self, entries, destination_dir):
         if not self._contents_listed:
             self.list_contents()
-        for f in super(TarArchive, self).iter_extract(entries, destination_dir):
-            yield f
+        if self._stream is None:
+            for f in super(TarArchive, self).iter_extract(entries, destination_dir):
+                yield f
+            return
+        for name, content in self.iter_read(entries):
+            new = self._create_file(os.path.join(destination_dir, name))
+            new.write(content)
+            new.close()
+            yield name
 
     def close(self):
         if self.tar is not None:
             self.tar.close()
             self.tar = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._stream = None
+
+    def _add_member(self, name, offset, size):
+        name = self._unicode_filename(name)
+        if offset is not None:
+            self._index[name] = (offset, size)
+        self._contents.append(name)
+        return name
+
+    def _open(self):
+        """ Open the archive, and check if it's compressed. """
+        if self._stream is not None:
+            self._is_compressed = True
+            return tarfile.open(fileobj=self._stream.open(), mode='r:')
+        try:
+            tar = tarfile.open(self.archive, 'r:')
+        except tarfile.ReadError:
+            # Not a plain tar, let tarfile figure out the compression.
+            self._is_compressed = True
+            return tarfile.open(self.archive, 'r')
+        self._is_compressed = False
+        self._fd = os.open(self.archive, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return tar
+
+    def _pread(self, offset, size):
+        """ Read <size> bytes at <offset> in the archive. """
+        if hasattr(os, 'pread'):
+            return os.pread(self._fd, size, offset)
+        # No pread (Windows): seek and read under lock.
+        with self._tar_lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            return os.read(self._fd, size)
 
 # vim: expandtab:sw=4:ts=4
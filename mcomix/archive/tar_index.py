@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+
+""" Seek checkpoints for gzip and bzip2 compressed tar archives.
+
+The uncompressed data of such archives can only be read sequentially. To
+avoid decompressing from the start of the file for each member, checkpoints
+(places decompression can restart from) are recorded while the archive is
+listed, and saved with the members list in the cache directory, so the
+next opening of the archive does not need to decompress anything at all.
+"""
+
+import bisect
+import bz2
+import hashlib
+import io
+import os
+import pickle
+import threading
+import zlib
+
+from mcomix import constants
+from mcomix import log
+
+#: Version of the saved indexes, bump on format changes.
+INDEX_VERSION = 1
+#: Size of the chunks read from the compressed file.
+CHUNK_SIZE = 64 * 1024
+#: Uncompressed distance between two in-memory gzip snapshots.
+SNAPSHOT_INTERVAL = 4 * 1024 * 1024
+#: Streams with checkpoints further apart are not considered random access.
+MAX_CHECKPOINT_GAP = 16 * 1024 * 1024
+
+BZIP2_BLOCK_MAGIC = 0x314159265359
+BZIP2_EOS_MAGIC = 0x177245385090
+BZIP2_HEADER = 0x425a6839 # 'BZh9'
+
+GZIP_FHCRC, GZIP_FEXTRA, GZIP_FNAME, GZIP_FCOMMENT = 2, 4, 8, 16
+
+
+def get_compression(path):
+    """ Return 'gz' or 'bz2' if <path> is compressed with one of the formats
+    supported by this module, None otherwise. """
+    with open(path, 'rb') as fp:
+        magic = fp.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return 'gz'
+    if magic == b'BZh':
+        return 'bz2'
+    return None
+
+def open_stream(path, compression, checkpoints=None, size=None):
+    """ Return a stream for the uncompressed data of <path>. """
+    if 'gz' == compression:
+        return GzipStream(path, checkpoints, size)
+    if 'bz2' == compression:
+        return Bzip2Stream(path, checkpoints, size)
+    raise ValueError('unsupported compression: %s' % compression)
+
+def load_index(path):
+    """ Return a (stream, members) tuple from the index saved by save_index()
+    for <path>, or None if there is no index, or it is outdated. """
+    index_path = _get_index_path(path)
+    if not os.path.isfile(index_path):
+        return None
+    try:
+        stat = os.stat(path)
+        with open(index_path, 'rb') as fp:
+            index = pickle.load(fp)
+        if index['version'] != INDEX_VERSION or \
+           index['key'] != (stat.st_size, stat.st_mtime):
+            return None
+        stream = open_stream(path, index['compression'],
+                             index['checkpoints'], index['size'])
+        return stream, index['members']
+    except Exception as ex:
+        log.warning('! Could not load tar index %s: %s', index_path, ex)
+        return None
+
+def save_index(path, stream, members):
+    """ Save the <stream> checkpoints and <members> of <path>, a list of
+    (name, offset, size) tuples, offset being None for members that
+    cannot be read directly. """
+    index_path = _get_index_path(path)
+    try:
+        stat = os.stat(path)
+        index = {
+            'version': INDEX_VERSION,
+            'key': (stat.st_size, stat.st_mtime),
+            'compression': stream.compression,
+            'size': stream.size,
+            'checkpoints': stream.get_checkpoints(),
+            'members': members,
+        }
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, 'wb') as fp:
+            pickle.dump(index, fp, pickle.HIGHEST_PROTOCOL)
+    except Exception as ex:
+        log.warning('! Could not save tar index %s: %s', index_path, ex)
+
+def _get_index_path(path):
+    path = os.path.abspath(path).encode('utf-8', 'surrogateescape')
+    return os.path.join(constants.TAR_INDEX_PATH,
+                        hashlib.md5(path).hexdigest() + '.pickle')
+
+
+class CompressedStream(object):
+
+    """ Uncompressed data of a file, that can be read from a checkpoint
+    instead of from the start. Checkpoints are tuples, the first item being
+    the offset in the uncompressed data; the other items depend on the
+    format. """
+
+    compression = None
+
+    def __init__(self, path, checkpoints=None, size=None):
+        self.path = path
+        #: Size of the uncompressed data, once it has been read to the end.
+        self.size = size
+        self._checkpoints = []
+        self._offsets = []
+        self._lock = threading.Lock()
+        for checkpoint in checkpoints or ():
+            self._add_checkpoint(checkpoint)
+
+    def get_checkpoints(self):
+        """ Return the list of checkpoints that can be saved. """
+        with self._lock:
+            return list(self._checkpoints)
+
+    def is_random_access(self):
+        """ Return True if any part of the data can be read without
+        decompressing much more than it. """
+        if self.size is None:
+            return False
+        with self._lock:
+            offsets = self._offsets + [self.size]
+        if offsets[0] != 0:
+            return False
+        for start, end in zip(offsets, offsets[1:]):
+            if end - start > MAX_CHECKPOINT_GAP:
+                return False
+        return True
+
+    def open(self):
+        """ Return a file object for reading the data sequentially. """
+        return _Reader(self._iter_chunks(None))
+
+    def read(self, offset, size):
+        """ Return <size> bytes of uncompressed data, starting at <offset>. """
+        for data in self.iter_read(((offset, size),)):
+            return data
+
+    def iter_read(self, ranges):
+        """ Generator returning the data for each (offset, size) of <ranges>,
+        which must be sorted by offset. The data is decompressed in one
+        pass, restarting from a checkpoint only when skipping past it. """
+        chunks = None
+        start, chunk = 0, b''
+        for offset, size in ranges:
+            checkpoint = self._find_checkpoint(offset)
+            checkpoint_offset = 0 if checkpoint is None else checkpoint[0]
+            if chunks is None or offset < start or \
+               checkpoint_offset > start + len(chunk):
+                if chunks is not None:
+                    chunks.close()
+                chunks = self._iter_chunks(checkpoint)
+                start, chunk = checkpoint_offset, b''
+            end = offset + size
+            parts = []
+            while True:
+                chunk_end = start + len(chunk)
+                if chunk_end > offset:
+                    parts.append(chunk[max(offset - start, 0):end - start])
+                if chunk_end >= end:
+                    break
+                data = next(chunks, None)
+                if data is None:
+                    raise EOFError('unexpected end of data')
+                start, chunk = chunk_end, data
+            yield b''.join(parts)
+        if chunks is not None:
+            chunks.close()
+
+    def _iter_chunks(self, checkpoint):
+        """ Generator returning the uncompressed data in chunks, starting
+        from <checkpoint>, or from the start of the file if None. Must set
+        self.size once the end of the data is reached. """
+        raise NotImplementedError()
+
+    def _find_checkpoint(self, offset):
+        """ Return the last checkpoint before <offset>, or None. """
+        if self.size is None:
+            # Checkpoints are still being recorded.
+            return None
+        with self._lock:
+            index = bisect.bisect_right(self._offsets, offset) - 1
+            if index < 0:
+                return None
+            return self._checkpoints[index]
+
+    def _get_checkpoint_offset(self, offset):
+        """ Return the offset of the last checkpoint before <offset>. """
+        with self._lock:
+            index = bisect.bisect_right(self._offsets, offset) - 1
+            return 0 if index < 0 else self._offsets[index]
+
+    def _add_checkpoint(self, checkpoint):
+        with self._lock:
+            index = bisect.bisect_left(self._offsets, checkpoint[0])
+            if index < len(self._offsets) and \
+               self._offsets[index] == checkpoint[0]:
+                return
+            self._offsets.insert(index, checkpoint[0])
+            self._checkpoints.insert(index, checkpoint)
+
+
+class GzipStream(CompressedStream):
+
+    """ Checkpoints are (offset, compressed offset, decompressor) tuples.
+
+    Python's zlib cannot restart inflating in the middle of a byte, so the
+    only checkpoints that can be saved are the start of each gzip member
+    (decompressor is None). In addition, snapshots of the decompressor are
+    kept in memory every SNAPSHOT_INTERVAL bytes of data, so a big single
+    member archive becomes random access once it has been read through.
+    """
+
+    compression = 'gz'
+
+    def get_checkpoints(self):
+        return [checkpoint for checkpoint in
+                super(GzipStream, self).get_checkpoints()
+                if checkpoint[2] is None]
+
+    def _iter_chunks(self, checkpoint):
+        with open(self.path, 'rb') as fp:
+            if checkpoint is None:
+                if not _read_gzip_header(fp):
+                    raise EOFError('not a gzip file')
+                checkpoint = (0, fp.tell(), None)
+                self._add_checkpoint(checkpoint)
+            offset, compressed_offset, decompressor = checkpoint
+            fp.seek(compressed_offset)
+            if decompressor is None:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            else:
+                decompressor = decompressor.copy()
+            while True:
+                data = fp.read(CHUNK_SIZE)
+                if not data:
+                    raise EOFError('compressed file ended before the '
+                                   'end-of-stream marker was reached')
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield chunk
+                    offset += len(chunk)
+                if decompressor.eof:
+                    # Skip the member trailer (CRC and size), and look
+                    # for another member.
+                    fp.seek(8 - len(decompressor.unused_data), os.SEEK_CUR)
+                    if not _read_gzip_header(fp):
+                        break
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                    self._add_checkpoint((offset, fp.tell(), None))
+                elif offset - self._get_checkpoint_offset(offset) >= SNAPSHOT_INTERVAL:
+                    self._add_checkpoint((offset, fp.tell(), decompressor.copy()))
+        self.size = offset
+
+
+class Bzip2Stream(CompressedStream):
+
+    """ Checkpoints are (offset, start, end) tuples, one per bzip2 block,
+    start and end being the position in bits of the block in the compressed
+    file. Each block can be decompressed on its own, but since they are not
+    byte aligned, it is first copied to a new single block stream. """
+
+    compression = 'bz2'
+
+    def _iter_chunks(self, checkpoint):
+        with open(self.path, 'rb') as fp:
+            if checkpoint is None:
+                blocks = self._iter_blocks(fp)
+            else:
+                with self._lock:
+                    index = self._checkpoints.index(checkpoint)
+                    blocks = self._checkpoints[index:]
+                blocks = [(data_offset, start, end, None)
+                          for data_offset, start, end in blocks]
+            offset = 0
+            for offset, start, end, data in blocks:
+                if data is None:
+                    data = _decompress_bzip2_block(fp, start, end)
+                self._add_checkpoint((offset, start, end))
+                yield data
+                offset += len(data)
+        self.size = offset
+
+    def _iter_blocks(self, fp):
+        """ Find all blocks in the file, and return an iterator on
+        (offset, start, end, data) tuples. """
+        blocks, boundaries = _scan_bzip2(fp)
+        offset = 0
+        position = 0
+        for start in blocks:
+            if start < position:
+                # Part of the previous block.
+                continue
+            index = bisect.bisect_right(boundaries, start)
+            # A block magic number could appear by chance in the compressed
+            # data: if the block cannot be decompressed, try to extend it
+            # to the next boundary.
+            for end in boundaries[index:index + 4]:
+                try:
+                    data = _decompress_bzip2_block(fp, start, end)
+                except (OSError, ValueError, EOFError):
+                    continue
+                break
+            else:
+                raise OSError('invalid bzip2 block at bit %u' % start)
+            yield offset, start, end, data
+            offset += len(data)
+            position = end
+
+
+class _Reader(object):
+
+    """ Minimal read-only file object on a chunks generator, enough
+    for tarfile. Only supports seeking forward, or slightly backward. """
+
+    #: How much of the previous data is kept for seeking backward.
+    KEEP_SIZE = 1024
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+        #: Offset of the buffer start.
+        self._start = 0
+        self._position = 0
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if os.SEEK_CUR == whence:
+            offset += self._position
+        elif os.SEEK_SET != whence:
+            raise io.UnsupportedOperation('can only seek from start or current position')
+        if offset < self._start:
+            raise io.UnsupportedOperation('cannot seek that far backward')
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        end = None if size is None or size < 0 else self._position + size
+        parts = []
+        while end is None or self._position < end:
+            index = self._position - self._start
+            if index < len(self._buffer):
+                data = self._buffer[index:None if end is None else end - self._start]
+                parts.append(data)
+                self._position += len(data)
+                continue
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            keep = self._buffer[-self.KEEP_SIZE:]
+            self._start += len(self._buffer) - len(keep)
+            self._buffer = keep + chunk
+        return b''.join(parts)
+
+    def close(self):
+        self._chunks.close()
+
+
+def _read_gzip_header(fp):
+    """ Skip the gzip member header at the current position of <fp>.
+    Return False if there is no member there. """
+    header = fp.read(10)
+    if len(header) < 10 or header[:2] != b'\x1f\x8b':
+        return False
+    if header[2] != 8:
+        raise OSError('unknown gzip compression method')
+    flags = header[3]
+    if flags & GZIP_FEXTRA:
+        size = int.from_bytes(fp.read(2), 'little')
+        fp.read(size)
+    for flag in (GZIP_FNAME, GZIP_FCOMMENT):
+        if flags & flag:
+            while fp.read(1) not in (b'\0', b''):
+                pass
+    if flags & GZIP_FHCRC:
+        fp.read(2)
+    return True
+
+def _scan_bzip2(fp):
+    """ Return the sorted list of positions in bits of the block magic
+    numbers in the file, and of all the possible ends of blocks (the
+    following blocks, the end of streams, and the end of the file). """
+    blocks = set()
+    boundaries = set()
+    fp.seek(0)
+    position = 0
+    tail = b''
+    while True:
+        data = fp.read(16 * CHUNK_SIZE)
+        if not data:
+            break
+        # Keep the end of the previous chunk for magic numbers crossing chunks.
+        data = tail + data
+        base = (position - len(tail)) * 8
+        for bit in _find_bits(data, BZIP2_BLOCK_MAGIC, 48):
+            blocks.add(base + bit)
+        for bit in _find_bits(data, BZIP2_EOS_MAGIC, 48):
+            boundaries.add(base + bit)
+        position += len(data) - len(tail)
+        tail = data[-7:]
+    boundaries.update(blocks)
+    boundaries.add(position * 8)
+    return sorted(blocks), sorted(boundaries)
+
+def _find_bits(data, pattern, size):
+    """ Generator returning the positions in bits of the <size> bits
+    <pattern> in <data>, in no particular order. """
+    for shift in range(8):
+        length = (shift + size + 7) // 8
+        padding = length * 8 - shift - size
+        value = pattern << padding
+        mask = ((1 << size) - 1) << padding
+        # Search the bytes fully covered by the pattern, then check the rest.
+        first = 1 if shift else 0
+        core = value.to_bytes(length, 'big')[first:(shift + size) // 8]
+        position = data.find(core)
+        while -1 != position:
+            start = position - first
+            if start >= 0 and start + length <= len(data) and \
+               int.from_bytes(data[start:start + length], 'big') & mask == value:
+                yield start * 8 + shift
+            position = data.find(core, position + 1)
+
+def _decompress_bzip2_block(fp, start, end):
+    """ Decompress the block between bits <start> and <end> of <fp>. """
+    fp.seek(start // 8)
+    data = fp.read((end + 7) // 8 - start // 8)
+    size = end - start
+    if len(data) * 8 < start % 8 + size:
+        raise EOFError('truncated bzip2 block')
+    bits = int.from_bytes(data, 'big') >> (len(data) * 8 - start % 8 - size)
+    bits &= (1 << size) - 1
+    # The block CRC follows the magic number, and is also the stream
+    # CRC of a single block stream.
+    crc = (bits >> (size - 80)) & 0xffffffff
+    stream = (((BZIP2_HEADER << size | bits) << 48 | BZIP2_EOS_MAGIC) << 32) | crc
+    size += 32 + 48 + 32
+    padding = -size % 8
+    stream = (stream << padding).to_bytes((size + padding) // 8, 'big')
+    return bz2.decompress(stream)
+
+# vim: expandtab:sw=4:ts=4
@@ -2,7 +2,10 @@
 
 """ Unicode-aware wrapper for zipfile.ZipFile. """
 
+import io
 import os
+import struct
+import threading
 import zipfile
 from contextlib import closing
 
@@ -21,10 +24,72 @@ def is_py_supported_zipfile(path):
                 return False
     return True
 
+class FileSection(io.RawIOBase):
+
+    """ Read-only file object for the <size> bytes at <offset>
+    in the file at <path>, e.g. a member stored in a ZIP archive. """
+
+    def __init__(self, path, offset, size):
+        super(FileSection, self).__init__()
+        self._file = open(path, 'rb')
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if io.SEEK_CUR == whence:
+            position += self._position
+        elif io.SEEK_END == whence:
+            position += self._size
+        if position < 0:
+            # Same as a real file.
+            raise OSError('invalid seek position: %d' % position)
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._size - self._position)
+        if size <= 0:
+            return 0
+        self._file.seek(self._offset + self._position)
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super(FileSection, self).close()
+
 class ZipArchive(archive_base.NonUnicodeArchive):
-    def __init__(self, archive):
+
+    # Each extracting thread uses its own handle.
+    support_concurrent_extractions = True
+
+    # Members are small enough to be handed over in memory.
+    support_memory_extraction = True
+
+    def __init__(self, archive, section=None):
+        """ If <section> is set, the archive is not the file at <archive>
+        (only used as its name), but the FileSection made from the
+        (path, offset, size) tuple <section>, see open_nested(). """
         super(ZipArchive, self).__init__(archive)
-        self.zip = zipfile.ZipFile(archive, 'r')
+        self._section = section
+        # File objects opened for <section>.
+        self._files = []
+        self.zip = self._open_zip()
+        # Per thread handles, see _get_zip().
+        self._local = threading.local()
+        self._handles = []
 
         # Encryption is supported starting with Python 2.6
         self._encryption_supported = hasattr(self.zip, "setpassword")
@@ -39,12 +104,16 @@ class ZipArchive(archive_base.NonUnicodeArchive):
             yield self._unicode_filename(filename)
 
     def extract(self, filename, destination_dir):
+        content = self.read(filename)
         new = self._create_file(os.path.join(destination_dir, filename))
-        content = self.zip.read(self._original_filename(filename))
         new.write(content)
         new.close()
 
-        zipinfo = self.zip.getinfo(self._original_filename(filename))
+    def read(self, filename):
+        zip = self._get_zip()
+        content = zip.read(self._original_filename(filename))
+
+        zipinfo = zip.getinfo(self._original_filename(filename))
         if len(content) != zipinfo.file_size:
             log.warning(_('%(filename)s\'s extracted size is %(actual_size)d bytes,'
                 ' but should be %(expected_size)d bytes.'
@@ -52,10 +121,75 @@ class ZipArchive(archive_base.NonUnicodeArchive):
                 { 'filename' : filename, 'actual_size' : len(content),
                   'expected_size' : zipinfo.file_size })
 
+        return content
 
+    def open_nested(self, filename):
+        """ Sub-archives stored without compression are read in place: their
+        listing comes from their own central directory, and their members
+        are only read when extracted. """
+        zipinfo = self.zip.getinfo(self._original_filename(filename))
+        if zipfile.ZIP_STORED != zipinfo.compress_type or zipinfo.flag_bits & 0x1:
+            return None
+        # The member data follows its local header.
+        path, offset, size = self._get_section()
+        with FileSection(path, offset, size) as fp:
+            fp.seek(zipinfo.header_offset)
+            header = fp.read(30)
+        if 30 != len(header) or zipfile.stringFileHeader != header[:4]:
+            return None
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        section = (path, offset + zipinfo.header_offset + 30 +
+                   name_length + extra_length, zipinfo.file_size)
+        try:
+            with closing(zipfile.ZipFile(FileSection(*section), 'r')) as zip_file:
+                for file_info in zip_file.infolist():
+                    if file_info.compress_type not in (zipfile.ZIP_STORED,
+                                                       zipfile.ZIP_DEFLATED):
+                        return None
+        except (zipfile.BadZipFile, OSError):
+            # Not a ZIP archive.
+            return None
+        log.debug('reading %s in place', filename)
+        return ZipArchive(os.path.join(self.archive, filename), section=section)
 
     def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
         self.zip.close()
+        for fp in self._files:
+            fp.close()
+
+    def _get_section(self):
+        """ Returns the (path, offset, size) of the archive data. """
+        if self._section is None:
+            return self.archive, 0, os.path.getsize(self.archive)
+        return self._section
+
+    def _open_zip(self):
+        """ Returns a new zipfile.ZipFile handle on the archive. """
+        if self._section is None:
+            return zipfile.ZipFile(self.archive, 'r')
+        fp = FileSection(*self._section)
+        with self._lock:
+            self._files.append(fp)
+        return zipfile.ZipFile(fp, 'r')
+
+    def _get_zip(self):
+        """ Returns a zipfile.ZipFile handle private to the calling thread:
+        a shared handle would serialize all reads on its file object, while
+        independent handles let deflated members be inflated in parallel
+        (zlib releases the GIL). """
+        handle = getattr(self._local, 'zip', None)
+        if handle is None:
+            handle = self._open_zip()
+            if self._password is not None:
+                handle.setpassword(i18n.to_utf8(self._password))
+            with self._lock:
+                self._handles.append(handle)
+            self._local.zip = handle
+        return handle
 
     def _has_encryption(self):
         """ Checks all files in the archive for encryption.
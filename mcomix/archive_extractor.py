@@ -2,15 +2,29 @@
 
 
 import os
+import shutil
+import tempfile
 import threading
 import traceback
 
 from mcomix import archive_tools
 from mcomix import callback
+from mcomix import listing_cache
 from mcomix import log
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
+#: Maximum number of files extracted in one batch.
+BATCH_MAX_SIZE = 32
+
+#: Number of listed entries after which a provisional
+#: contents_listed is signalled, for archives supporting it.
+PROVISIONAL_LISTING_SIZE = 32
+
+#: Directory (relative to the destination directory) for previews.
+PREVIEW_DIRECTORY = '.previews'
+
 class Extractor(object):
 
     """Extractor is a threaded class for extracting different archive formats.
@@ -30,15 +44,37 @@ class Extractor(object):
     def __init__(self):
         self._setupped = False
 
-    def setup(self, src, dst, type=None):
+    def setup(self, src, dst, type=None, store=None, cache=None):
         """Setup the extractor with archive <src> and destination dir <dst>.
         Return a threading.Condition related to the is_ready() method, or
         None if the format of <src> isn't supported.
+
+        If a page_store.PageStore is passed as <store>, members of archives
+        supporting it are extracted to memory instead of <dst>.
+
+        If a page_cache.PageCache is passed as <cache>, members found in
+        it are not extracted again, and extracted members are added to it.
         """
         self._src = src
         self._dst = dst
-        self._files = []
+        self._type = type
+        self._store = store
+        self._cache = cache
+        self._cache_key = None
+        if cache is not None:
+            self._cache_key = cache.get_archive_key(src)
+        # Map file name > extraction priority, smallest first.
+        self._files = {}
+        # Priority of the file wanted first, see extract_first().
+        self._first_priority = 0
         self._extracted = set()
+        # Size of each extracted file, and their total.
+        self._sizes = {}
+        self._extracted_size = 0
+        # Files currently being extracted by a batch.
+        self._extracting = set()
+        # Files with a preview, see get_preview_path().
+        self._previews = set()
         self._archive = archive_tools.get_recursive_archive_handler(src, dst, type=type)
         if self._archive is None:
             msg = _('Non-supported archive format: %s') % os.path.basename(src)
@@ -46,9 +82,12 @@ class Extractor(object):
             raise ArchiveException(msg)
 
         self._contents_listed = False
+        self._provisional = False
         self._extract_started = False
+        self._extract_early = False
         self._condition = threading.Condition()
-        self._list_thread = WorkerThread(self._list_contents, name='list')
+        self._list_thread = WorkerThread(self._list_contents, name='list',
+                                         priority=worker_thread.PRIORITY_PAGE)
         self._list_thread.append_order(self._archive)
         self._setupped = True
 
@@ -63,7 +102,7 @@ class Extractor(object):
         with self._condition:
             if not self._contents_listed:
                 return
-            return self._files[:]
+            return list(self._files)
 
     def get_directory(self):
         """Returns the root extraction directory of this extractor."""
@@ -75,22 +114,74 @@ class Extractor(object):
         in the archive using get_files(), then filter and/or permute this
         list before sending it back using set_files().
 
-        Note: Random access on gzip or bzip2 compressed tar archives is
-        no good idea. These formats are supported *only* for backwards
-        compability. They are fine formats for some purposes, but should
-        not be used for scanned comic books. So, we cheat and ignore the
-        ordering applied with this method on such archives.
+        Note: the ordering is ignored for solid archives, which are
+        extracted in one pass. Gzip or bzip2 compressed tar archives are
+        only solid if they lack seek checkpoints, see archive.tar_index.
         """
         with self._condition:
             if not self._contents_listed:
                 return
-            self._files = [f for f in files if f not in self._extracted]
-            if not self._files:
-                # Nothing to do!
-                return
+            self._files = {f: n for n, f in enumerate(files)
+                           if f not in self._extracted}
+            self._first_priority = 0
             if self._extract_started:
                 self.extract()
 
+    def extract_first(self, files):
+        """Extract <files> before the other files of the list set by
+        set_files(), in this order. Files missing from that list (see
+        forget()) are added to it. Only the priority of <files> changes,
+        so this is cheap even for big archives.
+
+        While the archive contents are still being listed, this is the
+        same as extract_listed().
+        """
+        with self._condition:
+            if not self._contents_listed:
+                self.extract_listed(files)
+                return
+            files = [f for f in files if f not in self._extracted]
+            if not files:
+                return
+            missing = False
+            self._first_priority -= len(files)
+            for n, f in enumerate(files, start=self._first_priority):
+                if f not in self._files:
+                    missing = True
+                self._files[f] = n
+            if not self._extract_started:
+                return
+            if self._extract_function == self._extract_all_files:
+                # Order is ignored, only queue the missing files.
+                if missing:
+                    self.extract()
+                return
+            if self._extract_function == self._extract_batch:
+                orders = [(self._files[f], (f,)) for f in files]
+            else:
+                orders = [(self._files[f], f) for f in files]
+            self._extract_thread.extend_orders(orders)
+
+    def extract_listed(self, files):
+        """Start extracting <files> while the archive contents are still being
+        listed. Only possible after a provisional contents_listed, and only
+        for the files it reported; ignored otherwise.
+        """
+        with self._condition:
+            if self._contents_listed or not self._provisional:
+                return
+            files = [f for f in files if f not in self._extracted]
+            if not files:
+                return
+            if not self._extract_started:
+                self._extract_function = self._extract_file
+                self._extract_thread = self._create_extract_thread(1)
+                self._extract_started = True
+                self._extract_early = True
+            else:
+                self._extract_thread.clear_orders()
+            self._extract_thread.extend_orders(list(enumerate(files)))
+
     def is_ready(self, name):
         """Return True if the file <name> in the extractor's file list
         (as set by set_files()) is fully extracted.
@@ -98,6 +189,47 @@ class Extractor(object):
         with self._condition:
             return name in self._extracted
 
+    def get_preview_path(self, name):
+        """Return the path of the low resolution version of the file <name>,
+        for archives supporting previews (see BaseArchive.read_preview), or
+        None if there is none. Previews are in the page store, if any.
+        """
+        with self._condition:
+            if name not in self._previews:
+                return None
+        return os.path.join(self._dst, PREVIEW_DIRECTORY, name)
+
+    def get_extracted_size(self):
+        """Return the number of bytes used by the extracted files, in
+        the destination directory or in the page store."""
+        with self._condition:
+            return self._extracted_size
+
+    def forget(self, names):
+        """Delete the extracted files <names> to reclaim space. They are
+        no longer "ready", and are not queued for extraction again: use
+        set_files() for that. Return the list of the files deleted, i.e.
+        the ones that were extracted.
+        """
+        forgotten = []
+        with self._condition:
+            for name in names:
+                if name not in self._extracted:
+                    continue
+                self._extracted.remove(name)
+                self._extracted_size -= self._sizes.pop(name, 0)
+                path = os.path.join(self._dst, name)
+                if self._store is not None:
+                    self._store.remove(path)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                forgotten.append(name)
+        if forgotten:
+            log.debug('Deleted extracted files: "%s"', '", "'.join(forgotten))
+        return forgotten
+
     def stop(self):
         """Signal the extractor to stop extracting and kill the extracting
         thread. Blocks until the extracting thread has terminated.
@@ -117,37 +249,63 @@ class Extractor(object):
         with self._condition:
             if not self._contents_listed:
                 return
-            if not self._extract_started:
+            if not self._extract_started or self._extract_early:
                 if self._archive.support_concurrent_extractions \
                    and not self._archive.is_solid():
                     max_threads = prefs['max extract threads']
                 else:
                     max_threads = 1
                 if self._archive.is_solid():
-                    fn = self._extract_all_files
+                    self._extract_function = self._extract_all_files
+                elif self._archive.support_batch_extraction:
+                    self._extract_function = self._extract_batch
                 else:
-                    fn = self._extract_file
-                self._extract_thread = WorkerThread(fn,
-                                                    name='extract',
-                                                    max_threads=max_threads,
-                                                    unique_orders=True)
+                    self._extract_function = self._extract_file
+            if not self._extract_started:
+                self._extract_thread = self._create_extract_thread(max_threads)
                 self._extract_started = True
             else:
+                if self._extract_early:
+                    # Now that we know everything about
+                    # the archive, use the right settings.
+                    self._extract_thread.set_max_threads(max_threads)
                 self._extract_thread.clear_orders()
+            self._extract_early = False
+            if not self._files:
+                # Nothing to do!
+                return
             if self._archive.is_solid():
                 # Sort files so we don't queue the same batch multiple times.
-                self._extract_thread.append_order(sorted(self._files))
+                self._extract_thread.append_order((0, tuple(sorted(self._files))))
+                return
+            files = sorted(self._files, key=self._files.get)
+            if self._archive.support_batch_extraction:
+                self._extract_thread.extend_orders([
+                    (self._files[batch[0]], batch)
+                    for batch in self._make_batches(files)])
             else:
-                self._extract_thread.extend_orders(self._files)
+                self._extract_thread.extend_orders([
+                    (self._files[f], f) for f in files])
 
     @callback.Callback
-    def contents_listed(self, extractor, files):
-        """ Called after the contents of the archive has been listed. """
+    def contents_listed(self, extractor, files, provisional=False):
+        """ Called after the contents of the archive has been listed.
+
+        If <provisional> is True, listing is still in progress and <files>
+        are the entries listed so far: they can already be extracted using
+        extract_listed(). """
         pass
 
-    @callback.Callback
-    def file_extracted(self, extractor, filename):
-        """ Called whenever a new file is extracted and ready. """
+    @callback.BatchCallback
+    def files_extracted(self, extractor, filenames):
+        """ Called whenever new files are extracted and ready. Files
+        extracted by worker threads are reported in batches. """
+        pass
+
+    @callback.BatchCallback
+    def files_updated(self, extractor, filenames):
+        """ Called whenever files made ready with a preview (see
+        get_preview_path()) are replaced by their full version. """
         pass
 
     def close(self):
@@ -159,11 +317,36 @@ class Extractor(object):
             self._archive.close()
 
     def _extraction_finished(self, name):
+        size = self._get_size(name)
         with self._condition:
-            self._files.remove(name)
+            self._files.pop(name, None)
             self._extracted.add(name)
+            self._extracted_size += size - self._sizes.get(name, 0)
+            self._sizes[name] = size
             self._condition.notifyAll()
-        self.file_extracted(self, name)
+        self.files_extracted(self, [name])
+
+    def _extraction_updated(self, name):
+        """Called when the file <name>, made ready with a preview,
+        has been replaced by its full version."""
+        size = self._get_size(name)
+        with self._condition:
+            if name not in self._extracted:
+                # Forgotten in the meantime.
+                return
+            self._extracted_size += size - self._sizes.get(name, 0)
+            self._sizes[name] = size
+        self.files_updated(self, [name])
+
+    def _get_size(self, name):
+        path = os.path.join(self._dst, name)
+        try:
+            if self._store is not None:
+                return self._store.get_size(path)
+            return os.path.getsize(path)
+        except OSError:
+            # Failed extraction.
+            return 0
 
     def _extract_all_files(self, files):
 
@@ -173,9 +356,78 @@ class Extractor(object):
             files = list(set(files) - self._extracted)
             files.sort()
 
+        files = self._extract_cached_files(files)
+        if not files:
+            return
+
         try:
+            if self._store is not None and self._archive.support_memory_extraction:
+                log.debug('Extracting from "%s" to memory: "%s"', self._src, '", "'.join(files))
+                for f, data in self._archive.iter_read(files):
+                    self._store.add(os.path.join(self._dst, f), data)
+                    self._add_to_cache(f, data)
+                    if self._extract_thread.must_stop():
+                        return
+                    self._extraction_finished(f)
+                return
             log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, '", "'.join(files))
             for f in self._archive.iter_extract(files, self._dst):
+                self._add_to_cache(f)
+                if self._extract_thread.must_stop():
+                    return
+                self._extraction_finished(f)
+
+        except Exception as ex:
+            # Better to ignore any failed extractions (e.g. from a corrupt
+            # archive) than to crash here and leave the main thread in a
+            # possible infinite block. Damaged or missing files *should* be
+            # handled gracefully by the main program anyway.
+            log.error(_('! Extraction error: %s'), ex)
+            log.debug('Traceback:\n%s', traceback.format_exc())
+
+    def _create_extract_thread(self, max_threads):
+        """Return the thread pool processing extraction orders: (priority,
+        files) tuples, smallest priority first, see extract_first()."""
+        return WorkerThread(self._extract_order, name='extract',
+                            max_threads=max_threads, sort_orders=True,
+                            unique_orders=True,
+                            order_uid=lambda order: order[1],
+                            priority=worker_thread.PRIORITY_PAGE)
+
+    def _extract_order(self, order):
+        """Process an extraction order queued by extract(), extract_first()
+        or extract_listed(), with the extraction function best suited to
+        the archive."""
+        self._extract_function(order[1])
+
+    def _make_batches(self, files):
+        """Split <files> into batches of growing size: the first files in
+        the list (the ones wanted first) are extracted by small batches to
+        keep latency low, the remaining ones by bigger batches to cut the
+        number of extraction passes."""
+        batches = []
+        size = 1
+        while files:
+            batches.append(tuple(files[:size]))
+            files = files[size:]
+            size = min(size * 2, BATCH_MAX_SIZE)
+        return batches
+
+    def _extract_batch(self, files):
+        """Extract a batch of files in one pass, and mark each one as
+        "ready" as soon as it has been extracted."""
+
+        with self._condition:
+            files = [f for f in files
+                     if f not in self._extracted and f not in self._extracting]
+            self._extracting.update(files)
+
+        try:
+            remaining = self._extract_cached_files(files)
+            if remaining:
+                log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, '", "'.join(remaining))
+            for f in self._archive.iter_extract(remaining, self._dst):
+                self._add_to_cache(f)
                 if self._extract_thread.must_stop():
                     return
                 self._extraction_finished(f)
@@ -188,15 +440,61 @@ class Extractor(object):
             log.error(_('! Extraction error: %s'), ex)
             log.debug('Traceback:\n%s', traceback.format_exc())
 
+        finally:
+            with self._condition:
+                self._extracting.difference_update(files)
+                missing = [f for f in files if f not in self._extracted]
+
+        if self._extract_thread.must_stop():
+            return
+        # Same as with _extract_file: don't leave anybody waiting
+        # on files that could not be extracted.
+        for f in missing:
+            self._extraction_finished(f)
+
     def _extract_file(self, name):
         """Extract the file named <name> to the destination directory,
         mark the file as "ready", then signal a notify() on the Condition
         returned by setup().
         """
 
+        with self._condition:
+            if name in self._extracted:
+                # Stale order, see forget().
+                return
+
+        previewed = updated = False
         try:
-            log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
-            self._archive.extract(name, self._dst)
+            if not self._extract_cached_files([name]):
+                # Found in the page cache, and already marked as "ready".
+                return
+            if self._archive.support_preview:
+                previewed = self._extract_preview(name)
+                if self._extract_thread.must_stop():
+                    return
+            if self._store is not None and self._archive.support_memory_extraction:
+                log.debug('Extracting from "%s" to memory: "%s"', self._src, name)
+                data = self._archive.read(name)
+                self._store.add(os.path.join(self._dst, name), data)
+                updated = True
+                self._add_to_cache(name, data)
+            elif previewed:
+                # The preview may be being read: extract
+                # to another directory, and replace it.
+                log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
+                tmp_dir = tempfile.mkdtemp(dir=self._dst, prefix='.extract.')
+                try:
+                    self._archive.extract(name, tmp_dir)
+                    os.replace(os.path.join(tmp_dir, name),
+                               os.path.join(self._dst, name))
+                    updated = True
+                finally:
+                    shutil.rmtree(tmp_dir, True)
+                self._add_to_cache(name)
+            else:
+                log.debug('Extracting from "%s" to "%s": "%s"', self._src, self._dst, name)
+                self._archive.extract(name, self._dst)
+                self._add_to_cache(name)
 
         except Exception as ex:
             # Better to ignore any failed extractions (e.g. from a corrupt
@@ -208,16 +506,104 @@ class Extractor(object):
 
         if self._extract_thread.must_stop():
             return
+        if not previewed:
+            self._extraction_finished(name)
+        elif updated:
+            self._extraction_updated(name)
+
+    def _extract_preview(self, name):
+        """Make the low resolution version of <name> available, as the file
+        itself until replaced by its full version, and as its preview (see
+        get_preview_path()). Return True on success."""
+        try:
+            log.debug('Extracting preview from "%s": "%s"', self._src, name)
+            data = self._archive.read_preview(name)
+        except Exception as ex:
+            log.debug('Could not extract preview of "%s": %s', name, ex)
+            return False
+        for path in (os.path.join(self._dst, name),
+                     os.path.join(self._dst, PREVIEW_DIRECTORY, name)):
+            if self._store is not None:
+                self._store.add(path, data)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as new:
+                    new.write(data)
+        with self._condition:
+            self._previews.add(name)
+        if self._extract_thread.must_stop():
+            return False
         self._extraction_finished(name)
+        return True
+
+    def _extract_cached_files(self, files):
+        """Take the files in <files> found in the page cache, and mark
+        them as "ready". Return the list of the remaining files."""
+        if self._cache_key is None:
+            return files
+        remaining = []
+        for name in files:
+            try:
+                data = self._cache.get(self._cache_key, name)
+            except Exception as ex:
+                log.warning('! Page cache error: %s', ex)
+                data = None
+            if data is None:
+                remaining.append(name)
+                continue
+            log.debug('Extracting from page cache: "%s"', name)
+            path = os.path.join(self._dst, name)
+            if self._store is not None:
+                self._store.add(path, data)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as new:
+                    new.write(data)
+            if self._extract_thread.must_stop():
+                break
+            self._extraction_finished(name)
+        return remaining
+
+    def _add_to_cache(self, name, data=None):
+        """Add <name> to the page cache, with the content <data>, or
+        read from the destination directory if None. Pages of encrypted
+        archives are not cached, they would be stored in plaintext."""
+        if self._cache_key is None or self._archive.is_encrypted():
+            return
+        try:
+            if data is None:
+                self._cache.add_file(self._cache_key, name,
+                                     os.path.join(self._dst, name))
+            else:
+                self._cache.add(self._cache_key, name, data)
+        except Exception as ex:
+            log.warning('! Page cache error: %s', ex)
 
     def _list_contents(self, archive):
-        files = []
-        for f in archive.iter_contents():
+        files = listing_cache.load(self._src, archive)
+        if files is None:
+            files = []
+            provisional = False
+            for f in archive.iter_contents():
+                if self._list_thread.must_stop():
+                    return
+                files.append(f)
+                if not provisional and \
+                   (PROVISIONAL_LISTING_SIZE <= len(files) or
+                    archive.listing_will_pause()) and \
+                   archive.can_extract_while_listing():
+                    # Big archive (or slow to list, e.g. because of
+                    # sub-archives), let the first pages be extracted
+                    # while listing goes on.
+                    provisional = True
+                    with self._condition:
+                        self._provisional = True
+                    self.contents_listed(self, files[:], provisional=True)
             if self._list_thread.must_stop():
                 return
-            files.append(f)
+            listing_cache.save(self._src, archive, files, mime=self._type)
         with self._condition:
-            self._files = files
+            self._files = {f: n for n, f in enumerate(files)}
             self._contents_listed = True
         self.contents_listed(self, files)
 
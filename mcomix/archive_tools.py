@@ -8,6 +8,7 @@ import tempfile
 
 from mcomix import image_tools
 from mcomix import constants
+from mcomix import listing_cache
 from mcomix import log
 from mcomix.archive import (
     lha_external,
@@ -174,6 +175,13 @@ def get_archive_info(path):
     """Return a tuple (mime, num_pages, size) with info about the archive
     at <path>, or None if <path> doesn't point to a supported
     """
+    size = os.stat(path).st_size
+    info = listing_cache.get_info(path)
+    if info is not None:
+        mime, files = info
+        num_pages = len(list(filter(image_tools.is_image_file, files)))
+        return (mime, num_pages, size)
+
     cleanup = []
     try:
         tmpdir = tempfile.mkdtemp(prefix='mcomix_archive_info.')
@@ -186,8 +194,8 @@ def get_archive_info(path):
         cleanup.append(archive.close)
 
         files = archive.list_contents()
+        listing_cache.save(path, archive, files, mime=mime)
         num_pages = len(list(filter(image_tools.is_image_file, files)))
-        size = os.stat(path).st_size
 
         return (mime, num_pages, size)
     finally:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import traceback
 import weakref
 import threading
@@ -103,6 +104,48 @@ class CallbackList(object):
         else:
             return (None, func)
 
+class BatchCallbackList(CallbackList):
+    """ Same as CallbackList, for functions taking a list as their last
+    argument. Calls made outside of the main thread are not run one by
+    one: they are queued, and merged into one call per main loop
+    iteration for each set of other arguments, with the concatenation of
+    their lists. Keyword arguments are not supported. """
+
+    def __init__(self, obj, function):
+        super(BatchCallbackList, self).__init__(obj, function)
+        self.__lock = threading.Lock()
+        # Map other arguments > list of items waiting to be delivered.
+        self.__pending = collections.OrderedDict()
+        self.__scheduled = False
+
+    def __call__(self, *args):
+        args, items = args[:-1], args[-1]
+        if threading.currentThread().name == 'MainThread':
+            # Deliver queued items first, to keep the order of calls.
+            self.flush()
+            return super(BatchCallbackList, self).__call__(*(args + (items,)))
+        with self.__lock:
+            self.__pending.setdefault(args, []).extend(items)
+            if self.__scheduled:
+                return
+            self.__scheduled = True
+        GObject.idle_add(self.__mainthread_flush)
+
+    def flush(self):
+        """ Deliver the queued calls now. Must be called from the main thread. """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = collections.OrderedDict()
+            self.__scheduled = False
+        for args, items in pending.items():
+            super(BatchCallbackList, self).__call__(*(args + (items,)))
+
+    def __mainthread_flush(self):
+        self.flush()
+
+        # Remove this function from the idle queue
+        return 0
+
 class Callback(object):
     """ Decorator class for using the CallbackList helper. """
 
@@ -117,4 +160,13 @@ class Callback(object):
 
         return CallbackList(obj, self.__function)
 
+class BatchCallback(object):
+    """ Decorator class for using the BatchCallbackList helper. """
+
+    def __init__(self, function):
+        self.__function = function
+
+    def __get__(self, obj, cls):
+        return BatchCallbackList(obj, self.__function)
+
 # vim: expandtab:sw=4:ts=4
@@ -11,12 +11,17 @@ VERSION = '2.0.3-dev0'
 HOME_DIR = tools.get_home_directory()
 CONFIG_DIR = tools.get_config_directory()
 DATA_DIR = tools.get_data_directory()
+CACHE_DIR = tools.get_cache_directory()
 
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 THUMBNAIL_PATH = os.path.join(HOME_DIR, '.thumbnails/normal')
 LIBRARY_DATABASE_PATH = os.path.join(DATA_DIR, 'library.db')
 LASTPAGE_DATABASE_PATH = os.path.join(DATA_DIR, 'lastreadpage.db')
 LIBRARY_COVERS_PATH = os.path.join(DATA_DIR, 'library_covers')
+TAR_INDEX_PATH = os.path.join(CACHE_DIR, 'tar_index')
+LISTING_CACHE_PATH = os.path.join(CACHE_DIR, 'listings')
+PAGE_CACHE_PATH = os.path.join(CACHE_DIR, 'pages')
+PDF_DPI_CACHE_PATH = os.path.join(CACHE_DIR, 'pdf_dpi')
 PREFERENCE_PATH = os.path.join(CONFIG_DIR, 'preferences.conf')
 KEYBINDINGS_CONF_PATH = os.path.join(CONFIG_DIR, 'keybindings.conf')
 
@@ -88,6 +88,8 @@ class _EditArchiveDialog(Gtk.Dialog):
 
         image_files = self._image_area.get_file_listing()
         comment_files = self._comment_area.get_file_listing()
+        # The packer needs the extracted files on disk.
+        self._window.filehandler.page_store.flush_all()
 
         try:
             fd, tmp_path = tempfile.mkstemp(
@@ -209,8 +211,8 @@ class _EditArchiveDialog(Gtk.Dialog):
                     new_positions.append(end_index)
                     end_index -= 1
 
-            self._window.imagehandler._image_files = new_image_array
-            self._window.imagehandler._raw_pixbufs = {}
+            self._window.imagehandler.set_image_files(new_image_array)
+            self._window.imagehandler.pixbuf_cache.clear()
             self._window.imagehandler.do_cacheing()
             self._window.thumbnailsidebar.clear()
             self._window.set_page(1)
@@ -86,6 +86,7 @@ class _ImageArea(Gtk.ScrolledWindow):
         except KeyError:
             # Not a page from the current archive, ignore.
             pass
+        self._window.filehandler.page_store.flush(path)
         pixbuf = self._thumbnailer.thumbnail(path)
         if pixbuf is None:
             pixbuf = image_tools.MISSING_IMAGE_ICON
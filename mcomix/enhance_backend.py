@@ -32,6 +32,11 @@ class ImageEnhancer(object):
 
         return pixbuf
 
+    def get_parameters(self):
+        """Return the enhancement values, as a tuple."""
+        return (self.brightness, self.contrast, self.saturation,
+                self.sharpness, self.autocontrast)
+
     def signal_update(self):
         """Signal to the main window that a change in the enhancement
         values has been made.
@@ -4,7 +4,6 @@
 import os
 import shutil
 import tempfile
-import threading
 import re
 import pickle
 from gi.repository import Gtk
@@ -15,11 +14,15 @@ from mcomix import archive_tools
 from mcomix import image_tools
 from mcomix import tools
 from mcomix import constants
+from mcomix import i18n
 from mcomix import file_provider
+from mcomix import page_cache
+from mcomix import page_store
 from mcomix import callback
 from mcomix import log
 from mcomix import last_read_page
 from mcomix import message_dialog
+from mcomix import worker_thread
 from mcomix.library import backend
 
 
@@ -50,13 +53,26 @@ class FileHandler(object):
         self._tmp_dir = None
         #: If C{True}, no longer wait for files to get extracted.
         self._stop_waiting = False
+        #: If C{True}, the archive is still being listed, and only
+        #: a provisional list of pages is available.
+        self._provisional = False
+        #: If C{True}, the extracted pages went over the disk budget: only
+        #: the files asked for are extracted, see L{forget_files}.
+        self._on_demand_extraction = False
         #: List of comment files inside of the currently opened archive.
         self._comment_files = []
         #: Mapping of absolute paths to archive path names.
         self._name_table = {}
+        #: In-memory store for extracted archive members.
+        self.page_store = page_store.PageStore(
+            prefs['max extraction memory'] * 1024 * 1024)
+        #: Cache of extracted archive members, shared across sessions.
+        self.page_cache = page_cache.PageCache(constants.PAGE_CACHE_PATH,
+            prefs['extraction cache size'] * 1024 * 1024)
         #: Archive extractor.
         self._extractor = archive_extractor.Extractor()
-        self._extractor.file_extracted += self._extracted_file
+        self._extractor.files_extracted += self._extracted_files
+        self._extractor.files_updated += self._updated_files
         self._extractor.contents_listed += self._listed_contents
         #: Condition to wait on when extracting archives and waiting on files.
         self._condition = None
@@ -138,9 +154,15 @@ class FileHandler(object):
         """
 
         self._window.imagehandler._base_path = self._base_path
-        self._window.imagehandler._image_files = image_files
+        self._window.imagehandler.set_image_files(image_files)
         self.file_opened()
 
+        if self.archive_type is not None:
+            # Some files may have been extracted while the
+            # archive was listed, see _listed_provisional_contents.
+            self.file_available([path for path in image_files
+                                 if self.file_is_available(path)])
+
         if not image_files:
             msg = _("No images in '%s'") % os.path.basename(self._current_file)
             self._window.statusbar.set_message(msg)
@@ -211,8 +233,11 @@ class FileHandler(object):
             self._current_file = None
             self._base_path = None
             self._stop_waiting = True
+            self._provisional = False
+            self._on_demand_extraction = False
             self._comment_files = []
             self._name_table.clear()
+            self.page_store.clear()
             self.file_closed()
         # Catch up on UI events, so we don't leave idle callbacks.
         while Gtk.events_pending():
@@ -279,26 +304,30 @@ class FileHandler(object):
         self._tmp_dir = tempfile.mkdtemp(prefix='mcomix.', suffix=os.sep)
         self._base_path = path
         try:
+            self.page_store.set_max_size(
+                prefs['max extraction memory'] * 1024 * 1024)
             self._condition = self._extractor.setup(self._base_path,
                                                 self._tmp_dir,
-                                                self.archive_type)
+                                                self.archive_type,
+                                                store=self.page_store,
+                                                cache=self.page_cache)
         except Exception:
             self._condition = None
             raise
 
-    def _listed_contents(self, archive, files):
+    def _listed_contents(self, archive, files, provisional=False):
 
         if not self.file_loading:
             return
+
+        if provisional:
+            self._listed_provisional_contents(files)
+            return
+
         self.file_loading = False
 
         files = self._extractor.get_files()
-        archive_images = [image for image in files
-            if image_tools.is_image_file(image)
-            # Remove MacOS meta files from image list
-            and not '__MACOSX' in os.path.normpath(image).split(os.sep)]
-
-        self._sort_archive_images(archive_images)
+        archive_images = self._get_archive_images(files)
         image_files = [ os.path.join(self._tmp_dir, f)
                         for f in archive_images ]
 
@@ -312,8 +341,55 @@ class FileHandler(object):
 
         self._extractor.set_files(archive_images + comment_files)
 
+        if self._provisional:
+            # Forget about the provisional page list. Its first page was
+            # picked from a partial listing, so only keep the current page
+            # (found by name) if the user moved away from it.
+            self._provisional = False
+            if self._window.imagehandler.get_current_page() > 1:
+                path = self._window.imagehandler.get_path_to_page()
+                if path in image_files:
+                    self._start_page = image_files.index(path) + 1
+            self._window.imagehandler.cleanup()
+
         self._archive_opened(image_files)
 
+    def _listed_provisional_contents(self, files):
+        """ Called while a big archive is still being listed, with the
+        entries listed so far. If the book is to be opened on its first page,
+        show a provisional page list, so the first page can be extracted and
+        displayed without waiting for the end of the listing. The page list
+        is replaced once the listing is complete, see _listed_contents. """
+
+        if self._start_page not in (0, 1):
+            return
+        if 0 == self._start_page and \
+           self.last_read_page.get_page(self._current_file) is not None:
+            return
+
+        archive_images = self._get_archive_images(files)
+        if not archive_images:
+            return
+        image_files = [ os.path.join(self._tmp_dir, f)
+                        for f in archive_images ]
+
+        self._provisional = True
+        self._name_table = dict(list(zip(image_files, archive_images)))
+        self._window.imagehandler._base_path = self._base_path
+        self._window.imagehandler.set_image_files(image_files)
+        self.file_opened()
+        self._window.set_page(1)
+
+    def _get_archive_images(self, files):
+        """ Return the sorted list of images in the archive
+        members passed in <files>. """
+        archive_images = [image for image in files
+            if image_tools.is_image_file(image)
+            # Remove MacOS meta files from image list
+            and not '__MACOSX' in os.path.normpath(image).split(os.sep)]
+        self._sort_archive_images(archive_images)
+        return archive_images
+
     def _sort_archive_images(self, filelist):
         """ Sorts the image list passed in C{filelist} based on the sorting
         preference option. """
@@ -408,8 +484,8 @@ class FileHandler(object):
         """
         self._wait_on_comment(num)
         try:
-            fd = open(self._comment_files[num - 1], 'r')
-            text = fd.read()
+            fd = self.page_store.open(self._comment_files[num - 1])
+            text = i18n.to_unicode(fd.read())
             fd.close()
         except Exception:
             text = None
@@ -573,6 +649,32 @@ class FileHandler(object):
         else:
             return False
 
+    def get_extracted_size(self):
+        """ Returns the number of bytes used by the files extracted
+        from the current archive. """
+        if self.archive_type is None:
+            return 0
+        return self._extractor.get_extracted_size()
+
+    def forget_files(self, filepaths):
+        """ Deletes the extracted files in C{filepaths} to keep within the
+        disk budget. They will be extracted again when asked for, with
+        L{_ask_for_files} or L{_wait_on_file}; from now on, the extractor
+        only extracts those files instead of the whole archive.
+
+        @return: The list of files deleted. """
+        if self.archive_type is None:
+            return []
+        with self._condition:
+            names = [self._name_table[path] for path in filepaths]
+            forgotten = set(self._extractor.forget(names))
+            if not self._on_demand_extraction:
+                self._on_demand_extraction = True
+                # Stop the extraction of the rest of the archive.
+                self._extractor.set_files([])
+        return [path for path in filepaths
+                if self._name_table[path] in forgotten]
+
     @callback.Callback
     def file_available(self, filepaths):
         """ Called every time a new file from the Filehandler's opened
@@ -580,14 +682,39 @@ class FileHandler(object):
         """
         pass
 
-    def _extracted_file(self, extractor, name):
-        """ Called when the extractor finishes extracting the file at
-        <name>. This name is relative to the temporary directory
+    @callback.Callback
+    def file_updated(self, filepaths):
+        """ Called every time available files are replaced by a better
+        version, e.g. the full resolution render of PDF pages made available
+        with a preview. C{filepaths} is a list of updated files.
+        """
+        pass
+
+    def get_preview_path(self, filepath):
+        """ Returns the path of a low resolution version of C{filepath},
+        for thumbnails, or None if there is none. """
+        if self.archive_type is None or filepath not in self._name_table:
+            return None
+        return self._extractor.get_preview_path(self._name_table[filepath])
+
+    def _updated_files(self, extractor, names):
+        """ Called when the extractor replaces the files at <names>
+        (relative to the extraction directory) by their full version. """
+        if not self.file_loaded:
+            return
+        directory = extractor.get_directory()
+        self.file_updated([os.path.join(directory, name)
+                           for name in names])
+
+    def _extracted_files(self, extractor, names):
+        """ Called when the extractor finishes extracting the files at
+        <names>. These names are relative to the temporary directory
         the files were extracted to. """
         if not self.file_loaded:
             return
-        filepath = os.path.join(extractor.get_directory(), name)
-        self.file_available([filepath])
+        directory = extractor.get_directory()
+        self.file_available([os.path.join(directory, name)
+                             for name in names])
 
     def _wait_on_comment(self, num):
         """Block the running (main) thread until the file corresponding to
@@ -607,6 +734,11 @@ class FileHandler(object):
         try:
             name = self._name_table[path]
             with self._condition:
+                if self._on_demand_extraction and \
+                   not self._extractor.is_ready(name):
+                    # May have been deleted to keep within
+                    # the disk budget, see forget_files.
+                    self._extractor.extract_first([name])
                 while not self._extractor.is_ready(name) and not self._stop_waiting:
                     self._condition.wait()
         except Exception as ex:
@@ -619,23 +751,22 @@ class FileHandler(object):
         if self.archive_type == None:
             return
 
+        names = [self._name_table[path] for path in files]
         with self._condition:
-            extractor_files = self._extractor.get_files()
-            for path in reversed(files):
-                name = self._name_table[path]
-                if not self._extractor.is_ready(name):
-                    extractor_files.remove(name)
-                    extractor_files.insert(0, name)
-            self._extractor.set_files(extractor_files)
+            if self._on_demand_extraction:
+                # Only extract what is needed, see forget_files.
+                self._extractor.set_files(names)
+            else:
+                # Also handles provisional listings,
+                # see _listed_provisional_contents.
+                self._extractor.extract_first(names)
 
     def thread_delete(self, path):
         """Start a threaded removal of the directory tree rooted at <path>.
         This is to avoid long blockings when removing large temporary dirs.
         """
-        del_thread = threading.Thread(target=shutil.rmtree, args=(path, True))
-        del_thread.name += '-delete'
-        del_thread.setDaemon(False)
-        del_thread.start()
+        worker_thread.start_thread(shutil.rmtree, (path, True), name='delete',
+                                   priority=worker_thread.PRIORITY_HOUSEKEEPING)
 
     def write_fileinfo_file(self):
         """Write current open file information."""
@@ -11,6 +11,9 @@ from mcomix import thumbnail_tools
 from mcomix import constants
 from mcomix import callback
 from mcomix import log
+from mcomix import pixbuf_cache
+from mcomix import read_ahead
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
 class ImageHandler(object):
@@ -31,61 +34,189 @@ class ImageHandler(object):
         #: Reference to main window
         self._window = window
 
-        #: Caching thread
+        #: Caching threads, decoding pages in parallel
         self._thread = WorkerThread(self._cache_pixbuf, name='image',
-                                    sort_orders=True)
+                                    max_threads=_get_decode_threads(prefs['max decode threads']),
+                                    sort_orders=True, unique_orders=True,
+                                    order_uid=lambda order: order[1],
+                                    cancellable=True,
+                                    priority=worker_thread.PRIORITY_PREFETCH)
+        #: Pre-rendering thread, see prerender_spreads()
+        self._prerender_thread = WorkerThread(self._prerender_spread,
+                                              name='prerender',
+                                              sort_orders=True,
+                                              cancellable=True,
+                                              priority=worker_thread.PRIORITY_PREFETCH)
 
         #: Archive path, if currently opened file is archive
         self._base_path = None
         #: List of image file names, either from extraction or directory
         self._image_files = None
+        #: Map image file path > page index, see set_image_files()
+        self._image_index = {}
         #: Index of current page
         self._current_image_index = None
         #: Set of images reading for decoding (i.e. already extracted)
         self._available_images = set()
         #: List of pixbufs we want to cache
         self._wanted_pixbufs = []
-        #: Pixbuf map from page > Pixbuf
-        self._raw_pixbufs = {}
-        #: How many pages to keep in cache
+        #: Decoded pages, see get_cache_stats()
+        self.pixbuf_cache = pixbuf_cache.PixbufCache(
+            prefs['max image cache memory'] * 1024 * 1024)
+        #: Display-ready (scaled, transformed) pages, see MainWindow._draw_image
+        self.scaled_cache = pixbuf_cache.ScaledPixbufCache(
+            prefs['max display cache memory'] * 1024 * 1024)
+        #: How much pages can be reduced when decoded, see set_decode_limit()
+        self._decode_limit = None
+        #: How many pages to decode ahead, see read_ahead.ReadAheadPlanner.plan()
         self._cache_pages = prefs['max pages to cache']
+        #: Decides which pages to extract and decode ahead of time
+        self._read_ahead = read_ahead.ReadAheadPlanner()
 
         self._window.filehandler.file_available += self._file_available
+        self._window.filehandler.file_updated += self._file_updated
 
-    def _get_pixbuf(self, index):
+    def _get_pixbuf(self, index, full_size=False):
         """Return the pixbuf indexed by <index> from cache.
-        Pixbufs not found in cache are fetched from disk first.
+        Pixbufs not found in cache are fetched from disk first, at a reduced
+        size if the zoom mode allows it, unless <full_size> is True.
         """
-        pixbuf = image_tools.MISSING_IMAGE_ICON
+        limit = None if full_size else self._decode_limit
+        pixbuf = self.pixbuf_cache.get(index)
+
+        if pixbuf is None:
+            pixbuf = self._decode_pixbuf(index, limit)
+        elif not image_tools.has_enough_resolution(pixbuf, limit):
+            if full_size:
+                pixbuf = self._decode_pixbuf(index, None)
+            else:
+                # Use it meanwhile, and decode it again in the background.
+                self._thread.append_order((-1, index))
 
-        if index not in self._raw_pixbufs:
-            self._wait_on_page(index + 1)
+        return pixbuf
 
-            try:
-                pixbuf = image_tools.load_pixbuf(self._image_files[index])
-                self._raw_pixbufs[index] = pixbuf
-                tools.garbage_collect()
-            except Exception as e:
-                self._raw_pixbufs[index] = image_tools.MISSING_IMAGE_ICON
-                log.error('Could not load pixbuf for page %u: %r', index + 1, e)
-        else:
-            try:
-                pixbuf = self._raw_pixbufs[index]
-            except Exception:
-                pass
+    def _decode_pixbuf(self, index, limit):
+        """Decode the page <index> with the decoding <limit> (see
+        set_decode_limit) and store it in cache."""
+        self._wait_on_page(index + 1)
 
+        path = self._image_files[index]
+        try:
+            pixbuf = self._load_pixbuf(path, limit)
+            self.pixbuf_cache.add(index, pixbuf,
+                                  self._get_memory_size(path, pixbuf))
+            tools.garbage_collect()
+        except Exception as e:
+            pixbuf = image_tools.MISSING_IMAGE_ICON
+            self.pixbuf_cache.add(index, pixbuf,
+                                  image_tools.get_pixbuf_memory_size(pixbuf))
+            log.error('Could not load pixbuf for page %u: %r', index + 1, e)
+
+        return pixbuf
+
+    def _load_pixbuf(self, path, limit=None):
+        """Decode the image file at <path>, straight from memory
+        if the file handler page store holds its content, at the
+        reduced size allowed by the decoding <limit> if any."""
+        max_size = None
+        if limit is not None:
+            image_format, size = self._get_image_info(path)[:2]
+            # Keep animations.
+            if image_format not in ('GIF', 'WEBP') and 0 not in size:
+                max_size = image_tools.get_reduced_size(size, limit)
+                if max_size == tuple(size):
+                    max_size = None
+        data = self._window.filehandler.page_store.get(path)
+        if data is None:
+            pixbuf = image_tools.load_pixbuf(path, max_size)
+        else:
+            pixbuf = image_tools.load_pixbuf_data(data, max_size)
+        if max_size is not None:
+            log.debug('Decoded %s at %ux%u instead of %ux%u', path,
+                      pixbuf.get_width(), pixbuf.get_height(), size[0], size[1])
+            image_tools.set_original_size(pixbuf, size)
         return pixbuf
 
-    def get_pixbufs(self, number_of_bufs):
+    def set_max_decode_threads(self, max_threads):
+        """Set the maximum number of pages decoded in parallel in the
+        background, 0 for the number of CPU cores."""
+        self._thread.set_max_threads(_get_decode_threads(max_threads))
+
+    def set_decode_limit(self, limit):
+        """Set how much pages can be reduced when decoded, as returned by
+        zoom.ZoomModel.get_decode_limit; None to decode them at full size.
+        Pages already decoded at a too small size are decoded again when
+        needed, see page_redecoded."""
+        self._decode_limit = limit
+
+    @callback.Callback
+    def page_redecoded(self, page):
+        """ Called whenever a page decoded at a reduced size has been
+        decoded again at a larger size. """
+        log.debug('Page %u is decoded again', page)
+        self.scaled_cache.discard(page - 1)
+
+    def _get_memory_size(self, path, pixbuf):
+        """Return the number of bytes used by <pixbuf>, decoded from <path>,
+        counting all the frames of animations."""
+        nb_frames = 1
+        if image_tools.is_animation(pixbuf):
+            with self._window.filehandler.page_store.open(path) as fp:
+                nb_frames = image_tools.get_nb_frames(fp)
+        return image_tools.get_pixbuf_memory_size(pixbuf, nb_frames)
+
+    def get_cache_stats(self):
+        """Return the statistics of the decoded pages cache, as a
+        pixbuf_cache.Stats."""
+        return self.pixbuf_cache.get_stats()
+
+    def get_scaled_cache_stats(self):
+        """Return the statistics of the display-ready pages cache, as a
+        pixbuf_cache.Stats."""
+        return self.scaled_cache.get_stats()
+
+    def _get_image_info(self, path):
+        """Same as image_tools.get_image_info, going through the page store."""
+        data = self._window.filehandler.page_store.get(path)
+        if data is None:
+            return image_tools.get_image_info(path)
+        return image_tools.get_image_data_info(data)
+
+    def get_pixbufs(self, number_of_bufs, page=None, full_size=False):
         """Returns number_of_bufs pixbufs for the image(s) that should be
-        currently displayed. This method might fetch images from disk, so make
-        sure that number_of_bufs is as small as possible.
+        currently displayed, or displayed from <page> on. This method might
+        fetch images from disk, so make sure that number_of_bufs is as small
+        as possible. The pixbufs can have been decoded at a reduced size (see
+        image_tools.get_original_size), unless <full_size> is True.
         """
+        if page is None:
+            index = self._current_image_index
+        else:
+            index = page - 1
         result = []
         for i in range(number_of_bufs):
-            result.append(self._get_pixbuf(self._current_image_index + i))
+            result.append(self._get_pixbuf(index + i, full_size))
         return result
 
+    def prerender_spreads(self, viewport_size):
+        """Prepare the display-ready pixbufs of the next and previous spreads
+        for a viewport of <viewport_size> in the background, the spread in the
+        reading direction first (see MainWindow.prerender_spread).
+        """
+        self._prerender_thread.clear_orders()
+        page = self.get_current_page()
+        if not page:
+            return
+        direction = self._read_ahead.get_direction()
+        self._prerender_thread.extend_orders([
+            (0, direction, page, viewport_size),
+            (1, -direction, page, viewport_size),
+        ])
+
+    def _prerender_spread(self, order, token):
+        priority, step, page, viewport_size = order
+        self._window.prerender_spread(page, step, viewport_size, token)
+
     def get_pixbuf_auto_background(self, number_of_bufs): # XXX limited to at most 2 pages
         """ Returns an automatically calculated background color
         for the current page(s). """
@@ -107,10 +238,9 @@ class ImageHandler(object):
 
     def do_cacheing(self):
         """Make sure that the correct pixbufs are stored in cache. These
-        are (in the current implementation) the current image(s), and
-        if cacheing is enabled, also the one or two pixbufs before and
-        after the current page. All other pixbufs are deleted and garbage
-        collected directly in order to save memory.
+        are the current image(s), and if cacheing is enabled, also the pages
+        read ahead around the current page. Other pixbufs are kept as long as
+        they fit in the cache memory budget, see pixbuf_cache.PixbufCache.
         """
         if not self._window.filehandler.file_loaded:
             return
@@ -119,29 +249,36 @@ class ImageHandler(object):
         self._thread.clear_orders()
         # Get list of wanted pixbufs.
         wanted_pixbufs = self._ask_for_pages(self.get_current_page())
-        if -1 != self._cache_pages:
-            # We're not caching everything, remove old pixbufs.
-            for index in set(self._raw_pixbufs) - set(wanted_pixbufs):
-                del self._raw_pixbufs[index]
+        self.pixbuf_cache.set_current(self.get_current_page() - 1, wanted_pixbufs)
         log.debug('Caching page(s) %s', ' '.join([str(index + 1) for index in wanted_pixbufs]))
         self._wanted_pixbufs = wanted_pixbufs
         # Start caching available images not already in cache.
         wanted_pixbufs = [index for index in wanted_pixbufs
-                          if index in self._available_images and not index in self._raw_pixbufs]
+                          if index in self._available_images and not index in self.pixbuf_cache]
         orders = [(priority, index) for priority, index in enumerate(wanted_pixbufs)]
         if len(orders) > 0:
             self._thread.extend_orders(orders)
 
-    def _cache_pixbuf(self, wanted):
+    def _cache_pixbuf(self, wanted, token):
         priority, index = wanted
+        if token.is_cancelled():
+            # No longer wanted.
+            return
         log.debug('Caching page %u', index + 1)
-        self._get_pixbuf(index)
+        limit = self._decode_limit
+        pixbuf = self.pixbuf_cache.get(index)
+        if pixbuf is None:
+            self._decode_pixbuf(index, limit)
+        elif not image_tools.has_enough_resolution(pixbuf, limit):
+            self._decode_pixbuf(index, limit)
+            self.page_redecoded(index + 1)
 
     def set_page(self, page_num):
         """Set up filehandler to the page <page_num>.
         """
         assert 0 < page_num <= self.get_number_of_pages()
         self._current_image_index = page_num - 1
+        self._read_ahead.page_changed(page_num, self._get_page_width())
         self.do_cacheing()
 
     def get_virtual_double_page(self, page=None):
@@ -195,12 +332,23 @@ class ImageHandler(object):
         self.last_wanted = 1
 
         self._thread.stop()
+        self._prerender_thread.stop()
         self._base_path = None
-        self._image_files = []
+        self.set_image_files([])
         self._current_image_index = None
         self._available_images.clear()
-        self._raw_pixbufs.clear()
+        self.pixbuf_cache.clear()
+        self.pixbuf_cache.set_max_size(prefs['max image cache memory'] * 1024 * 1024)
+        self.scaled_cache.set_max_size(prefs['max display cache memory'] * 1024 * 1024)
         self._cache_pages = prefs['max pages to cache']
+        self._read_ahead.reset()
+
+    def set_image_files(self, image_files):
+        """ Set the list of image file paths, one per page. """
+        self._image_files = image_files
+        self._image_index = {path: index
+                             for index, path in enumerate(image_files)}
+        self.scaled_cache.clear()
 
     def page_is_available(self, page=None):
         """ Returns True if <page> is available and calls to get_pixbufs
@@ -236,22 +384,85 @@ class ImageHandler(object):
         if index in self._wanted_pixbufs:
             # In the list of wanted pixbufs.
             priority = self._wanted_pixbufs.index(index)
-        elif -1 == self._cache_pages:
-            # We're caching everything.
+        elif -1 == self._cache_pages and not self.pixbuf_cache.is_full():
+            # We're caching everything that fits.
             priority = self.get_number_of_pages()
         if priority is not None:
             self._thread.append_order((priority, index))
 
     def _file_available(self, filepaths):
         """ Called by the filehandler when a new file becomes available. """
-        # Find the page that corresponds to <filepath>
+        # Find the pages that correspond to <filepaths>
         if not self._image_files:
             return
 
-        available = sorted(filepaths)
-        for i, imgpath in enumerate(self._image_files):
-            if tools.bin_search(available, imgpath) >= 0:
-                self.page_available(i + 1)
+        indexes = {self._image_index.get(path) for path in filepaths}
+        indexes.discard(None)
+        # A file may be announced twice: by the file handler once the
+        # archive is listed, and by a pending files_extracted batch.
+        indexes -= self._available_images
+        for index in sorted(indexes):
+            self.page_available(index + 1)
+
+        self._trim_extracted_pages()
+
+    @callback.Callback
+    def page_updated(self, page):
+        """ Called whenever an available page is replaced by a better
+        version, e.g. the full resolution render of a PDF page. """
+        log.debug('Page %u is updated', page)
+        index = page - 1
+        self.scaled_cache.discard(index)
+        if self.pixbuf_cache.pop(index) is None:
+            return
+        # Decode it again if still wanted.
+        if index in self._wanted_pixbufs:
+            self._thread.append_order((self._wanted_pixbufs.index(index), index))
+
+    def _file_updated(self, filepaths):
+        """ Called by the filehandler when available files are replaced. """
+        indexes = {self._image_index.get(path) for path in filepaths}
+        indexes.discard(None)
+        for index in sorted(indexes):
+            if index in self._available_images:
+                self.page_updated(index + 1)
+
+    def _trim_extracted_pages(self):
+        """ Keep the extracted pages within the disk budget, by deleting
+        the ones farthest from the current page. They are extracted again
+        when needed, see FileHandler.forget_files. """
+        max_size = prefs['max extraction disk usage'] * 1024 * 1024
+        if 0 == max_size or self._current_image_index is None:
+            return
+        filehandler = self._window.filehandler
+        size = filehandler.get_extracted_size()
+        if size <= max_size:
+            return
+        # Never delete the current page(s), nor the ones read ahead.
+        keep = set(self._wanted_pixbufs)
+        if self._read_ahead.last_plan is not None:
+            keep.update(self._read_ahead.last_plan.extract)
+        keep.update((self._current_image_index, self._current_image_index + 1))
+        candidates = sorted(self._available_images - keep,
+                            key=lambda index: abs(index - self._current_image_index),
+                            reverse=True)
+        paths = {}
+        for index in candidates:
+            if size <= max_size:
+                break
+            path = self._image_files[index]
+            try:
+                size -= filehandler.page_store.get_size(path)
+            except OSError:
+                pass
+            paths[path] = index
+        if not paths:
+            return
+        forgotten = filehandler.forget_files(list(paths))
+        log.debug('Deleted extracted page(s) %s',
+                  ' '.join([str(paths[path] + 1) for path in forgotten]))
+        for path in forgotten:
+            self._available_images.discard(paths[path])
 
     def get_number_of_pages(self):
         """Return the number of pages in the current archive/directory."""
@@ -325,15 +536,17 @@ class ImageHandler(object):
         if first_path == None:
             return returnvalue_on_error
 
+        page_store = self._window.filehandler.page_store
+
         if double:
             second_path = self.get_path_to_page(page + 1)
             if second_path != None:
                 try:
-                    first = tools.format_byte_size(os.stat(first_path).st_size)
+                    first = tools.format_byte_size(page_store.get_size(first_path))
                 except OSError:
                     first = ''
                 try:
-                    second = tools.format_byte_size(os.stat(second_path).st_size)
+                    second = tools.format_byte_size(page_store.get_size(second_path))
                 except OSError:
                     second = ''
             else:
@@ -341,7 +554,7 @@ class ImageHandler(object):
             return first, second
 
         try:
-            size = tools.format_byte_size(os.stat(first_path).st_size)
+            size = tools.format_byte_size(page_store.get_size(first_path))
         except OSError:
             size = ''
 
@@ -374,7 +587,7 @@ class ImageHandler(object):
         if page_path is None:
             return (0, 0)
 
-        format, dimensions, providers = image_tools.get_image_info(page_path)
+        format, dimensions, providers = self._get_image_info(page_path)
         return dimensions
 
     def get_mime_name(self, page=None):
@@ -387,7 +600,7 @@ class ImageHandler(object):
         if page_path is None:
             return None
 
-        format, dimensions, providers = image_tools.get_image_info(page_path)
+        format, dimensions, providers = self._get_image_info(page_path)
         return format
 
     def get_thumbnail(self, page=None, width=128, height=128, create=False,
@@ -409,7 +622,16 @@ class ImageHandler(object):
         if path == None:
             return None
 
+        # Low resolution versions are good enough for thumbnails.
+        preview_path = self._window.filehandler.get_preview_path(path)
+        if preview_path is not None:
+            path = preview_path
+
         try:
+            data = self._window.filehandler.page_store.get(path)
+            if data is not None:
+                # No point in storing thumbnails for in-memory pages.
+                return image_tools.load_pixbuf_data_size(data, width, height)
             thumbnailer = thumbnail_tools.Thumbnailer(store_on_disk=create,
                                                       size=(width, height))
             return thumbnailer.thumbnail(path)
@@ -440,42 +662,37 @@ class ImageHandler(object):
         self._window.filehandler._wait_on_file(path)
         return True
 
-    def _ask_for_pages(self, page):
-        """Ask for pages around <page> to be given priority extraction.
-        """
-        files = []
+    def _get_page_width(self):
+        """Return the number of pages shown at once."""
         if prefs['default double page']:
-            page_width = 2
-        else:
-            page_width = 1
-        if 0 == self._cache_pages:
-            # Only ask for current page.
-            num_pages = page_width
-        elif -1 == self._cache_pages:
-            # Ask for 10 pages.
-            num_pages = min(10, self.get_number_of_pages())
-        else:
-            num_pages = self._cache_pages
+            return 2
+        return 1
 
-        page_list = [page - 1 - page_width + n for n in range(num_pages)]
-
-        # Current and next page first, followed by previous page.
-        previous_page = page_list[0:page_width]
-        del page_list[0:page_width]
-        page_list[2*page_width:2*page_width] = previous_page
-        page_list = [index for index in page_list
-                     if index >= 0 and index < len(self._image_files)]
+    def _ask_for_pages(self, page):
+        """Ask for pages around <page> to be given priority extraction,
+        as planned by the read-ahead planner. Return the list of
+        pages to decode, in priority order.
+        """
+        plan = self._read_ahead.plan(page, self.get_number_of_pages(),
+                                    self._get_page_width(), self._cache_pages)
 
         log.debug('Ask for priority extraction around page %u: %s',
-                  page, ' '.join([str(n + 1) for n in page_list]))
-
-        for index in page_list:
-            if index not in self._available_images:
-                files.append(self._image_files[index])
+                  page, ' '.join([str(n + 1) for n in plan.extract]))
 
+        files = [self._image_files[index] for index in plan.extract
+                 if index not in self._available_images]
         if len(files) > 0:
             self._window.filehandler._ask_for_files(files)
 
-        return page_list
+        return plan.decode
+
+def _get_decode_threads(max_threads):
+    """Return the number of decoding threads for the 'max decode threads'
+    preference <max_threads>, 0 standing for the number of CPU cores. The
+    decoders (GdkPixbuf, PIL) release the GIL, and the total number of
+    running threads is kept within the worker thread budget anyway."""
+    if 0 == max_threads:
+        return os.cpu_count() or 1
+    return max_threads
 
 # vim: expandtab:sw=4:ts=4
@@ -1,12 +1,13 @@
 """image_tools.py - Various image manipulations."""
 
+import math
 import operator
 from gi.repository import GLib, GdkPixbuf, Gdk, Gtk
 import PIL
 from PIL import Image
 from PIL import ImageEnhance
 from PIL import ImageOps
-from io import StringIO
+from io import BytesIO
 
 from mcomix.preferences import prefs
 from mcomix import constants
@@ -309,6 +310,62 @@ def static_image(pixbuf):
         return pixbuf.get_static_image()
     return pixbuf
 
+def get_nb_frames(fp):
+    """ Returns the number of frames of the image read from the file
+    object <fp>, 1 if it cannot be found. """
+    try:
+        with Image.open(fp) as im:
+            return max(1, getattr(im, 'n_frames', 1))
+    except Exception:
+        return 1
+
+def get_reduced_size(size, limit):
+    """ Returns the size an image of <size> can be decoded at to be shown
+    with the decoding <limit> (see zoom.ZoomModel.get_decode_limit),
+    never larger than <size>. """
+    if limit is None:
+        return tuple(size)
+    side, shorter = limit
+    width, height = size
+    reference = min(width, height) if shorter else max(width, height)
+    if reference <= side:
+        return tuple(size)
+    scale = side / reference
+    return (max(1, int(math.ceil(width * scale))),
+            max(1, int(math.ceil(height * scale))))
+
+def set_original_size(pixbuf, size):
+    """ Records that <pixbuf> was decoded at a reduced size from an image
+    of <size>. """
+    setattr(pixbuf, 'original_size', tuple(size))
+
+def get_original_size(pixbuf):
+    """ Returns the size of the image <pixbuf> was decoded from. """
+    size = getattr(pixbuf, 'original_size', None)
+    if size is None:
+        return (pixbuf.get_width(), pixbuf.get_height())
+    return size
+
+def has_enough_resolution(pixbuf, limit):
+    """ Returns True if <pixbuf> can be shown with the decoding <limit>
+    without losing details, i.e. if it was decoded at full resolution,
+    or at a reduced size no smaller than what <limit> allows. """
+    size = (pixbuf.get_width(), pixbuf.get_height())
+    original_size = get_original_size(pixbuf)
+    if size == original_size:
+        return True
+    if limit is None:
+        return False
+    # Tolerate rounding errors from the decoders.
+    return all(s + 1 >= r for s, r in zip(size, get_reduced_size(original_size, limit)))
+
+def get_pixbuf_memory_size(pixbuf, nb_frames=1):
+    """ Returns the number of bytes used by the pixels of <pixbuf>,
+    an animation being counted as <nb_frames> frames the size of its
+    static image. """
+    pixbuf = static_image(pixbuf)
+    return pixbuf.get_rowstride() * pixbuf.get_height() * nb_frames
+
 def unwrap_image(image):
     """ Returns an object that contains the image data based on
     Gtk.Image.get_storage_type or None if image is None or image.get_storage_type
@@ -338,31 +395,59 @@ def set_from_pixbuf(image, pixbuf):
     else:
         return image.set_from_pixbuf(pixbuf)
 
-def load_pixbuf(path):
-    """ Loads a pixbuf from a given image file. """
+def _limit_size(loader, image_width, image_height, max_size):
+    """ GdkPixbuf.PixbufLoader 'size-prepared' handler, decoding images
+    larger than <max_size> at a reduced size fitting inside it. """
+    # Work around GdkPixbuf bug: https://bugzilla.gnome.org/show_bug.cgi?id=735422
+    # (currently https://gitlab.gnome.org/GNOME/gdk-pixbuf/issues/45)
+    if 'gif' == loader.get_format().get_name():
+        return
+    if image_width > max_size[0] or image_height > max_size[1]:
+        loader.set_size(*get_fitting_size((image_width, image_height), max_size))
+
+def _load_pixbuf(fp, name, providers, max_size=None, draft=False):
+    """ Loads a pixbuf from the binary file object <fp>, trying each
+    provider of <providers> in turn. <name> is only used for logging.
+
+    If <max_size> is given as a (width, height) tuple, larger images are
+    decoded at a reduced size fitting inside it, keeping their ratio (and
+    losing their animation). If <draft> is True, the decoded image only
+    gets as close to <max_size> as is cheap with PIL, and is not
+    guaranteed to fit inside it. """
     pixbuf = None
     last_error = None
-    providers = get_image_info(path)[2]
     for provider in providers:
+        fp.seek(0)
         try:
             # TODO use dynamic dispatch instead of "if" chain
             if provider == constants.IMAGEIO_GDKPIXBUF:
-                if prefs['animation mode'] != constants.ANIMATION_DISABLED:
-                    try:
-                        pixbuf = GdkPixbuf.PixbufAnimation.new_from_file(path)
-                        if pixbuf.is_static_image():
-                            pixbuf = pixbuf.get_static_image()
-                    except GLib.GError:
-                        # NOTE: Broken JPEGs sometimes result in this exception.
-                        # However, one may be able to load them using
-                        # Gdk.pixbuf_new_from_file, so we need to continue.
-                        pass
+                loader = GdkPixbuf.PixbufLoader()
+                if max_size is not None:
+                    loader.connect('size-prepared', _limit_size, max_size)
+                loader.write(fp.read())
+                try:
+                    loader.close()
+                except GLib.GError:
+                    # NOTE: Broken JPEGs sometimes result in this exception,
+                    # but most of the image may still have been decoded.
+                    if loader.get_pixbuf() is None:
+                        raise
+                if (max_size is None and
+                    prefs['animation mode'] != constants.ANIMATION_DISABLED):
+                    pixbuf = loader.get_animation()
+                    if pixbuf is not None and pixbuf.is_static_image():
+                        pixbuf = pixbuf.get_static_image()
                 if pixbuf is None:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+                    pixbuf = loader.get_pixbuf()
             elif provider == constants.IMAGEIO_PIL:
                 # TODO When using PIL, whether or how animations work is
                 # currently undefined.
-                im = Image.open(path)
+                im = Image.open(fp)
+                if max_size is not None:
+                    if draft:
+                        im.draft(None, max_size)
+                    else:
+                        im.thumbnail(max_size)
                 pixbuf = pil_to_pixbuf(im, keep_orientation=True)
             else:
                 raise TypeError()
@@ -371,87 +456,45 @@ def load_pixbuf(path):
             last_error = e
         if pixbuf is not None:
             # stop loop on success
-            log.debug("provider %s succeeded in loading %s", provider, path)
+            log.debug("provider %s succeeded in loading %s", provider, name)
             break
-        log.debug("provider %s failed to load %s", provider, path)
+        log.debug("provider %s failed to load %s", provider, name)
     if pixbuf is None:
         # raising necessary because caller expects pixbuf to be not None
         raise last_error or TypeError()
     return pixbuf
 
+def load_pixbuf(path, max_size=None):
+    """ Loads a pixbuf from a given image file. If <max_size> is given as a
+    (width, height) tuple, larger images are decoded at a reduced size
+    fitting inside it, keeping their ratio (and losing their animation). """
+    providers = get_image_info(path)[2]
+    with open(path, 'rb') as fp:
+        return _load_pixbuf(fp, path, providers, max_size=max_size)
+
 def load_pixbuf_size(path, width, height):
     """ Loads a pixbuf from a given image file and scale it to fit
     inside (width, height). """
-    # TODO similar to load_pixbuf, should be merged using callbacks etc.
-    pixbuf = None
-    last_error = None
-    image_format, image_dimensions, providers = get_image_info(path)
-    for provider in providers:
-        try:
-            # TODO use dynamic dispatch instead of "if" chain
-            if provider == constants.IMAGEIO_GDKPIXBUF:
-                # If we could not get the image info, still try to load
-                # the image to let GdkPixbuf raise the appropriate exception.
-                if (0, 0) == image_dimensions:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-                # Work around GdkPixbuf bug: https://bugzilla.gnome.org/show_bug.cgi?id=735422
-                # (currently https://gitlab.gnome.org/GNOME/gdk-pixbuf/issues/45)
-                elif 'GIF' == image_format:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-                else:
-                    # Don't upscale if smaller than target dimensions!
-                    image_width, image_height = image_dimensions
-                    if image_width <= width and image_height <= height:
-                        width, height = image_width, image_height
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, width, height)
-            elif provider == constants.IMAGEIO_PIL:
-                im = Image.open(path)
-                im.draft(None, (width, height))
-                pixbuf = pil_to_pixbuf(im, keep_orientation=True)
-            else:
-                raise TypeError()
-        except Exception as e:
-            # current provider could not load image
-            last_error = e
-        if pixbuf is not None:
-            # stop loop on success
-            log.debug("provider %s succeeded in loading %s at size %s", provider, path, (width, height))
-            break
-        log.debug("provider %s failed to load %s at size %s", provider, path, (width, height))
-    if pixbuf is None:
-        # raising necessary because caller expects pixbuf to be not None
-        raise last_error or TypeError()
+    providers = get_image_info(path)[2]
+    with open(path, 'rb') as fp:
+        pixbuf = _load_pixbuf(fp, path, providers,
+                              max_size=(width, height), draft=True)
     return fit_in_rectangle(pixbuf, width, height, GdkPixbuf.InterpType.BILINEAR)
 
-def load_pixbuf_data(imgdata):
-    """ Loads a pixbuf from the data passed in <imgdata>. """
-    # TODO similar to load_pixbuf, should be merged using callbacks etc.
-    pixbuf = None
-    last_error = None
-    for provider in (constants.IMAGEIO_GDKPIXBUF, constants.IMAGEIO_PIL):
-        try:
-            # TODO use dynamic dispatch instead of "if" chain
-            if provider == constants.IMAGEIO_GDKPIXBUF:
-                loader = GdkPixbuf.PixbufLoader()
-                loader.write(imgdata)
-                loader.close()
-                pixbuf = loader.get_pixbuf()
-            elif provider == constants.IMAGEIO_PIL:
-                pixbuf = pil_to_pixbuf(Image.open(StringIO(imgdata)), keep_orientation=True)
-            else:
-                raise TypeError()
-        except Exception as e:
-            # current provider could not load image
-            last_error = e
-        if pixbuf is not None:
-            # stop loop on success
-            log.debug("provider %s succeeded in decoding %s bytes", provider, len(imgdata))
-            break
-        log.debug("provider %s failed to decode %s bytes", provider, len(imgdata))
-    if pixbuf is None:
-        # raising necessary because caller expects pixbuf to be not None
-        raise last_error
-    return pixbuf
+def load_pixbuf_data(imgdata, max_size=None):
+    """ Loads a pixbuf from the data passed in <imgdata>. See load_pixbuf
+    for <max_size>. """
+    return _load_pixbuf(BytesIO(imgdata), '%u bytes' % len(imgdata),
+                        (constants.IMAGEIO_GDKPIXBUF, constants.IMAGEIO_PIL),
+                        max_size=max_size)
+
+def load_pixbuf_data_size(imgdata, width, height):
+    """ Loads a pixbuf from the data passed in <imgdata> and scale it to fit
+    inside (width, height). """
+    pixbuf = _load_pixbuf(BytesIO(imgdata), '%u bytes' % len(imgdata),
+                          (constants.IMAGEIO_GDKPIXBUF, constants.IMAGEIO_PIL),
+                          max_size=(width, height), draft=True)
+    return fit_in_rectangle(pixbuf, width, height, GdkPixbuf.InterpType.BILINEAR)
 
 def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
   sharpness=1.0, autocontrast=False):
@@ -623,6 +666,54 @@ def get_image_info(path):
         image_dimensions = (0, 0)
     return (image_format, image_dimensions, providers)
 
+def _get_pixbuf_data_info(imgdata):
+    """ Same as GdkPixbuf.Pixbuf.get_file_info, for the image data passed
+    in <imgdata>: only the start of the data is decoded if possible. """
+    sizes = []
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', lambda loader, width, height:
+                   sizes.append((width, height)))
+    try:
+        for offset in range(0, len(imgdata), 64 * 1024):
+            loader.write(imgdata[offset:offset + 64 * 1024])
+            if sizes:
+                break
+    except GLib.GError:
+        pass
+    try:
+        loader.close()
+    except GLib.GError:
+        # Not all the data was written.
+        pass
+    image_format = loader.get_format()
+    if image_format is None or not sizes:
+        return None
+    return image_format, sizes[0][0], sizes[0][1]
+
+def get_image_data_info(imgdata):
+    """Same as <get_image_info>, for the image data passed in <imgdata>."""
+    image_format = None
+    image_dimensions = None
+    providers = ()
+    gdk_image_info = _get_pixbuf_data_info(imgdata)
+    if gdk_image_info is not None:
+        image_format = gdk_image_info[0].get_name().upper()
+        image_dimensions = gdk_image_info[1], gdk_image_info[2]
+        providers = (constants.IMAGEIO_GDKPIXBUF, constants.IMAGEIO_PIL)
+    else:
+        try:
+            im = Image.open(BytesIO(imgdata))
+            image_format = im.format
+            image_dimensions = im.size
+            providers = (constants.IMAGEIO_PIL, constants.IMAGEIO_GDKPIXBUF)
+        except IOError:
+            # If the image cannot be opened and identified.
+            pass
+    if image_format is None:
+        image_format = _('Unknown filetype')
+        image_dimensions = (0, 0)
+    return (image_format, image_dimensions, providers)
+
 def get_supported_formats():
     global _SUPPORTED_IMAGE_FORMATS
     if _SUPPORTED_IMAGE_FORMATS is None:
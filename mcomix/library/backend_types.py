@@ -1,11 +1,11 @@
 """ Data class for library books and collections. """
 
 import os
-import threading
 import datetime
 
 from mcomix import callback
 from mcomix import archive_tools
+from mcomix import worker_thread
 
 
 class _BackendObject(object):
@@ -302,9 +302,9 @@ class _WatchList(object):
         """ Begins scanning for new files in the watched directories.
         When the scan finishes, L{new_files_found} will be called
         asynchronously. """
-        thread = threading.Thread(target=self._scan_for_new_files_thread)
-        thread.name += '-scan_for_new_files'
-        thread.start()
+        worker_thread.start_thread(self._scan_for_new_files_thread,
+                                   name='scan_for_new_files',
+                                   priority=worker_thread.PRIORITY_HOUSEKEEPING)
 
     def _scan_for_new_files_thread(self):
         """ Executes the actual scanning operation in a new thread. """
@@ -17,6 +17,7 @@ from mcomix import status
 from mcomix import log
 from mcomix import message_dialog
 from mcomix import tools
+from mcomix import worker_thread
 from mcomix.library.pixbuf_cache import get_pixbuf_cache
 
 _dialog = None
@@ -62,6 +63,7 @@ class _BookArea(Gtk.ScrolledWindow):
             1, # UID
             0, # pixbuf
             5, # status
+            priority=worker_thread.PRIORITY_LIBRARY,
         )
         self._iconview.generate_thumbnail = self._get_pixbuf
         self._iconview.connect('item_activated', self._book_activated)
@@ -439,6 +441,9 @@ class _BookArea(Gtk.ScrolledWindow):
             width, height = self._pixbuf_size(border_size=0)
             try:
                 pixbuf = self._library.backend.get_book_thumbnail(book.path) or image_tools.MISSING_IMAGE_ICON
+            except worker_thread.OrderCancelled:
+                # Scrolled out of view, don't cache a missing icon.
+                raise
             except:
                 pixbuf = image_tools.MISSING_IMAGE_ICON
             pixbuf = image_tools.fit_in_rectangle(pixbuf, width, height, scale_up=True)
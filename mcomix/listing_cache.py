@@ -0,0 +1,97 @@
+"""listing_cache.py - Persistent cache of archive listings."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from mcomix import constants
+from mcomix import log
+
+#: Version of the cache entries, bump on format changes.
+CACHE_VERSION = 1
+#: Maximum number of cached listings, the oldest are removed first.
+MAX_ENTRIES = 1000
+
+
+def load(path, archive):
+    """ Restore the listing of <archive>, the handler for <path>, from the
+    cache. Returns the list of files in the archive, or None if the listing
+    is not in the cache, or is outdated. """
+    entry = _load_entry(path)
+    if entry is None:
+        return None
+    if not archive.set_listing_state(entry['contents'], entry['state']):
+        return None
+    log.debug('Using cached listing for %s', path)
+    return list(entry['contents'])
+
+def save(path, archive, contents, mime=None):
+    """ Save the listing of <archive>, the handler for <path>,
+    <contents> being the list of files in the archive. """
+    state = archive.get_listing_state()
+    if state is None:
+        return
+    try:
+        entry = {
+            'version': CACHE_VERSION,
+            'key': _get_key(path),
+            'mime': mime,
+            'contents': list(contents),
+            'state': state,
+        }
+        cache_path = _get_cache_path(path)
+        os.makedirs(constants.LISTING_CACHE_PATH, exist_ok=True)
+        # Write to a temporary file first, so readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=constants.LISTING_CACHE_PATH)
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        _prune()
+    except Exception as ex:
+        log.warning('! Could not save listing of %s: %s', path, ex)
+
+def get_info(path):
+    """ Return a (mime, contents) tuple for <path> from the cache, or None. """
+    entry = _load_entry(path)
+    if entry is None or entry['mime'] is None:
+        return None
+    return entry['mime'], list(entry['contents'])
+
+def _load_entry(path):
+    cache_path = _get_cache_path(path)
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as fp:
+            entry = pickle.load(fp)
+        if entry['version'] != CACHE_VERSION or entry['key'] != _get_key(path):
+            return None
+        return entry
+    except Exception as ex:
+        log.warning('! Could not load cached listing of %s: %s', path, ex)
+        return None
+
+def _get_key(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+def _get_cache_path(path):
+    path = os.path.abspath(path).encode('utf-8', 'surrogateescape')
+    return os.path.join(constants.LISTING_CACHE_PATH,
+                        hashlib.md5(path).hexdigest() + '.pickle')
+
+def _prune():
+    """ Remove the oldest entries if there are more than MAX_ENTRIES. """
+    entries = [entry for entry in os.scandir(constants.LISTING_CACHE_PATH)
+               if entry.name.endswith('.pickle')]
+    if len(entries) <= MAX_ENTRIES:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - MAX_ENTRIES]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+# vim: expandtab:sw=4:ts=4
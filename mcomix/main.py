@@ -37,6 +37,7 @@ from mcomix.library import backend, main_dialog
 from mcomix import tools
 from mcomix import layout
 from mcomix import log
+from mcomix import worker_thread
 
 
 class MainWindow(Gtk.Window):
@@ -63,9 +64,13 @@ class MainWindow(Gtk.Window):
         # Remember last scroll destination.
         self._last_scroll_destination = constants.SCROLL_TO_START
 
+        worker_thread.set_thread_budget(prefs['max worker threads'])
+
         self.layout = _dummy_layout()
         self._spacing = 2
         self._waiting_for_redraw = False
+        #: Viewport size the next and previous spreads are pre-rendered for.
+        self._prerender_viewport_size = None
 
         self._image_box = Gtk.HBox(False, 2) # XXX transitional(kept for osd.py)
         self._main_layout = Gtk.Layout()
@@ -86,6 +91,8 @@ class MainWindow(Gtk.Window):
         self.filehandler.file_opened += self._on_file_opened
         self.imagehandler = image_handler.ImageHandler(self)
         self.imagehandler.page_available += self._page_available
+        self.imagehandler.page_updated += self._page_updated
+        self.imagehandler.page_redecoded += self._page_updated
         self.thumbnailsidebar = thumbbar.ThumbnailSidebar(self)
 
         self.statusbar = status.Statusbar()
@@ -366,6 +373,155 @@ class MainWindow(Gtk.Window):
                 if should_be_visible != widget.get_visible():
                     (widget.show if should_be_visible else widget.hide)()
 
+    def _get_pages_geometry(self, pixbuf_list):
+        """Return how the pages in <pixbuf_list>, shown at once, are laid
+        out: (size_list, rotation_list, do_not_transform, orientation,
+        distribution_axis, alignment_axis), <size_list> being the sizes of
+        the pages once rotated by the angles in <rotation_list>, and
+        <do_not_transform> telling which pages are shown as is (animations).
+        """
+        distribution_axis = constants.DISTRIBUTION_AXIS
+        alignment_axis = constants.ALIGNMENT_AXIS
+        pixbuf_count = len(pixbuf_list)
+        do_not_transform = [image_tools.is_animation(x) for x in pixbuf_list]
+        # Pages can have been decoded at a reduced size.
+        size_list = [list(image_tools.get_original_size(pixbuf))
+                     for pixbuf in pixbuf_list]
+
+        if self.is_manga_mode:
+            orientation = constants.MANGA_ORIENTATION
+        else:
+            orientation = constants.WESTERN_ORIENTATION
+
+        # Rotation handling:
+        # - apply Exif rotation on individual images
+        # - apply automatic rotation (size based) on whole page
+        # - apply manual rotation on whole page
+        if prefs['auto rotate from exif']:
+            rotation_list = [image_tools.get_implied_rotation(pixbuf)
+                             for pixbuf in pixbuf_list]
+        else:
+            rotation_list = [0] * len(pixbuf_list)
+        virtual_size = [0, 0]
+        for i in range(pixbuf_count):
+            if rotation_list[i] in (90, 270):
+                size_list[i].reverse()
+            size = size_list[i]
+            virtual_size[distribution_axis] += size[distribution_axis]
+            virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
+                                               size[alignment_axis])
+        rotation = self._get_size_rotation(*virtual_size)
+        rotation = (rotation + prefs['rotation']) % 360
+        if rotation in (90, 270):
+            distribution_axis, alignment_axis = alignment_axis, distribution_axis
+            orientation = list(orientation)
+            orientation.reverse()
+            for i in range(pixbuf_count):
+                if do_not_transform[i]:
+                    continue
+                size_list[i].reverse()
+        if rotation in (180, 270):
+            orientation = tools.vector_opposite(orientation)
+        for i in range(pixbuf_count):
+            rotation_list[i] = (rotation_list[i] + rotation) % 360
+        if prefs['vertical flip'] and rotation in (90, 270):
+            orientation = tools.vector_opposite(orientation)
+        if prefs['horizontal flip'] and rotation in (0, 180):
+            orientation = tools.vector_opposite(orientation)
+
+        return (size_list, rotation_list, do_not_transform, orientation,
+                distribution_axis, alignment_axis)
+
+    def _get_scaled_sizes(self, size_list, viewport_size, distribution_axis,
+                          do_not_transform):
+        """Return the sizes of the pages of <size_list>, as returned by
+        _get_pages_geometry, once zoomed to be shown in <viewport_size>."""
+        zoom_dummy_size = list(viewport_size)
+        dasize = zoom_dummy_size[distribution_axis] - \
+            self._spacing * (len(size_list) - 1)
+        if dasize <= 0:
+            dasize = 1
+        zoom_dummy_size[distribution_axis] = dasize
+        prefer_same_size = prefs['double page autoresize'] == constants.DOUBLE_PAGE_AUTORESIZE_SIZE
+        return self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
+            distribution_axis, do_not_transform, prefer_same_size)
+
+    def prerender_spread(self, page, step, viewport_size, token):
+        """Prepare the display-ready pixbufs of the spread shown after
+        flipping <step> pages from <page>, for a viewport of <viewport_size>
+        without scrollbars, so showing it does not have to scale the pages.
+        Called from a background thread, see ImageHandler.prerender_spreads.
+        """
+        number_of_pages = self.imagehandler.get_number_of_pages()
+        new_page = self._get_flipped_page(page, step)
+        if not 1 <= new_page <= number_of_pages or token.is_cancelled():
+            return
+        pixbuf_count = 2 if self.displayed_double(new_page) else 1
+        for n in range(pixbuf_count):
+            if not self.imagehandler.page_is_available(new_page + n):
+                # Done again once available, see _page_available.
+                return
+        if token.is_cancelled():
+            return
+        pixbuf_list = self.imagehandler.get_pixbufs(pixbuf_count, page=new_page)
+        (size_list, rotation_list, do_not_transform, orientation,
+         distribution_axis, alignment_axis) = self._get_pages_geometry(pixbuf_list)
+        scaled_sizes = self._get_scaled_sizes(size_list, viewport_size,
+                                              distribution_axis, do_not_transform)
+        for i in range(pixbuf_count):
+            if do_not_transform[i]:
+                continue
+            token.check()
+            self._get_display_pixbuf(new_page - 1 + i, pixbuf_list[i],
+                                     scaled_sizes[i], rotation_list[i])
+        log.debug('Pre-rendered page(s) %s',
+                  ' '.join([str(new_page + n) for n in range(pixbuf_count)]))
+
+    def _update_decode_limit(self):
+        """Tell the image handler how much pages can be reduced when
+        decoded, for the current zoom and viewport size."""
+        # The viewport size without scrollbars, as used by _draw_image
+        # when the pages fit.
+        viewport_size = list(self.get_visible_area_size())
+        for scrollbar in self._scroll:
+            if scrollbar.get_visible():
+                axis = self._toggle_axis[scrollbar]
+                requisition = scrollbar.size_request()
+                if constants.WIDTH_AXIS == axis:
+                    viewport_size[axis] += requisition.width
+                elif constants.HEIGHT_AXIS == axis:
+                    viewport_size[axis] += requisition.height
+        self.imagehandler.set_decode_limit(self.zoom.get_decode_limit(viewport_size))
+
+    def _get_display_pixbuf(self, index, pixbuf, size, rotation):
+        """Return <pixbuf>, the decoded page <index>, scaled to <size> and
+        rotated by <rotation>, then flipped and enhanced as currently set.
+        The result is kept in the image handler scaled cache, so redrawing
+        the page with the same parameters does not transform it again.
+        """
+        params = (tuple(size), rotation,
+                  prefs['horizontal flip'], prefs['vertical flip'],
+                  prefs['scaling quality'],
+                  prefs['checkered bg for transparent images'],
+                  self.enhancer.get_parameters())
+        cache = self.imagehandler.scaled_cache
+        display_pixbuf = cache.get(index, params)
+        if display_pixbuf is not None:
+            return display_pixbuf
+
+        display_pixbuf = image_tools.fit_pixbuf_to_rectangle(pixbuf, size, rotation)
+        if prefs['horizontal flip']:
+            display_pixbuf = display_pixbuf.flip(horizontal=True)
+        if prefs['vertical flip']:
+            display_pixbuf = display_pixbuf.flip(horizontal=False)
+        display_pixbuf = self.enhancer.enhance(display_pixbuf)
+
+        if display_pixbuf is not pixbuf:
+            # Otherwise, already kept in the decoded pages cache.
+            cache.add(index, params, display_pixbuf,
+                      image_tools.get_pixbuf_memory_size(display_pixbuf))
+        return display_pixbuf
+
     def _draw_image(self, scroll_to):
 
         self._update_toggles_visibility()
@@ -378,57 +534,15 @@ class MainWindow(Gtk.Window):
             return False
 
         if self.imagehandler.page_is_available():
-            distribution_axis = constants.DISTRIBUTION_AXIS
-            alignment_axis = constants.ALIGNMENT_AXIS
+            self._update_decode_limit()
             pixbuf_count = 2 if self.displayed_double() else 1 # XXX limited to at most 2 pages
             pixbuf_list = list(self.imagehandler.get_pixbufs(pixbuf_count))
-            do_not_transform = [image_tools.is_animation(x) for x in pixbuf_list]
-            size_list = [[pixbuf.get_width(), pixbuf.get_height()]
-                         for pixbuf in pixbuf_list]
-
-            if self.is_manga_mode:
-                orientation = constants.MANGA_ORIENTATION
-            else:
-                orientation = constants.WESTERN_ORIENTATION
-
-            # Rotation handling:
-            # - apply Exif rotation on individual images
-            # - apply automatic rotation (size based) on whole page
-            # - apply manual rotation on whole page
-            if prefs['auto rotate from exif']:
-                rotation_list = [image_tools.get_implied_rotation(pixbuf)
-                                 for pixbuf in pixbuf_list]
-            else:
-                rotation_list = [0] * len(pixbuf_list)
-            virtual_size = [0, 0]
-            for i in range(pixbuf_count):
-                if rotation_list[i] in (90, 270):
-                    size_list[i].reverse()
-                size = size_list[i]
-                virtual_size[distribution_axis] += size[distribution_axis]
-                virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
-                                                   size[alignment_axis])
-            rotation = self._get_size_rotation(*virtual_size)
-            rotation = (rotation + prefs['rotation']) % 360
-            if rotation in (90, 270):
-                distribution_axis, alignment_axis = alignment_axis, distribution_axis
-                orientation = list(orientation)
-                orientation.reverse()
-                for i in range(pixbuf_count):
-                    if do_not_transform[i]:
-                        continue
-                    size_list[i].reverse()
-            if rotation in (180, 270):
-                orientation = tools.vector_opposite(orientation)
-            for i in range(pixbuf_count):
-                rotation_list[i] = (rotation_list[i] + rotation) % 360
-            if prefs['vertical flip'] and rotation in (90, 270):
-                orientation = tools.vector_opposite(orientation)
-            if prefs['horizontal flip'] and rotation in (0, 180):
-                orientation = tools.vector_opposite(orientation)
+            (size_list, rotation_list, do_not_transform, orientation,
+             distribution_axis, alignment_axis) = self._get_pages_geometry(pixbuf_list)
 
             viewport_size = () # dummy
-            prefer_same_size = prefs['double page autoresize'] == constants.DOUBLE_PAGE_AUTORESIZE_SIZE
+            # Viewport size without scrollbars.
+            base_viewport_size = None
             expand_area = False
             scrollbar_requests = [False] * len(self._scroll)
             # Visible area size is recomputed depending on scrollbar visibility
@@ -438,14 +552,10 @@ class MainWindow(Gtk.Window):
                 if new_viewport_size == viewport_size:
                     break
                 viewport_size = new_viewport_size
-                zoom_dummy_size = list(viewport_size)
-                dasize = zoom_dummy_size[distribution_axis] - \
-                    self._spacing * (pixbuf_count - 1)
-                if dasize <= 0:
-                    dasize = 1
-                zoom_dummy_size[distribution_axis] = dasize
-                scaled_sizes = self.zoom.get_zoomed_size(size_list, zoom_dummy_size,
-                    distribution_axis, do_not_transform, prefer_same_size)
+                if base_viewport_size is None:
+                    base_viewport_size = viewport_size
+                scaled_sizes = self._get_scaled_sizes(size_list, viewport_size,
+                    distribution_axis, do_not_transform)
                 self.layout = layout.FiniteLayout(scaled_sizes,
                                                   viewport_size,
                                                   orientation,
@@ -460,20 +570,12 @@ class MainWindow(Gtk.Window):
                     expand_area = True
                     viewport_size = () # start anew
 
+            first_index = self.imagehandler.get_current_page() - 1
             for i in range(pixbuf_count):
                 if do_not_transform[i]:
                     continue
-                pixbuf_list[i] = image_tools.fit_pixbuf_to_rectangle(
-                    pixbuf_list[i], scaled_sizes[i], rotation_list[i])
-
-            for i in range(pixbuf_count):
-                if do_not_transform[i]:
-                    continue
-                if prefs['horizontal flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=True)
-                if prefs['vertical flip']:
-                    pixbuf_list[i] = pixbuf_list[i].flip(horizontal=False)
-                pixbuf_list[i] = self.enhancer.enhance(pixbuf_list[i])
+                pixbuf_list[i] = self._get_display_pixbuf(
+                    first_index + i, pixbuf_list[i], scaled_sizes[i], rotation_list[i])
 
             for i in range(pixbuf_count):
                 image_tools.set_from_pixbuf(self.images[i], pixbuf_list[i])
@@ -526,6 +628,9 @@ class MainWindow(Gtk.Window):
                 self.scroll_to_predefined(destination, index)
 
             self._main_layout.get_bin_window().thaw_updates()
+
+            self._prerender_viewport_size = base_viewport_size
+            self.imagehandler.prerender_spreads(base_viewport_size)
         else:
             # Save scroll destination for when the page becomes available.
             self._last_scroll_destination = scroll_to
@@ -594,6 +699,13 @@ class MainWindow(Gtk.Window):
 
         return size_rotation
 
+    def _page_updated(self, page):
+        """ Called whenever a page is replaced by a better version. """
+        current_page = self.imagehandler.get_current_page()
+        nb_pages = 2 if self.displayed_double() else 1
+        if current_page <= page < (current_page + nb_pages):
+            self.draw_image(scroll_to=self._last_scroll_destination)
+
     def _page_available(self, page):
         """ Called whenever a new page is ready for displaying. """
         # Refresh display when currently opened page becomes available.
@@ -602,6 +714,10 @@ class MainWindow(Gtk.Window):
         if current_page <= page < (current_page + nb_pages):
             self.draw_image(scroll_to=self._last_scroll_destination)
             self._update_page_information()
+        elif (self._prerender_viewport_size is not None and
+              abs(page - current_page) <= 2 * nb_pages):
+            # Could be part of the next or previous spread.
+            self.imagehandler.prerender_spreads(self._prerender_viewport_size)
 
         # Use first page as application icon when opening archives.
         if (page == 1
@@ -617,6 +733,7 @@ class MainWindow(Gtk.Window):
         self.statusbar.update()
 
     def _on_file_closed(self):
+        self._prerender_viewport_size = None
         self.clear()
         self.thumbnailsidebar.hide()
         self.thumbnailsidebar.clear()
@@ -691,15 +808,7 @@ class MainWindow(Gtk.Window):
         current_page = self.imagehandler.get_current_page()
         number_of_pages = self.imagehandler.get_number_of_pages()
 
-        new_page = current_page + step
-        if (1 == abs(step) and
-            not single_step and
-            prefs['default double page'] and
-            prefs['double step in double page mode']):
-            if +1 == step and not self.imagehandler.get_virtual_double_page():
-                new_page += 1
-            elif -1 == step and not self.imagehandler.get_virtual_double_page(new_page - 1):
-                new_page -= 1
+        new_page = self._get_flipped_page(current_page, step, single_step)
 
         if new_page <= 0:
             # Only switch to previous page when flipping one page before the
@@ -717,6 +826,20 @@ class MainWindow(Gtk.Window):
         if new_page != current_page:
             self.set_page(new_page, at_bottom=(-1 == step))
 
+    def _get_flipped_page(self, page, step, single_step=False):
+        """Return the page shown after flipping <step> pages from <page>,
+        which may be out of the current book."""
+        new_page = page + step
+        if (1 == abs(step) and
+            not single_step and
+            prefs['default double page'] and
+            prefs['double step in double page mode']):
+            if +1 == step and not self.imagehandler.get_virtual_double_page(page):
+                new_page += 1
+            elif -1 == step and not self.imagehandler.get_virtual_double_page(new_page - 1):
+                new_page -= 1
+        return new_page
+
     def first_page(self):
         number_of_pages = self.imagehandler.get_number_of_pages()
         if number_of_pages:
@@ -932,12 +1055,15 @@ class MainWindow(Gtk.Window):
         self._main_layout.set_size(*self.layout.get_union_box().get_size())
         self.set_bg_colour(prefs['bg colour'])
 
-    def displayed_double(self):
-        """Return True if two pages are currently displayed."""
-        return (self.imagehandler.get_current_page() and
+    def displayed_double(self, page=None):
+        """Return True if two pages are currently displayed, or would be
+        displayed when on <page>."""
+        if page is None:
+            page = self.imagehandler.get_current_page()
+        return (page and
                 prefs['default double page'] and
-                not self.imagehandler.get_virtual_double_page() and
-                self.imagehandler.get_current_page() != self.imagehandler.get_number_of_pages())
+                not self.imagehandler.get_virtual_double_page(page) and
+                page != self.imagehandler.get_number_of_pages())
 
     def get_visible_area_size(self):
         """Return a 2-tuple with the width and height of the visible part
@@ -1048,6 +1174,7 @@ class MainWindow(Gtk.Window):
                 if target:
                     target = i18n.to_unicode(target)
                     try:
+                        self.filehandler.page_store.flush(file_path)
                         shutil.copy2(file_path, target)
                     except Exception as e:
                         log.warning(e)
@@ -79,6 +79,8 @@ class OpenWithCommand(object):
             # Redirect process output to null here?
             # FIXME: Close process when finished to avoid zombie process
             args = self.parse(window)
+            # External programs need the extracted files on disk.
+            window.filehandler.page_store.flush_all()
             if sys.platform == 'win32':
                 proc = process.Win32Popen(args)
             else:
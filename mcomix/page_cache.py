@@ -0,0 +1,150 @@
+"""page_cache.py - Persistent cache of pages extracted from archives."""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+from mcomix import log
+
+class PageCache(object):
+
+    """The PageCache keeps a copy of the members extracted from archives in
+    <directory>, so reopening a book does not need to extract them again.
+
+    Members are identified by the archive identity (path, size, modification
+    time and inode, see get_archive_key()) and their name. The cache is
+    bounded by <max_size> bytes, and least recently used members are removed
+    first. A <max_size> of 0 disables the cache.
+    """
+
+    def __init__(self, directory, max_size):
+        self._directory = directory
+        #: Maximum number of bytes on disk.
+        self._max_size = max_size
+        #: Number of bytes currently on disk.
+        self._size = 0
+        #: Map file name > size, least recently used first. Loaded
+        #: on first use, see _load().
+        self._files = None
+        self._lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Change the disk budget to <max_size> bytes."""
+        with self._lock:
+            self._max_size = max_size
+            if self._files is not None:
+                self._evict()
+
+    def is_enabled(self):
+        return self._max_size > 0
+
+    def get_archive_key(self, path):
+        """Return the identity of the archive at <path>, to be passed to the
+        other methods, or None if the cache is disabled."""
+        if not self.is_enabled():
+            return None
+        stat = os.stat(path)
+        return '%s\0%u\0%f\0%u' % (os.path.abspath(path), stat.st_size,
+                                   stat.st_mtime, stat.st_ino)
+
+    def get(self, archive_key, name):
+        """Return the content of member <name> of the archive
+        identified by <archive_key>, or None if not cached."""
+        if archive_key is None:
+            return None
+        filename = self._get_filename(archive_key, name)
+        with self._lock:
+            self._load()
+            if filename not in self._files:
+                return None
+            self._files.move_to_end(filename)
+        path = os.path.join(self._directory, filename)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            # Used for ordering entries on the next session.
+            os.utime(path)
+        except OSError as ex:
+            log.warning('! Could not read cached page %s: %s', path, ex)
+            with self._lock:
+                self._forget(filename)
+            return None
+        return data
+
+    def add(self, archive_key, name, data):
+        """Store <data> as the content of member <name> of the
+        archive identified by <archive_key>."""
+        if archive_key is None or len(data) > self._max_size:
+            return
+        filename = self._get_filename(archive_key, name)
+        try:
+            # Write to a temporary file first, so readers never see a partial entry.
+            os.makedirs(self._directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, os.path.join(self._directory, filename))
+        except OSError as ex:
+            log.warning('! Could not cache page %s: %s', name, ex)
+            return
+        with self._lock:
+            self._load()
+            self._forget(filename)
+            self._files[filename] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def add_file(self, archive_key, name, path):
+        """Same as add(), with the content read from <path>."""
+        if archive_key is None:
+            return
+        with open(path, 'rb') as fp:
+            self.add(archive_key, name, fp.read())
+
+    def get_size(self):
+        """Return the number of bytes used on disk."""
+        with self._lock:
+            self._load()
+            return self._size
+
+    def _get_filename(self, archive_key, name):
+        key = '%s\0%s' % (archive_key, name)
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _load(self):
+        """Index the files already in the cache directory."""
+        if self._files is not None:
+            return
+        self._files = collections.OrderedDict()
+        self._size = 0
+        if not os.path.isdir(self._directory):
+            return
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith('.tmp'):
+                # Leftover from an interrupted write.
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for mtime, filename, size in sorted(entries):
+            self._files[filename] = size
+            self._size += size
+        self._evict()
+
+    def _forget(self, filename):
+        size = self._files.pop(filename, None)
+        if size is not None:
+            self._size -= size
+
+    def _evict(self):
+        while self._size > self._max_size and self._files:
+            filename, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                os.unlink(os.path.join(self._directory, filename))
+            except OSError:
+                pass
+
+# vim: expandtab:sw=4:ts=4
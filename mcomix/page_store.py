@@ -0,0 +1,123 @@
+"""page_store.py - In-memory store for extracted archive members."""
+
+import collections
+import io
+import os
+import threading
+
+from mcomix import log
+
+class PageStore(object):
+
+    """The PageStore keeps the content of extracted archive members in memory,
+    so they can be fed directly to the image decoders without a round trip
+    through the temporary directory.
+
+    Members are indexed by the path they would have once extracted to disk,
+    so the rest of MComix can keep working with paths. The store is bounded
+    by <max_size> bytes: when it grows beyond that, the least recently used
+    members are written to their path and dropped from memory.
+    """
+
+    def __init__(self, max_size):
+        #: Maximum number of bytes kept in memory.
+        self._max_size = max_size
+        #: Number of bytes currently kept in memory.
+        self._size = 0
+        #: Map path > data, least recently used first.
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Change the memory budget to <max_size> bytes."""
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    def add(self, path, data):
+        """Store <data> as the content of <path>. Return True if the data was
+        kept in memory, False if it was written to disk instead."""
+        with self._lock:
+            if path in self._data:
+                self._size -= len(self._data.pop(path))
+            if len(data) > self._max_size:
+                # Would not fit anyway.
+                self._write(path, data)
+                return False
+            self._data[path] = data
+            self._size += len(data)
+            self._evict()
+            return path in self._data
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._data
+
+    def get(self, path):
+        """Return the content of <path> if it is held in memory, or None."""
+        with self._lock:
+            data = self._data.get(path, None)
+            if data is not None:
+                self._data.move_to_end(path)
+            return data
+
+    def open(self, path):
+        """Return a binary file object for reading <path>, from memory
+        if possible."""
+        data = self.get(path)
+        if data is None:
+            return open(path, 'rb')
+        return io.BytesIO(data)
+
+    def get_size(self, path):
+        """Return the size in bytes of <path>."""
+        data = self.get(path)
+        if data is None:
+            return os.stat(path).st_size
+        return len(data)
+
+    def flush(self, path):
+        """Make sure <path> exists on disk, for callers that need a real file
+        (e.g. external programs). The data is kept in memory too."""
+        # Write under the lock, so it does not race with _evict().
+        with self._lock:
+            data = self._data.get(path, None)
+            if data is not None and not os.path.exists(path):
+                self._write(path, data)
+
+    def flush_all(self):
+        """Same as flush(), for every path in the store."""
+        with self._lock:
+            paths = list(self._data.keys())
+        for path in paths:
+            self.flush(path)
+
+    def remove(self, path):
+        """Drop the in-memory data for <path>, if any."""
+        with self._lock:
+            data = self._data.pop(path, None)
+            if data is not None:
+                self._size -= len(data)
+
+    def clear(self):
+        """Drop all in-memory data."""
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def _evict(self):
+        while self._size > self._max_size and self._data:
+            path, data = self._data.popitem(last=False)
+            self._size -= len(data)
+            log.debug('Page store full, writing %s to disk', path)
+            self._write(path, data)
+
+    @staticmethod
+    def _write(path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+
+# vim: expandtab:sw=4:ts=4
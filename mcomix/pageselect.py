@@ -3,6 +3,7 @@
 from gi.repository import Gtk
 
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 from mcomix import callback
 
@@ -71,7 +72,9 @@ class Pageselector(Gtk.Dialog):
 
         # Currently displayed thumbnail page.
         self._thumbnail_page = 0
-        self._thread = WorkerThread(self._generate_thumbnail, name='preview')
+        self._thread = WorkerThread(self._generate_thumbnail, name='preview',
+                                    cancellable=True,
+                                    priority=worker_thread.PRIORITY_THUMBNAIL)
         self._update_thumbnail(int(self._selector_adjustment.props.value))
         self._window.imagehandler.page_available += self._page_available
 
@@ -114,11 +117,12 @@ class Pageselector(Gtk.Dialog):
         self._thread.clear_orders()
         self._thread.append_order((page, width, height))
 
-    def _generate_thumbnail(self, params):
+    def _generate_thumbnail(self, params, token):
         """ Generate the preview thumbnail for the page selector.
         A transparent image will be used if the page is not yet available. """
         page, width, height = params
 
+        token.check()
         pixbuf = self._window.imagehandler.get_thumbnail(page,
             width=width, height=height, nowait=True)
         self._thumbnail_finished(page, pixbuf)
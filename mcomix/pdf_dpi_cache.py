@@ -0,0 +1,75 @@
+"""pdf_dpi_cache.py - Persistent cache of the rendering DPI of PDF pages."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from mcomix import constants
+from mcomix import log
+
+#: Version of the cache entries, bump on format changes.
+CACHE_VERSION = 1
+#: Maximum number of cached documents, the oldest are removed first.
+MAX_ENTRIES = 1000
+
+
+def load(path):
+    """ Return the map page number > DPI cached for the PDF document at
+    <path>, empty if the document is not in the cache, or has changed. """
+    cache_path = _get_cache_path(path)
+    if not os.path.isfile(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'rb') as fp:
+            entry = pickle.load(fp)
+        if entry['version'] != CACHE_VERSION or entry['key'] != _get_key(path):
+            return {}
+        log.debug('Using cached rendering DPI for %s', path)
+        return dict(entry['dpis'])
+    except Exception as ex:
+        log.warning('! Could not load cached rendering DPI of %s: %s', path, ex)
+        return {}
+
+def save(path, dpis):
+    """ Save <dpis>, the map page number > DPI of the PDF document at <path>. """
+    try:
+        entry = {
+            'version': CACHE_VERSION,
+            'key': _get_key(path),
+            'dpis': dict(dpis),
+        }
+        cache_path = _get_cache_path(path)
+        os.makedirs(constants.PDF_DPI_CACHE_PATH, exist_ok=True)
+        # Write to a temporary file first, so readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=constants.PDF_DPI_CACHE_PATH)
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        _prune()
+    except Exception as ex:
+        log.warning('! Could not save rendering DPI of %s: %s', path, ex)
+
+def _get_key(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+def _get_cache_path(path):
+    path = os.path.abspath(path).encode('utf-8', 'surrogateescape')
+    return os.path.join(constants.PDF_DPI_CACHE_PATH,
+                        hashlib.md5(path).hexdigest() + '.pickle')
+
+def _prune():
+    """ Remove the oldest entries if there are more than MAX_ENTRIES. """
+    entries = [entry for entry in os.scandir(constants.PDF_DPI_CACHE_PATH)
+               if entry.name.endswith('.pickle')]
+    if len(entries) <= MAX_ENTRIES:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - MAX_ENTRIES]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,228 @@
+"""pixbuf_cache.py - Memory-bounded caches for decoded and display-ready pages."""
+
+import collections
+import threading
+
+#: Cache statistics, see PixbufCache.get_stats().
+Stats = collections.namedtuple('Stats',
+                               'size max_size count hits misses evictions')
+
+#: When choosing the pixbufs to evict, being one page farther from the
+#: current page counts as much as DISTANCE_WEIGHT accesses to other
+#: pages since the pixbuf was last used.
+DISTANCE_WEIGHT = 4
+
+class PixbufCache(object):
+
+    """The PixbufCache keeps decoded pages in memory, indexed by page index.
+
+    The cache is bounded by <max_size> bytes, as reported by the caller for
+    each pixbuf (see image_tools.get_pixbuf_memory_size). When it grows
+    beyond that, pixbufs are evicted least recently used first, pages far
+    from the current page going first. The pages that are wanted (see
+    set_current()) are never evicted, so the budget can be exceeded when
+    they do not fit in it.
+    """
+
+    def __init__(self, max_size):
+        #: Maximum number of bytes kept in memory.
+        self._max_size = max_size
+        #: Number of bytes currently kept in memory.
+        self._size = 0
+        #: Map page index > [pixbuf, size, time of last use].
+        self._entries = {}
+        #: Incremented on each use, to order them.
+        self._clock = 0
+        #: Index of the current page.
+        self._current = 0
+        #: Indexes of the pages that must not be evicted.
+        self._wanted = frozenset()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Change the memory budget to <max_size> bytes."""
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    def set_current(self, index, wanted=()):
+        """Set the current page <index>, and the indexes of the <wanted>
+        pages, which are kept whatever the budget."""
+        with self._lock:
+            self._current = index
+            self._wanted = frozenset(wanted)
+            self._evict()
+
+    def add(self, index, pixbuf, size):
+        """Store <pixbuf>, using <size> bytes, for page <index>. Return True
+        if it was kept, False if it would not fit in the budget."""
+        with self._lock:
+            self._remove(index)
+            if size > self._max_size and index not in self._wanted:
+                return False
+            self._clock += 1
+            self._entries[index] = [pixbuf, size, self._clock]
+            self._size += size
+            self._evict()
+            return index in self._entries
+
+    def get(self, index):
+        """Return the pixbuf of page <index>, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(index, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._clock += 1
+            entry[2] = self._clock
+            return entry[0]
+
+    def __contains__(self, index):
+        with self._lock:
+            return index in self._entries
+
+    def pop(self, index):
+        """Remove page <index>, returning its pixbuf, or None if it was not
+        cached."""
+        with self._lock:
+            return self._remove(index)
+
+    def clear(self):
+        """Remove all pixbufs."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._wanted = frozenset()
+
+    def is_full(self):
+        """Return True if no more pixbufs fit in the budget."""
+        with self._lock:
+            return self._size >= self._max_size
+
+    def get_size(self):
+        """Return the number of bytes used by the cached pixbufs."""
+        with self._lock:
+            return self._size
+
+    def get_stats(self):
+        """Return the cache Stats: memory used and budget (in bytes), number
+        of pixbufs cached, and number of hits, misses and evictions since the
+        cache was created."""
+        with self._lock:
+            return Stats(self._size, self._max_size, len(self._entries),
+                         self._hits, self._misses, self._evictions)
+
+    def _remove(self, index):
+        entry = self._entries.pop(index, None)
+        if entry is None:
+            return None
+        self._size -= entry[1]
+        return entry[0]
+
+    def _evict(self):
+        if self._size <= self._max_size:
+            return
+        candidates = [index for index in self._entries
+                      if index not in self._wanted]
+        # Most expendable last.
+        candidates.sort(key=lambda index: self._clock - self._entries[index][2] +
+                        DISTANCE_WEIGHT * abs(index - self._current))
+        while self._size > self._max_size and candidates:
+            self._remove(candidates.pop())
+            self._evictions += 1
+
+class ScaledPixbufCache(object):
+
+    """The ScaledPixbufCache keeps display-ready versions of decoded pages
+    (scaled, rotated, flipped and enhanced), so redrawing a page with the
+    same parameters does not transform it again.
+
+    Pixbufs are indexed by page index and by a tuple of drawing parameters,
+    and the cache is bounded by <max_size> bytes: when it grows beyond that,
+    the least recently used pixbufs are dropped.
+    """
+
+    def __init__(self, max_size):
+        #: Maximum number of bytes kept in memory.
+        self._max_size = max_size
+        #: Number of bytes currently kept in memory.
+        self._size = 0
+        #: Map (page index, parameters) > (pixbuf, size),
+        #: least recently used first.
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def set_max_size(self, max_size):
+        """Change the memory budget to <max_size> bytes."""
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    def add(self, index, params, pixbuf, size):
+        """Store <pixbuf>, using <size> bytes, as page <index> drawn with
+        <params>. Return True if it was kept."""
+        key = (index, params)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+            if size > self._max_size:
+                return False
+            self._entries[key] = (pixbuf, size)
+            self._size += size
+            self._evict()
+            return key in self._entries
+
+    def get(self, index, params):
+        """Return page <index> drawn with <params>, or None if it is not
+        cached."""
+        key = (index, params)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def discard(self, index):
+        """Remove all the versions of page <index>."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == index]:
+                self._size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """Remove all pixbufs."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_size(self):
+        """Return the number of bytes used by the cached pixbufs."""
+        with self._lock:
+            return self._size
+
+    def get_stats(self):
+        """Return the cache Stats, see PixbufCache.get_stats()."""
+        with self._lock:
+            return Stats(self._size, self._max_size, len(self._entries),
+                         self._hits, self._misses, self._evictions)
+
+    def _evict(self):
+        while self._size > self._max_size and self._entries:
+            self._size -= self._entries.popitem(last=False)[1][1]
+            self._evictions += 1
+
+# vim: expandtab:sw=4:ts=4
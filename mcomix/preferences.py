@@ -80,6 +80,8 @@ prefs = {
     'sharpness': 1.0,
     'auto contrast': False,
     'max pages to cache': 7,
+    'max image cache memory': 512,  # MiB
+    'max display cache memory': 128,  # MiB
     'window x': 0,
     'window y': 0,
     'window height': 600,
@@ -96,7 +98,12 @@ prefs = {
     'statusbar fields': constants.STATUS_PAGE | constants.STATUS_RESOLUTION | \
                         constants.STATUS_PATH | constants.STATUS_FILENAME | constants.STATUS_FILESIZE,
     'max threads': 3,
+    'max worker threads': 0,  # 0 for the number of CPU cores
+    'max decode threads': 0,  # 0 for the number of CPU cores
     'max extract threads': 1,
+    'max extraction memory': 256,  # MiB
+    'extraction cache size': 0,  # MiB, 0 to disable
+    'max extraction disk usage': 0,  # MiB, 0 for no limit
     'wrap mouse scroll': False,
     'scaling quality': 2,  # GdkPixbuf.InterpType.BILINEAR
     'escape quits': False,
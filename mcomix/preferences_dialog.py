@@ -12,6 +12,7 @@ from mcomix import constants
 from mcomix import message_dialog
 from mcomix import keybindings
 from mcomix import keybindings_editor
+from mcomix import worker_thread
 
 _dialog = None
 
@@ -280,11 +281,36 @@ class _PreferencesDialog(Gtk.Dialog):
 
         page.new_section(_('Extraction and cache'))
 
+        page.add_row(Gtk.Label(label=_('Maximum number of worker threads:')),
+            self._create_pref_spinner('max worker threads',
+            1, 0, 64, 1, 4, 0,
+            _('Set the maximum number of background tasks (extraction, decoding, thumbnails...) running at the same time. The page being shown has priority over other tasks. Set to 0 to use the number of processor cores.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum number of concurrent decoding threads:')),
+            self._create_pref_spinner('max decode threads',
+            1, 0, 64, 1, 4, 0,
+            _('Set the maximum number of pages decoded at the same time in the background, the pages to be shown next first. Set to 0 to use the number of processor cores.')))
+
         page.add_row(Gtk.Label(label=_('Maximum number of concurrent extraction threads:')),
             self._create_pref_spinner('max extract threads',
             1, 1, 16, 1, 4, 0,
             _('Set the maximum number of concurrent threads for formats that support it.')))
 
+        page.add_row(Gtk.Label(label=_('Memory for extracted files (in MiB):')),
+            self._create_pref_spinner('max extraction memory',
+            1, 0, 4096, 16, 64, 0,
+            _('Set how much memory can be used to hold pages extracted from archives that support it (ZIP). Pages beyond this limit are written to the temporary directory.')))
+
+        page.add_row(Gtk.Label(label=_('Disk cache for extracted files (in MiB):')),
+            self._create_pref_spinner('extraction cache size',
+            1, 0, 65536, 64, 256, 0,
+            _('Keep a copy of the pages extracted from archives, so books can be reopened without extracting them again. Set to 0 to disable the cache.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum size of extracted files (in MiB):')),
+            self._create_pref_spinner('max extraction disk usage',
+            1, 0, 65536, 64, 256, 0,
+            _('Limit the space used by the pages extracted from an archive. Beyond this limit, the pages farthest from the current page are deleted, and extracted again when needed. Set to 0 to extract whole archives.')))
+
         page.add_row(self._create_pref_check_button(
             _('Store thumbnails for opened files'),
             'create thumbnails',
@@ -295,6 +321,16 @@ class _PreferencesDialog(Gtk.Dialog):
             1, -1, 500, 1, 3, 0,
             _('Set the max number of pages to cache. A value of -1 will cache the entire archive.')))
 
+        page.add_row(Gtk.Label(label=_('Memory for cached pages (in MiB):')),
+            self._create_pref_spinner('max image cache memory',
+            1, 16, 16384, 16, 64, 0,
+            _('Set how much memory can be used to keep decoded pages. When the limit is reached, the pages least recently shown and farthest from the current page are dropped first.')))
+
+        page.add_row(Gtk.Label(label=_('Memory for scaled pages (in MiB):')),
+            self._create_pref_spinner('max display cache memory',
+            1, 0, 4096, 16, 64, 0,
+            _('Set how much memory can be used to keep pages as shown on screen (scaled, rotated and enhanced), so they can be shown again without being transformed. Set to 0 to disable.')))
+
         page.new_section(_('Magnifying Lens'))
 
         page.add_row(Gtk.Label(label=_('Magnifying lens size (in pixels):')),
@@ -874,6 +910,16 @@ class _PreferencesDialog(Gtk.Dialog):
             prefs[preference] = int(value)
             self._window.imagehandler.do_cacheing()
 
+        elif preference == 'max image cache memory':
+            prefs[preference] = int(value)
+            self._window.imagehandler.pixbuf_cache.set_max_size(
+                prefs[preference] * 1024 * 1024)
+
+        elif preference == 'max display cache memory':
+            prefs[preference] = int(value)
+            self._window.imagehandler.scaled_cache.set_max_size(
+                prefs[preference] * 1024 * 1024)
+
         elif preference == 'number of key presses before page turn':
             prefs['number of key presses before page turn'] = int(value)
             self._window._event_handler._extra_scroll_events = 0
@@ -882,8 +928,26 @@ class _PreferencesDialog(Gtk.Dialog):
             prefs[preference] = int(value)
             self._window.change_zoom_mode()
 
-        elif preference == 'max extract threads':
+        elif preference in ('max extract threads', 'max extraction disk usage'):
+            prefs[preference] = int(value)
+
+        elif preference == 'max worker threads':
+            prefs[preference] = int(value)
+            worker_thread.set_thread_budget(prefs[preference])
+
+        elif preference == 'max decode threads':
+            prefs[preference] = int(value)
+            self._window.imagehandler.set_max_decode_threads(prefs[preference])
+
+        elif preference == 'max extraction memory':
+            prefs[preference] = int(value)
+            self._window.filehandler.page_store.set_max_size(
+                prefs[preference] * 1024 * 1024)
+
+        elif preference == 'extraction cache size':
             prefs[preference] = int(value)
+            self._window.filehandler.page_cache.set_max_size(
+                prefs[preference] * 1024 * 1024)
 
 
     def _entry_cb(self, entry, event=None):
@@ -44,6 +44,22 @@ def popen(args, stdin=NULL, stdout=PIPE, stderr=NULL):
                             creationflags=_get_creationflags())
 
 
+def run(args, stdout=NULL, token=None, poll_interval=0.1):
+    """ Run <args> to completion, and return its output if <stdout> is PIPE.
+    If <token> (a worker_thread.OrderToken) is cancelled in the meantime,
+    the process is killed, and worker_thread.OrderCancelled raised. """
+    proc = popen(args, stdout=stdout)
+    while True:
+        try:
+            return proc.communicate(timeout=poll_interval)[0]
+        except subprocess.TimeoutExpired:
+            if token is not None and token.is_cancelled():
+                break
+    proc.kill()
+    proc.communicate()
+    token.check()
+
+
 if 'win32' == sys.platform:
     _exe_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
 
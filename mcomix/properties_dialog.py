@@ -91,6 +91,7 @@ class _PropertiesDialog(Gtk.Dialog):
             return
         self._update_page_image(page)
         path = window.imagehandler.get_path_to_page()
+        window.filehandler.page_store.flush(path)
         filename = os.path.basename(path)
         page.set_filename(filename)
         width, height = window.imagehandler.get_size()
@@ -0,0 +1,138 @@
+"""read_ahead.py - Read-ahead planning for page extraction and decoding."""
+
+import collections
+import math
+import time
+
+#: Number of recent page flips used to estimate the flipping speed.
+HISTORY_SIZE = 8
+#: Page flips older than this (in seconds) are ignored.
+HISTORY_DURATION = 5.0
+#: Reading time (in seconds) covered by the extra decoding window.
+DECODE_AHEAD_TIME = 1.0
+#: Reading time (in seconds) covered by the extra extraction window.
+EXTRACT_AHEAD_TIME = 4.0
+#: Maximum number of pages added to the extraction window.
+MAX_EXTRA_PAGES = 32
+
+#: A read-ahead plan: <decode> and <extract> are lists of page indexes,
+#: in priority order, the pages in <decode> being also in <extract>.
+Plan = collections.namedtuple('Plan', 'page direction speed decode extract')
+
+class ReadAheadPlanner(object):
+
+    """The ReadAheadPlanner decides which pages should be extracted and
+    decoded ahead of time, from the way the book is being read.
+
+    It tracks the reading direction and the flipping speed (see
+    page_changed()). The pages wanted next (after the current one(s) when
+    reading forward, before them when reading backward) come first, and
+    the window is widened in the reading direction when flipping fast:
+    a little for decoding, more for extraction, which is cheaper to keep
+    around.
+
+    Pages are numbered from 1, page indexes from 0.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget about the book being read."""
+        #: Last page seen by page_changed().
+        self._page = None
+        #: 1 when reading forward, -1 when reading backward.
+        self._direction = 1
+        #: Time of the recent page flips.
+        self._flips = collections.deque(maxlen=HISTORY_SIZE)
+        #: Last plan returned by plan().
+        self.last_plan = None
+
+    def get_direction(self):
+        """Return 1 when reading forward, -1 when reading backward."""
+        return self._direction
+
+    def get_speed(self, now=None):
+        """Return the flipping speed, in page flips per second."""
+        if now is None:
+            now = time.monotonic()
+        flips = [flip for flip in self._flips
+                 if now - flip <= HISTORY_DURATION]
+        if len(flips) < 2 or now <= flips[0]:
+            return 0.0
+        # Decays once the reader stops flipping.
+        return (len(flips) - 1) / (now - flips[0])
+
+    def page_changed(self, page, page_width, now=None):
+        """Record that <page> is now the current page, <page_width> being
+        the number of pages shown at once (2 in double page mode)."""
+        if now is None:
+            now = time.monotonic()
+        if self._page is not None and page != self._page:
+            delta = page - self._page
+            if abs(delta) > page_width:
+                # Jump to another part of the book: it
+                # does not tell anything about reading.
+                self._flips.clear()
+            else:
+                direction = 1 if delta > 0 else -1
+                if direction != self._direction:
+                    self._flips.clear()
+                    self._direction = direction
+                self._flips.append(now)
+        self._page = page
+
+    def plan(self, page, nb_pages, page_width, cache_pages, now=None):
+        """Return the Plan for <page>, in a book of <nb_pages> pages shown
+        <page_width> at a time. <cache_pages> is the size of the decoding
+        window when not flipping: 0 for the current page(s) only, -1 for
+        all the pages (the window is then limited to 10 pages, as other
+        pages are decoded when extracted anyway).
+        """
+        speed = self.get_speed(now)
+        if 0 == cache_pages:
+            size = page_width
+            decode_extra = extract_extra = 0
+        else:
+            if -1 == cache_pages:
+                size = min(10, nb_pages)
+            else:
+                size = max(cache_pages, page_width)
+            decode_extra = min(self._get_extra_pages(speed, page_width,
+                                                     DECODE_AHEAD_TIME), size)
+            extract_extra = min(self._get_extra_pages(speed, page_width,
+                                                      EXTRACT_AHEAD_TIME),
+                                MAX_EXTRA_PAGES)
+
+        # Pages in the reading direction, and in the opposite direction.
+        behind = min(page_width, size - page_width)
+        ahead = size - page_width - behind + decode_extra
+        current = page - 1
+        current_pages = [current + n for n in range(page_width)]
+        if 1 == self._direction:
+            forward = [current + page_width + n
+                       for n in range(ahead + extract_extra)]
+            backward = [current - 1 - n for n in range(behind)]
+        else:
+            forward = [current - 1 - n
+                       for n in range(ahead + extract_extra)]
+            backward = [current + page_width + n for n in range(behind)]
+
+        # Current page(s) first, then the next 2 spreads, then
+        # the previous spread, then the rest of the window.
+        next_spreads = min(2 * page_width, ahead)
+        decode = current_pages + forward[:next_spreads] + backward + \
+            forward[next_spreads:ahead]
+        decode = [index for index in decode if 0 <= index < nb_pages]
+        extract = decode + [index for index in forward[ahead:]
+                            if 0 <= index < nb_pages]
+
+        self.last_plan = Plan(page, self._direction, speed, decode, extract)
+        return self.last_plan
+
+    @staticmethod
+    def _get_extra_pages(speed, page_width, duration):
+        """Return the number of pages flipped in <duration> seconds."""
+        return int(math.ceil(speed * duration)) * page_width
+
+# vim: expandtab:sw=4:ts=4
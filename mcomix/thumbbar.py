@@ -230,6 +230,7 @@ class ThumbnailSidebar(Gtk.ScrolledWindow):
 
         selected = self._get_selected_row()
         path = self._window.imagehandler.get_path_to_page(selected + 1)
+        self._window.filehandler.page_store.flush(path)
         uri = 'file://localhost' + urllib.request.pathname2url(path)
         selection.set_uris([uri])
 
@@ -7,7 +7,6 @@ import re
 import shutil
 import tempfile
 import mimetypes
-import threading
 import itertools
 import traceback
 import locale
@@ -29,6 +28,7 @@ from mcomix import portability
 from mcomix import i18n
 from mcomix import callback
 from mcomix import log
+from mcomix import worker_thread
 
 
 class Thumbnailer(object):
@@ -92,10 +92,10 @@ class Thumbnailer(object):
 
         else:
             if threaded:
-                thread = threading.Thread(target=self._create_thumbnail, args=(filepath,))
-                thread.name += '-thumbnailer'
-                thread.setDaemon(True)
-                thread.start()
+                worker_thread.start_thread(self._create_thumbnail, (filepath,),
+                                           name='thumbnailer',
+                                           priority=worker_thread.PRIORITY_THUMBNAIL,
+                                           daemon=True)
                 return None
             else:
                 return self._create_thumbnail(filepath)
@@ -120,7 +120,12 @@ class Thumbnailer(object):
 
     def _create_thumbnail_pixbuf(self, filepath):
         """ Creates a thumbnail pixbuf from <filepath>, and returns it as a
-        tuple along with a file metadata dictionary: (pixbuf, tEXt_data) """
+        tuple along with a file metadata dictionary: (pixbuf, tEXt_data)
+
+        Raises worker_thread.OrderCancelled if run by a worker thread
+        and the corresponding order has been cancelled. """
+
+        token = worker_thread.get_current_token()
 
         if self.archive_support:
             mime = archive_tools.archive_mime_type(filepath)
@@ -142,7 +147,14 @@ class Thumbnailer(object):
                 if wanted is None:
                     return None, None
 
-                archive.extract(wanted, tmpdir)
+                token.check()
+                if archive.support_preview:
+                    # Low resolution is good enough, and faster.
+                    with open(os.path.join(tmpdir, wanted), 'wb') as fp:
+                        fp.write(archive.read_preview(wanted))
+                else:
+                    archive.extract(wanted, tmpdir)
+                token.check()
 
                 image_path = os.path.join(tmpdir, wanted)
                 if not os.path.isfile(image_path):
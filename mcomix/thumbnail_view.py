@@ -5,6 +5,7 @@ from gi.repository import Gtk
 from gi.repository import GObject
 
 from mcomix.preferences import prefs
+from mcomix import worker_thread
 from mcomix.worker_thread import WorkerThread
 
 
@@ -13,12 +14,15 @@ class ThumbnailViewBase(object):
     Gtk.IconView. Instantiating this class directly is *impossible*,
     as it depends on methods provided by the view classes. """
 
-    def __init__(self, uid_column, pixbuf_column, status_column):
+    def __init__(self, uid_column, pixbuf_column, status_column,
+                 priority=worker_thread.PRIORITY_THUMBNAIL):
         """ Constructs a new ThumbnailView.
         @param uid_column: index of unique identifer column.
         @param pixbuf_column: index of pixbuf column.
         @param status_column: index of status boolean column
                               (True if pixbuf is not temporary filler)
+        @param priority: priority class of the thumbnails generation,
+                         see L{worker_thread.set_thread_budget}.
         """
 
         #: Keep track of already generated thumbnails.
@@ -32,7 +36,9 @@ class ThumbnailViewBase(object):
         self._thread = WorkerThread(self._pixbuf_worker,
                                     name='thumbview',
                                     unique_orders=True,
-                                    max_threads=prefs["max threads"])
+                                    max_threads=prefs["max threads"],
+                                    cancellable=True,
+                                    priority=priority)
 
     def generate_thumbnail(self, uid):
         """ This function must return the thumbnail for C{uid}. """
@@ -83,9 +89,11 @@ class ThumbnailViewBase(object):
                 self._updates_stopped = False
                 self._thread.extend_orders(pixbufs_needed)
 
-    def _pixbuf_worker(self, order):
-        """ Run by a worker thread to generate the thumbnail for a path."""
+    def _pixbuf_worker(self, order, token):
+        """ Run by a worker thread to generate the thumbnail for a path.
+        Generation is cancelled when the icon is scrolled out of view. """
         uid, iter = order
+        token.check()
         pixbuf = self.generate_thumbnail(uid)
         if pixbuf is not None:
             GObject.idle_add(self._pixbuf_finished, iter, pixbuf)
@@ -105,10 +113,12 @@ class ThumbnailViewBase(object):
         return 0
 
 class ThumbnailIconView(Gtk.IconView, ThumbnailViewBase):
-    def __init__(self, model, uid_column, pixbuf_column, status_column):
+    def __init__(self, model, uid_column, pixbuf_column, status_column,
+                 priority=worker_thread.PRIORITY_THUMBNAIL):
         assert 0 != (model.get_flags() & Gtk.TreeModelFlags.ITERS_PERSIST)
         super(ThumbnailIconView, self).__init__(model)
-        ThumbnailViewBase.__init__(self, uid_column, pixbuf_column, status_column)
+        ThumbnailViewBase.__init__(self, uid_column, pixbuf_column, status_column,
+                                   priority=priority)
         self.set_pixbuf_column(pixbuf_column)
 
         # Connect events
@@ -118,10 +128,12 @@ class ThumbnailIconView(Gtk.IconView, ThumbnailViewBase):
         return Gtk.IconView.get_visible_range(self)
 
 class ThumbnailTreeView(Gtk.TreeView, ThumbnailViewBase):
-    def __init__(self, model, uid_column, pixbuf_column, status_column):
+    def __init__(self, model, uid_column, pixbuf_column, status_column,
+                 priority=worker_thread.PRIORITY_THUMBNAIL):
         assert 0 != (model.get_flags() & Gtk.TreeModelFlags.ITERS_PERSIST)
         super(ThumbnailTreeView, self).__init__(model)
-        ThumbnailViewBase.__init__(self, uid_column, pixbuf_column, status_column)
+        ThumbnailViewBase.__init__(self, uid_column, pixbuf_column, status_column,
+                                   priority=priority)
 
         # Connect events
         self.connect('draw', self.draw_thumbnails_on_screen)
@@ -110,6 +110,22 @@ def get_data_directory():
         return os.path.join(base_path, 'mcomix')
 
 
+def get_cache_directory():
+    """Return the path to the MComix cache directory. On UNIX, this will
+    be $XDG_CACHE_HOME/mcomix, on Windows it will be the same directory as
+    get_home_directory().
+
+    See http://standards.freedesktop.org/basedir-spec/latest/ for more
+    information on the $XDG_CACHE_HOME environmental variable.
+    """
+    if sys.platform == 'win32':
+        return get_home_directory()
+    else:
+        base_path = os.getenv('XDG_CACHE_HOME',
+            os.path.join(get_home_directory(), '.cache'))
+        return os.path.join(base_path, 'mcomix')
+
+
 def number_of_digits(n):
     if 0 == n:
         return 1
@@ -1,35 +1,209 @@
 """ Worker thread class. """
 
 
+import heapq
+import itertools
+import os
 import threading
 import traceback
 
 from mcomix import log
 
+#: Priority classes of the work done by threads, most urgent first: the
+#: page being shown, pages read ahead, thumbnails, library covers, and
+#: housekeeping tasks. See set_thread_budget().
+(PRIORITY_PAGE, PRIORITY_PREFETCH, PRIORITY_THUMBNAIL,
+ PRIORITY_LIBRARY, PRIORITY_HOUSEKEEPING) = range(5)
+
+#: Marks a cancelled entry in the orders queue.
+_CANCELLED = object()
+
+class _ThreadBudget(object):
+
+    """Limits the number of threads working at the same time, process-wide.
+    Threads waiting for a slot get one by priority class first, then first
+    come first served. The last slot is kept for PRIORITY_PAGE work, so
+    background work never delays the page being shown for long."""
+
+    def __init__(self, max_threads):
+        self._max_threads = max_threads
+        self._running = 0
+        # Heap of (priority, sequence number) of the waiting threads.
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def set_max_threads(self, max_threads):
+        with self._condition:
+            self._max_threads = max_threads
+            self._condition.notify_all()
+
+    def get_max_threads(self):
+        return self._max_threads
+
+    def wake_up(self):
+        """Wake up waiting threads, to check if they were aborted."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def acquire(self, priority, is_aborted):
+        """Wait for a free slot for <priority> work. Return False, without
+        a slot, if <is_aborted>() returns True in the meantime."""
+        with self._condition:
+            waiter = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, waiter)
+            try:
+                while not is_aborted():
+                    if self._waiting[0] == waiter and self._has_slot(priority):
+                        self._running += 1
+                        return True
+                    self._condition.wait()
+                return False
+            finally:
+                self._waiting.remove(waiter)
+                heapq.heapify(self._waiting)
+                # Let the next waiter check if it can go.
+                self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def _has_slot(self, priority):
+        if PRIORITY_PAGE == priority:
+            return self._running < self._max_threads
+        return self._running < self._max_threads - 1
+
+def _get_default_budget():
+    return max(2, os.cpu_count() or 1)
+
+_budget = _ThreadBudget(_get_default_budget())
+
+def set_thread_budget(max_threads):
+    """Set the maximum number of threads working at the same time, 0 for
+    the number of CPU cores. At least 2 are allowed, so one is always
+    available for the page being shown."""
+    if 0 == max_threads:
+        max_threads = _get_default_budget()
+    _budget.set_max_threads(max(2, max_threads))
+
+def get_thread_budget():
+    """Return the maximum number of threads working at the same time."""
+    return _budget.get_max_threads()
+
+def start_thread(target, args=(), name=None,
+                 priority=PRIORITY_HOUSEKEEPING, daemon=False):
+    """Run <target>(*<args>) in a new thread, once the thread
+    budget allows it. Return the thread."""
+    def run():
+        _budget.acquire(priority, lambda: False)
+        try:
+            target(*args)
+        finally:
+            _budget.release()
+    thread = threading.Thread(target=run)
+    if name is not None:
+        thread.name += '-' + name
+    thread.daemon = daemon
+    thread.start()
+    return thread
+
+class OrderCancelled(Exception):
+    """ Raised by OrderToken.check() when the order has been cancelled. """
+    pass
+
+class OrderToken(object):
+
+    """Cancellation token of an order being processed, see WorkerThread.
+    Long jobs should check it regularly, and stop early once cancelled."""
+
+    def __init__(self):
+        self._cancelled = False
+        # True once the processing function was told about the cancellation.
+        self._aborted = False
+
+    def cancel(self):
+        self._cancelled = True
+        # In case the order is waiting for the thread budget.
+        _budget.wake_up()
+
+    def is_cancelled(self):
+        if self._cancelled:
+            self._aborted = True
+        return self._cancelled
+
+    def check(self):
+        """Raise OrderCancelled if the order has been cancelled. The
+        exception is silently ignored by the worker thread."""
+        if self.is_cancelled():
+            raise OrderCancelled()
+
+#: Token for code not run by a cancellable worker thread.
+_NEVER_CANCELLED = OrderToken()
+
+_current = threading.local()
+
+def get_current_token():
+    """Return the token of the order being processed by the current
+    thread, for code deep down in the call stack that cannot be
+    passed the token explicitly. The returned token is never cancelled
+    when not called from a cancellable worker thread."""
+    return getattr(_current, 'token', _NEVER_CANCELLED)
+
 class WorkerThread(object):
 
     def __init__(self, process_order, name=None, max_threads=1,
-                 sort_orders=False, unique_orders=False):
+                 sort_orders=False, unique_orders=False, order_uid=None,
+                 cancellable=False, priority=PRIORITY_PREFETCH):
         """Create a new pool of worker threads.
 
         Optional <name> will be added to spawned thread names.
         <process_order> will be called to process each work order.
         At most <max_threads> will be started for processing.
-        If <sort_orders> is True, the orders queue will be sorted
-        after each addition. If <unique_orders> is True, duplicate
-        orders will not be added to the queue. """
+        If <sort_orders> is True, orders are processed smallest first,
+        otherwise in the order they were added. If <unique_orders> is
+        True, duplicate orders will not be added to the queue: orders
+        are identified by <order_uid>(order), by default the first item
+        of tuple/list orders, and the order itself otherwise. Queued
+        orders can then be cancelled with cancel_order(), and with
+        <sort_orders>, adding a queued order again changes its priority
+        in place.
+
+        If <cancellable> is True, <process_order> is called with a
+        second argument, the OrderToken of the order, which is cancelled
+        by clear_orders(), cancel_order() and stop(). With <unique_orders>,
+        adding an order while it is being processed revokes its
+        cancellation (and queues it again if processing was aborted).
+
+        Processing an order takes a slot in the process-wide thread
+        budget, with the priority class <priority>: see
+        set_thread_budget(). <max_threads> only limits this pool. """
         self._name = name
         self._process_order = process_order
         self._max_threads = max_threads
         self._sort_orders = sort_orders
         self._unique_orders = unique_orders
+        self._cancellable = cancellable
+        self._priority = priority
+        if order_uid is not None:
+            self._order_uid = order_uid
         self._stop = False
         self._threads = []
-        # Queue of orders waiting for processing.
+        # Heap of orders waiting for processing, as [sort key,
+        # sequence number, order] entries: the sequence number keeps
+        # orders with the same sort key in the order they were added.
         self._orders_queue = []
+        self._orders_sequence = itertools.count()
+        # Number of queued entries that are not cancelled.
+        self._nb_orders = 0
         if self._unique_orders:
-            # Track orders.
-            self._orders_set = set()
+            # Map uid > queue entry of queued orders.
+            self._queued_orders = {}
+            # Map uid > token of the orders being processed.
+            self._running_orders = {}
+        # Tokens of the orders being processed.
+        self._running_tokens = set()
         self._condition = threading.Condition()
 
     def __enter__(self):
@@ -40,7 +214,7 @@ class WorkerThread(object):
 
     def _start(self, nb_threads=1):
         for n in range(nb_threads):
-            if len(self._threads) == self._max_threads:
+            if len(self._threads) >= self._max_threads:
                 break
             thread = threading.Thread(target=self._run)
             if self._name is not None:
@@ -54,25 +228,115 @@ class WorkerThread(object):
             return order[0]
         return order
 
+    def _queue_order(self, order):
+        """Add <order> to the queue, return True if it was actually
+        added. Must be called with the condition held."""
+        if self._unique_orders:
+            order_uid = self._order_uid(order)
+            token = self._running_orders.get(order_uid, None)
+            if token is not None:
+                # Duplicate order, still wanted after all.
+                token._cancelled = False
+                return False
+            entry = self._queued_orders.get(order_uid, None)
+            if entry is not None:
+                if not self._sort_orders or entry[2] == order:
+                    # Duplicate order.
+                    return False
+                # Change of priority: cancel the old entry.
+                self._cancel_entry(entry)
+        sort_key = order if self._sort_orders else None
+        entry = [sort_key, next(self._orders_sequence), order]
+        heapq.heappush(self._orders_queue, entry)
+        self._nb_orders += 1
+        if self._unique_orders:
+            self._queued_orders[order_uid] = entry
+        return True
+
+    def _cancel_entry(self, entry):
+        """Cancel the queue <entry>. Must be called with the condition held."""
+        # Lazy removal: the entry is skipped once popped.
+        entry[2] = _CANCELLED
+        self._nb_orders -= 1
+        if len(self._orders_queue) > 2 * self._nb_orders + 64:
+            # Too many cancelled entries, compact the queue.
+            self._orders_queue = [entry for entry in self._orders_queue
+                                  if entry[2] is not _CANCELLED]
+            heapq.heapify(self._orders_queue)
+
+    def _pop_order(self):
+        """Return the next order in the queue, skipping cancelled entries,
+        or _CANCELLED if the queue is empty. Must be called with the
+        condition held."""
+        while self._orders_queue:
+            order = heapq.heappop(self._orders_queue)[2]
+            if order is _CANCELLED:
+                continue
+            self._nb_orders -= 1
+            return order
+        return _CANCELLED
+
     def _run(self):
-        order_uid = None
+        order, order_uid, token = None, None, None
         while True:
             with self._condition:
-                if order_uid is not None:
-                    self._orders_set.remove(order_uid)
-                while not self._stop and 0 == len(self._orders_queue):
+                if token is not None:
+                    self._order_finished(order, order_uid, token)
+                order = _CANCELLED
+                while not self._stop:
+                    order = self._pop_order()
+                    if order is not _CANCELLED:
+                        break
                     self._condition.wait()
                 if self._stop:
                     return
-                order = self._orders_queue.pop(0)
+                token = OrderToken()
+                self._running_tokens.add(token)
                 if self._unique_orders:
                     order_uid = self._order_uid(order)
+                    del self._queued_orders[order_uid]
+                    self._running_orders[order_uid] = token
+            _current.token = token if self._cancellable else _NEVER_CANCELLED
+            if not _budget.acquire(self._priority, lambda:
+                                   self._stop or token.is_cancelled()):
+                continue
             try:
-                self._process_order(order)
+                if self._cancellable:
+                    self._process_order(order, token)
+                else:
+                    self._process_order(order)
+            except OrderCancelled:
+                log.debug('Worker thread order cancelled: %r', order)
             except Exception as e:
                 log.error(_('! Worker thread processing %(function)r failed: %(error)s'),
                           { 'function' : self._process_order, 'error' : e })
                 log.debug('Traceback:\n%s', traceback.format_exc())
+            finally:
+                _budget.release()
+
+    def _order_finished(self, order, order_uid, token):
+        """Forget about the running <order>. Must be
+        called with the condition held."""
+        self._running_tokens.discard(token)
+        if not self._unique_orders:
+            return
+        if self._running_orders.get(order_uid, None) is token:
+            del self._running_orders[order_uid]
+        if token._aborted and not token._cancelled and not self._stop:
+            # Cancellation revoked too late, see _queue_order.
+            if self._queue_order(order):
+                self._condition.notifyAll()
+
+    def _cancel_running_orders(self):
+        """Cancel the orders being processed. Must be
+        called with the condition held."""
+        for token in self._running_tokens:
+            token.cancel()
+
+    def set_max_threads(self, max_threads):
+        """Change the maximum number of threads started for processing."""
+        with self._condition:
+            self._max_threads = max_threads
 
     def must_stop(self):
         """Return true if we've been asked to stop processing.
@@ -84,49 +348,53 @@ class WorkerThread(object):
     def clear_orders(self):
         """Clear the current orders queue."""
         with self._condition:
-            if self._unique_orders:
-                # We can't just clear the set, as some orders
-                # can be in the process of being processed.
-                for order in self._orders_queue:
-                    order_uid = self._order_uid(order)
-                    self._orders_set.remove(order_uid)
             self._orders_queue = []
+            self._nb_orders = 0
+            if self._unique_orders:
+                self._queued_orders = {}
+            if self._cancellable:
+                self._cancel_running_orders()
+
+    def cancel_order(self, order):
+        """Remove <order> from the queue, if it is still waiting for
+        processing, or cancel its processing if <cancellable>. Only
+        supported with <unique_orders>, any order with the same uid is
+        cancelled. Return True if an order was cancelled."""
+        assert self._unique_orders
+        with self._condition:
+            order_uid = self._order_uid(order)
+            token = self._running_orders.get(order_uid, None)
+            if token is not None and self._cancellable:
+                token.cancel()
+                return True
+            entry = self._queued_orders.pop(order_uid, None)
+            if entry is None:
+                return False
+            self._cancel_entry(entry)
+            return True
+
+    def get_nb_orders(self):
+        """Return the number of orders waiting for processing."""
+        with self._condition:
+            return self._nb_orders
 
     def append_order(self, order):
         """Append work order to the thread orders queue."""
         with self._condition:
-            if self._unique_orders:
-                order_uid = self._order_uid(order)
-                if order_uid in self._orders_set:
-                    # Duplicate order.
-                    return
-                self._orders_set.add(order_uid)
-            self._orders_queue.append(order)
-            if self._sort_orders:
-                self._orders_queue.sort()
+            if not self._queue_order(order):
+                return
             self._condition.notifyAll()
             self._start()
 
     def extend_orders(self, orders_list):
         """Append work orders to the thread orders queue."""
         with self._condition:
-            if self._unique_orders:
-                nb_added = 0
-                for order in orders_list:
-                    order_uid = self._order_uid(order)
-                    if order_uid in self._orders_set:
-                        # Duplicate order.
-                        continue
-                    self._orders_set.add(order_uid)
-                    self._orders_queue.append(order)
+            nb_added = 0
+            for order in orders_list:
+                if self._queue_order(order):
                     nb_added += 1
-            else:
-                self._orders_queue.extend(orders_list)
-                nb_added = len(orders_list)
             if 0 == nb_added:
                 return
-            if self._sort_orders:
-                self._orders_queue.sort()
             self._condition.notifyAll()
             self._start(nb_threads=nb_added)
 
@@ -134,13 +402,17 @@ class WorkerThread(object):
         """Stop the worker threads and flush the orders queue."""
         self._stop = True
         with self._condition:
+            self._cancel_running_orders()
             self._condition.notifyAll()
         for thread in self._threads:
             thread.join()
         self._threads = []
         self._stop = False
         self._orders_queue = []
+        self._nb_orders = 0
+        self._running_tokens.clear()
         if self._unique_orders:
-            self._orders_set.clear()
+            self._queued_orders = {}
+            self._running_orders.clear()
 
 # vim: expandtab:sw=4:ts=4
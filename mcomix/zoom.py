@@ -47,6 +47,30 @@ class ZoomModel(object):
     def reset_user_zoom(self):
         self._set_user_zoom_log(IDENTITY_ZOOM_LOG)
 
+    def get_decode_limit(self, screen_size):
+        """ Returns how much images can be reduced when decoded, without
+        losing details once zoomed to be shown in <screen_size>: a tuple
+        (side, shorter), meaning images are never shown larger than the size
+        where their shorter side (their longer side if <shorter> is False)
+        is <side> pixels long, whatever their rotation. Returns None if
+        images must be decoded at full resolution (manual mode, zoom in). """
+        if self._user_zoom_log > IDENTITY_ZOOM_LOG:
+            return None
+        fitmode = self._fitmode
+        if fitmode == constants.ZOOM_MODE_MANUAL:
+            return None
+        if fitmode == constants.ZOOM_MODE_BEST:
+            # The images fit on both axes.
+            return (max(screen_size), False)
+        if fitmode == constants.ZOOM_MODE_SIZE:
+            side = int(prefs['fit to size px'])
+        elif fitmode == constants.ZOOM_MODE_WIDTH:
+            side = screen_size[constants.WIDTH_AXIS]
+        else:
+            side = screen_size[constants.HEIGHT_AXIS]
+        # Only one axis is fitted, and it can be either side of a rotated image.
+        return (side, True)
+
     def get_zoomed_size(self, image_sizes, screen_size, distribution_axis,
         do_not_transform, prefer_same_size):
         scale_up = self._scale_up
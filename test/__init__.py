@@ -59,6 +59,7 @@ class MComixTest(unittest.TestCase):
         os.environ['HOME'] = home_dir
         os.environ['XDG_DATA_HOME'] = os.path.join(home_dir, 'data')
         os.environ['XDG_CONFIG_HOME'] = os.path.join(home_dir, 'config')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home_dir, 'cache')
         # Create and setup temporary directory.
         temp_dir = os.path.join(self.tmp_dir, 'tmp')
         os.mkdir(temp_dir)
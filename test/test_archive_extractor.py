@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import zipfile
+
+from gi.repository import GLib
+
+from . import MComixTest, get_testfile_path
+
+import mcomix
+from mcomix import archive_extractor
+from mcomix import page_cache
+
+
+class ExtractorTest(MComixTest):
+
+    def setUp(self):
+        super(ExtractorTest, self).setUp()
+        self.dest_dir = tempfile.mkdtemp(prefix='extract.')
+        self.extractor = archive_extractor.Extractor()
+        self.condition = None
+
+    def tearDown(self):
+        if self.condition is not None:
+            self.extractor.close()
+        super(ExtractorTest, self).tearDown()
+
+    def _setup(self, name, cache=None):
+        archive = get_testfile_path('archives', name)
+        self.condition = self.extractor.setup(archive, self.dest_dir,
+                                              cache=cache)
+
+    def _wait(self, predicate):
+        # Listing completion is not signalled on the condition, poll.
+        # Password requests are made in the main thread, process them.
+        context = GLib.MainContext.default()
+        for n in range(100):
+            while context.pending():
+                context.iteration(False)
+            with self.condition:
+                if predicate():
+                    return
+                self.condition.wait(0.1)
+
+    def _wait_listed(self):
+        self._wait(lambda: self.extractor.get_files() is not None)
+        files = self.extractor.get_files()
+        self.assertIsNotNone(files)
+        return sorted(files)
+
+    def _wait_ready(self, files):
+        self._wait(lambda: all(self.extractor.is_ready(f) for f in files))
+        for f in files:
+            self.assertTrue(self.extractor.is_ready(f))
+            self.assertTrue(os.path.exists(os.path.join(self.dest_dir, f)))
+
+    def test_extract_before_set_files(self):
+        # Extraction finishing between contents_listed and set_files().
+        self._setup('Flat.zip')
+        files = self._wait_listed()
+        self.extractor.extract()
+        self._wait_ready(files)
+        self.assertEqual(self.extractor.get_files(), [])
+        self.extractor.set_files(files)
+        self.assertEqual(self.extractor.get_files(), [])
+
+    def test_extract_first_before_set_files(self):
+        self._setup('Flat.zip')
+        files = self._wait_listed()
+        self.extractor.extract()
+        self.extractor.extract_first(files[-1:])
+        self._wait_ready(files)
+        self.extractor.set_files(files)
+        self.assertEqual(self.extractor.get_files(), [])
+
+    def test_sub_archives_provisional(self):
+        # Pages of the first sub-archive can be extracted
+        # before the next sub-archives are.
+        volume = os.path.join(self.tmp_dir, 'volume.cbz')
+        with zipfile.ZipFile(volume, 'w', zipfile.ZIP_DEFLATED) as volume_zip:
+            volume_zip.write(get_testfile_path('images', 'red.png'), 'red.png')
+        archive = os.path.join(self.tmp_dir, 'volumes.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as main_zip:
+            main_zip.write(volume, '1.cbz')
+            main_zip.write(volume, '2.cbz')
+        listings = []
+        self.extractor.contents_listed += \
+                lambda extractor, files, provisional=False: \
+                listings.append((sorted(files), provisional))
+        self.condition = self.extractor.setup(archive, self.dest_dir)
+        files = self._wait_listed()
+        self._wait(lambda: 2 == len(listings))
+        self.assertEqual(listings, [
+            ([os.path.join('1.cbz', 'red.png')], True),
+            (files, False),
+        ])
+        self.assertEqual(len(files), 2)
+
+    def test_page_cache(self):
+        cache = page_cache.PageCache(os.path.join(self.tmp_dir, 'cache'), 1 << 20)
+        self._setup('Flat.zip', cache=cache)
+        files = self._wait_listed()
+        self.extractor.extract()
+        self._wait_ready(files)
+        key = cache.get_archive_key(get_testfile_path('archives', 'Flat.zip'))
+        for f in files:
+            self.assertIsNotNone(cache.get(key, f))
+
+    def test_page_cache_forget(self):
+        # Pages found in the page cache can be extracted again once forgotten.
+        cache = page_cache.PageCache(os.path.join(self.tmp_dir, 'cache'), 1 << 20)
+        self._setup('Flat.zip', cache=cache)
+        files = self._wait_listed()
+        self.extractor.extract()
+        self._wait_ready(files)
+        self.extractor.close()
+        self.dest_dir = tempfile.mkdtemp(prefix='extract.')
+        self.extractor = archive_extractor.Extractor()
+        self._setup('Flat.zip', cache=cache)
+        self.assertEqual(self._wait_listed(), files)
+        # Extract by batches, as done for non-solid 7z archives.
+        self.extractor._archive.support_batch_extraction = True
+        self.extractor.extract()
+        self._wait_ready(files)
+        self.assertEqual(self.extractor.forget(files[:1]), files[:1])
+        self.assertFalse(self.extractor.is_ready(files[0]))
+        self.extractor.set_files(files)
+        self._wait_ready(files)
+
+    def test_page_cache_encrypted(self):
+        # Pages of encrypted archives are not cached.
+        ask_for_password = mcomix.archive.ask_for_password
+        mcomix.archive.ask_for_password = lambda archive: 'password'
+        self.addCleanup(setattr, mcomix.archive,
+                        'ask_for_password', ask_for_password)
+        cache = page_cache.PageCache(os.path.join(self.tmp_dir, 'cache'), 1 << 20)
+        self._setup('Encrypted.zip', cache=cache)
+        files = self._wait_listed()
+        self.extractor.extract()
+        self._wait_ready(files)
+        key = cache.get_archive_key(get_testfile_path('archives', 'Encrypted.zip'))
+        for f in files:
+            self.assertIsNone(cache.get(key, f))
+        self.assertEqual(cache.get_size(), 0)
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from gi.repository import GLib
+
+from mcomix import callback
+
+
+class Source(object):
+
+    @callback.BatchCallback
+    def items_ready(self, source, items):
+        pass
+
+
+class BatchCallbackTest(unittest.TestCase):
+
+    def _iterate(self):
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+
+    def test_batch(self):
+        source = Source()
+        calls = []
+        source.items_ready += lambda source, items: calls.append(list(items))
+        threads = [threading.Thread(target=source.items_ready,
+                                    args=(source, [n]))
+                   for n in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(calls, [])
+        self._iterate()
+        # All the calls made from the worker threads are delivered at once.
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0]), list(range(100)))
+
+    def test_main_thread_flush(self):
+        source = Source()
+        calls = []
+        source.items_ready += lambda source, items: calls.append(list(items))
+        thread = threading.Thread(target=source.items_ready, args=(source, [1]))
+        thread.start()
+        thread.join(5)
+        # Pending items are delivered first, to keep the order of calls.
+        source.items_ready(source, [2])
+        self.assertEqual(calls, [[1], [2]])
+        self._iterate()
+        self.assertEqual(calls, [[1], [2]])
+
+# vim: expandtab:sw=4:ts=4
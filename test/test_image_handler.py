@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mcomix import worker_thread
+from mcomix.image_handler import ImageHandler
+
+
+class FileAvailableBenchmark(unittest.TestCase):
+
+    def _extract_book(self, nb_pages):
+        """ Return the time taken to notify the ImageHandler of the
+        extraction of a <nb_pages> pages book, one file at a time. """
+        handler = ImageHandler(mock.MagicMock())
+        paths = ['/tmp/book/%05u.jpg' % n for n in range(nb_pages)]
+        handler.set_image_files(paths)
+        start = time.perf_counter()
+        for path in paths:
+            handler._file_available([path])
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(handler._available_images), nb_pages)
+        return elapsed
+
+    def test_linear_scaling(self):
+        small = min(self._extract_book(1000) for n in range(3))
+        big = min(self._extract_book(5000) for n in range(3))
+        # Linear would be 5 times slower, quadratic 25 times.
+        self.assertLess(big / small, 12)
+
+    def test_announced_twice(self):
+        handler = ImageHandler(mock.MagicMock())
+        paths = ['/tmp/book/%05u.jpg' % n for n in range(4)]
+        handler.set_image_files(paths)
+        handler._file_available(paths[:2])
+        # Already available pages must not stop the others.
+        handler._file_available(paths[1:])
+        self.assertEqual(handler._available_images, set(range(4)))
+
+class PrerenderTest(unittest.TestCase):
+
+    def test_reading_direction_first(self):
+        window = mock.MagicMock()
+        done = threading.Event()
+        calls = []
+        def prerender_spread(page, step, viewport_size, token):
+            calls.append((page, step, viewport_size))
+            if 2 == len(calls):
+                done.set()
+        window.prerender_spread.side_effect = prerender_spread
+        handler = ImageHandler(window)
+        handler.set_image_files(['/tmp/book/%05u.jpg' % n for n in range(10)])
+        handler._current_image_index = 4
+        for page in range(7, 4, -1):
+            handler._read_ahead.page_changed(page, 1)
+        handler.prerender_spreads((800, 600))
+        self.assertTrue(done.wait(5))
+        handler.cleanup()
+        self.assertEqual(calls, [(5, -1, (800, 600)), (5, 1, (800, 600))])
+
+class ParallelDecodeTest(unittest.TestCase):
+
+    def test_parallel_decode(self):
+        max_threads = worker_thread.get_thread_budget()
+        self.addCleanup(worker_thread.set_thread_budget, max_threads)
+        worker_thread.set_thread_budget(8)
+        lock = threading.Lock()
+        running = []
+        max_running = [0]
+        decoded = []
+        def load_pixbuf(path, limit=None):
+            with lock:
+                running.append(path)
+                max_running[0] = max(max_running[0], len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(path)
+                decoded.append(path)
+            return mock.MagicMock()
+        handler = ImageHandler(mock.MagicMock())
+        handler.set_max_decode_threads(4)
+        handler._load_pixbuf = load_pixbuf
+        handler._get_memory_size = lambda path, pixbuf: 1
+        paths = ['/tmp/book/%05u.jpg' % n for n in range(8)]
+        handler.set_image_files(paths)
+        handler._available_images.update(range(len(paths)))
+        handler._thread.extend_orders([(n, n) for n in range(len(paths))])
+        for n in range(500):
+            with lock:
+                if len(decoded) == len(paths):
+                    break
+            time.sleep(0.01)
+        handler.cleanup()
+        self.assertEqual(sorted(decoded), paths)
+        self.assertGreater(max_running[0], 1)
+        self.assertLessEqual(max_running[0], 4)
+
+# vim: expandtab:sw=4:ts=4
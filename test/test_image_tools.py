@@ -256,6 +256,36 @@ class ImageToolsTest(object):
             exception = GObject.GError
         self.assertRaises(exception, image_tools.load_pixbuf, os.devnull)
 
+    def test_load_pixbuf_reduced(self):
+        tmp_file = tempfile.NamedTemporaryFile(prefix='image.',
+                                               suffix='.jpg', delete=False)
+        tmp_file.close()
+        try:
+            Image.new('RGB', (400, 200), (255, 0, 0)).save(tmp_file.name)
+            pixbuf = image_tools.load_pixbuf(tmp_file.name, (100, 100))
+            self.assertEqual((pixbuf.get_width(), pixbuf.get_height()), (100, 50))
+            with open(tmp_file.name, 'rb') as fp:
+                pixbuf = image_tools.load_pixbuf_data(fp.read(), (100, 100))
+            self.assertEqual((pixbuf.get_width(), pixbuf.get_height()), (100, 50))
+        finally:
+            os.unlink(tmp_file.name)
+        self.assertEqual(image_tools.get_original_size(pixbuf), (100, 50))
+        image_tools.set_original_size(pixbuf, (400, 200))
+        self.assertEqual(image_tools.get_original_size(pixbuf), (400, 200))
+        self.assertTrue(image_tools.has_enough_resolution(pixbuf, (100, False)))
+        self.assertTrue(image_tools.has_enough_resolution(pixbuf, (50, True)))
+        self.assertFalse(image_tools.has_enough_resolution(pixbuf, (200, False)))
+        self.assertFalse(image_tools.has_enough_resolution(pixbuf, None))
+
+    def test_get_reduced_size(self):
+        self.assertEqual(image_tools.get_reduced_size((4000, 6000), None), (4000, 6000))
+        # Limited by the longer side (best fit mode).
+        self.assertEqual(image_tools.get_reduced_size((4000, 6000), (1200, False)), (800, 1200))
+        # Limited by the shorter side (fit width or height mode).
+        self.assertEqual(image_tools.get_reduced_size((4000, 6000), (1000, True)), (1000, 1500))
+        # Never larger.
+        self.assertEqual(image_tools.get_reduced_size((400, 600), (1000, True)), (400, 600))
+
     def test_load_pixbuf_size_basic(self):
         # Same as test_load_pixbuf_basic:
         # load bunch of images at their
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mcomix import constants
+from mcomix import listing_cache
+from mcomix.archive import archive_base
+
+
+class DummyArchive(archive_base.BaseArchive):
+
+    _listing_attributes = ('_is_solid',)
+
+    def __init__(self, archive):
+        super(DummyArchive, self).__init__(archive)
+        self._is_solid = False
+
+
+class OtherArchive(DummyArchive):
+    pass
+
+
+class ListingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='listing_cache.')
+        patcher = mock.patch.object(constants, 'LISTING_CACHE_PATH',
+                                    os.path.join(self.tmp_dir, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(self.path, 'wb') as fp:
+            fp.write(b'book')
+        self.contents = ['01.jpg', '02.jpg', 'info.txt']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _save(self):
+        archive = DummyArchive(self.path)
+        archive._is_solid = True
+        listing_cache.save(self.path, archive, self.contents, mime=constants.ZIP)
+
+    def test_load(self):
+        self.assertIsNone(listing_cache.load(self.path, DummyArchive(self.path)))
+        self._save()
+        archive = DummyArchive(self.path)
+        self.assertEqual(listing_cache.load(self.path, archive), self.contents)
+        self.assertTrue(archive._is_solid)
+
+    def test_get_info(self):
+        self.assertIsNone(listing_cache.get_info(self.path))
+        self._save()
+        self.assertEqual(listing_cache.get_info(self.path),
+                         (constants.ZIP, self.contents))
+
+    def test_other_handler(self):
+        self._save()
+        self.assertIsNone(listing_cache.load(self.path, OtherArchive(self.path)))
+
+    def test_modified_archive(self):
+        self._save()
+        with open(self.path, 'ab') as fp:
+            fp.write(b'more pages')
+        self.assertIsNone(listing_cache.load(self.path, DummyArchive(self.path)))
+
+    def test_not_cacheable(self):
+        archive = archive_base.BaseArchive(self.path)
+        listing_cache.save(self.path, archive, self.contents)
+        self.assertIsNone(listing_cache.get_info(self.path))
+        self.assertFalse(os.path.exists(constants.LISTING_CACHE_PATH))
+
+    def test_prune(self):
+        with mock.patch.object(listing_cache, 'MAX_ENTRIES', 2):
+            for n in range(4):
+                path = os.path.join(self.tmp_dir, '%u.cbz' % n)
+                with open(path, 'wb') as fp:
+                    fp.write(b'book')
+                listing_cache.save(path, DummyArchive(path), self.contents)
+        self.assertEqual(len(os.listdir(constants.LISTING_CACHE_PATH)), 2)
+
+# vim: expandtab:sw=4:ts=4
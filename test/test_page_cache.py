@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mcomix import page_cache
+
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='page_cache.')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.archive = os.path.join(self.tmp_dir, 'book.cbr')
+        with open(self.archive, 'wb') as fp:
+            fp.write(b'book')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_get(self):
+        cache = page_cache.PageCache(self.cache_dir, 1024)
+        key = cache.get_archive_key(self.archive)
+        self.assertIsNone(cache.get(key, '01.jpg'))
+        cache.add(key, '01.jpg', b'page 1')
+        self.assertEqual(cache.get(key, '01.jpg'), b'page 1')
+        self.assertIsNone(cache.get(key, '02.jpg'))
+        # Persisted across sessions.
+        cache = page_cache.PageCache(self.cache_dir, 1024)
+        self.assertEqual(cache.get(key, '01.jpg'), b'page 1')
+        self.assertEqual(cache.get_size(), 6)
+
+    def test_add_file(self):
+        cache = page_cache.PageCache(self.cache_dir, 1024)
+        key = cache.get_archive_key(self.archive)
+        path = os.path.join(self.tmp_dir, '01.jpg')
+        with open(path, 'wb') as fp:
+            fp.write(b'page 1')
+        cache.add_file(key, '01.jpg', path)
+        self.assertEqual(cache.get(key, '01.jpg'), b'page 1')
+
+    def test_modified_archive(self):
+        cache = page_cache.PageCache(self.cache_dir, 1024)
+        cache.add(cache.get_archive_key(self.archive), '01.jpg', b'page 1')
+        with open(self.archive, 'ab') as fp:
+            fp.write(b'more pages')
+        self.assertIsNone(cache.get(cache.get_archive_key(self.archive), '01.jpg'))
+
+    def test_disabled(self):
+        cache = page_cache.PageCache(self.cache_dir, 0)
+        key = cache.get_archive_key(self.archive)
+        self.assertIsNone(key)
+        cache.add(key, '01.jpg', b'page 1')
+        self.assertIsNone(cache.get(key, '01.jpg'))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_lru(self):
+        cache = page_cache.PageCache(self.cache_dir, 20)
+        key = cache.get_archive_key(self.archive)
+        cache.add(key, '01.jpg', b'0123456789')
+        cache.add(key, '02.jpg', b'0123456789')
+        # Make 01.jpg the most recently used.
+        cache.get(key, '01.jpg')
+        cache.add(key, '03.jpg', b'0123456789')
+        self.assertEqual(cache.get_size(), 20)
+        self.assertIsNotNone(cache.get(key, '01.jpg'))
+        self.assertIsNone(cache.get(key, '02.jpg'))
+        self.assertIsNotNone(cache.get(key, '03.jpg'))
+        cache.set_max_size(10)
+        self.assertEqual(cache.get_size(), 10)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+# vim: expandtab:sw=4:ts=4
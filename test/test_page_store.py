@@ -0,0 +1,72 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mcomix.page_store import PageStore
+
+
+class PageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='page_store.')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_and_get(self):
+        store = PageStore(100)
+        path = os.path.join(self.tmp_dir, 'a.jpg')
+        self.assertTrue(store.add(path, b'0123456789'))
+        self.assertTrue(path in store)
+        self.assertEqual(store.get(path), b'0123456789')
+        self.assertEqual(store.get_size(path), 10)
+        self.assertEqual(store.open(path).read(), b'0123456789')
+        self.assertFalse(os.path.exists(path))
+
+    def test_eviction_writes_to_disk(self):
+        store = PageStore(25)
+        paths = [os.path.join(self.tmp_dir, 'dir', '%u.jpg' % n) for n in range(3)]
+        for n, path in enumerate(paths):
+            store.add(path, bytes([n]) * 10)
+        # Least recently used page was spilled to disk.
+        self.assertFalse(paths[0] in store)
+        self.assertEqual(open(paths[0], 'rb').read(), b'\0' * 10)
+        self.assertEqual(store.open(paths[0]).read(), b'\0' * 10)
+        self.assertEqual(store.get_size(paths[0]), 10)
+        self.assertTrue(paths[1] in store)
+        self.assertTrue(paths[2] in store)
+        # Access updates recency.
+        store.get(paths[1])
+        store.add(paths[0], b'\0' * 10)
+        self.assertTrue(paths[1] in store)
+        self.assertFalse(paths[2] in store)
+
+    def test_too_big(self):
+        store = PageStore(5)
+        path = os.path.join(self.tmp_dir, 'big.jpg')
+        self.assertFalse(store.add(path, b'0123456789'))
+        self.assertFalse(path in store)
+        self.assertEqual(store.open(path).read(), b'0123456789')
+
+    def test_flush(self):
+        store = PageStore(100)
+        path = os.path.join(self.tmp_dir, 'a.jpg')
+        store.add(path, b'data')
+        store.flush_all()
+        self.assertTrue(path in store)
+        self.assertEqual(open(path, 'rb').read(), b'data')
+        store.clear()
+        self.assertFalse(path in store)
+        self.assertIsNone(store.get(path))
+
+    def test_remove(self):
+        store = PageStore(15)
+        paths = [os.path.join(self.tmp_dir, '%u.jpg' % n) for n in range(2)]
+        store.add(paths[0], b'0123456789')
+        store.remove(paths[0])
+        self.assertFalse(paths[0] in store)
+        # Space was reclaimed.
+        self.assertTrue(store.add(paths[1], b'0123456789'))
+        self.assertFalse(os.path.exists(paths[0]))
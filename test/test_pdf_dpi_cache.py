@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mcomix import constants
+from mcomix import pdf_dpi_cache
+
+
+class PdfDpiCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='pdf_dpi_cache.')
+        patcher = mock.patch.object(constants, 'PDF_DPI_CACHE_PATH',
+                                    os.path.join(self.tmp_dir, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.tmp_dir, 'book.pdf')
+        with open(self.path, 'wb') as fp:
+            fp.write(b'book')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load(self):
+        self.assertEqual(pdf_dpi_cache.load(self.path), {})
+        pdf_dpi_cache.save(self.path, {1: 288, 2: 300})
+        self.assertEqual(pdf_dpi_cache.load(self.path), {1: 288, 2: 300})
+
+    def test_modified_document(self):
+        pdf_dpi_cache.save(self.path, {1: 288})
+        with open(self.path, 'ab') as fp:
+            fp.write(b'more pages')
+        self.assertEqual(pdf_dpi_cache.load(self.path), {})
+
+    def test_prune(self):
+        with mock.patch.object(pdf_dpi_cache, 'MAX_ENTRIES', 2):
+            for n in range(4):
+                path = os.path.join(self.tmp_dir, '%u.pdf' % n)
+                with open(path, 'wb') as fp:
+                    fp.write(b'book')
+                pdf_dpi_cache.save(path, {1: 288})
+        self.assertEqual(len(os.listdir(constants.PDF_DPI_CACHE_PATH)), 2)
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mcomix import pixbuf_cache
+
+
+class PixbufCacheTest(unittest.TestCase):
+
+    def test_add_get(self):
+        cache = pixbuf_cache.PixbufCache(100)
+        self.assertIsNone(cache.get(0))
+        self.assertTrue(cache.add(0, 'page 1', 10))
+        self.assertEqual(cache.get(0), 'page 1')
+        self.assertIn(0, cache)
+        self.assertEqual(cache.pop(0), 'page 1')
+        self.assertIsNone(cache.pop(0))
+        self.assertEqual(cache.get_stats(),
+                         pixbuf_cache.Stats(0, 100, 0, 1, 1, 0))
+
+    def test_byte_budget(self):
+        cache = pixbuf_cache.PixbufCache(100)
+        for index in range(5):
+            cache.add(index, index, 30)
+        self.assertEqual(cache.get_size(), 90)
+        self.assertEqual(cache.get_stats().evictions, 2)
+        self.assertFalse(cache.is_full())
+        # Would not fit anyway.
+        self.assertFalse(cache.add(10, 10, 200))
+        self.assertEqual(cache.get_size(), 90)
+        cache.set_max_size(30)
+        self.assertEqual(cache.get_size(), 30)
+
+    def test_lru(self):
+        cache = pixbuf_cache.PixbufCache(20)
+        cache.set_current(1)
+        cache.add(0, 0, 10)
+        cache.add(2, 2, 10)
+        # Make page 0 more recently used than page 2.
+        cache.get(0)
+        cache.add(1, 1, 10)
+        self.assertNotIn(2, cache)
+        self.assertIn(0, cache)
+        self.assertIn(1, cache)
+
+    def test_distance(self):
+        cache = pixbuf_cache.PixbufCache(30)
+        cache.set_current(50)
+        cache.add(0, 0, 10)
+        cache.add(49, 49, 10)
+        cache.add(51, 51, 10)
+        # Page 0 is far away, even if more recently used.
+        cache.get(0)
+        cache.add(52, 52, 10)
+        self.assertNotIn(0, cache)
+        self.assertEqual(cache.get_stats().count, 3)
+
+    def test_wanted(self):
+        cache = pixbuf_cache.PixbufCache(20)
+        cache.set_current(0, wanted=[0, 1, 2])
+        for index in range(3):
+            self.assertTrue(cache.add(index, index, 15))
+        # Wanted pages are kept over the budget.
+        self.assertEqual(cache.get_size(), 45)
+        self.assertTrue(cache.is_full())
+        cache.set_current(2, wanted=[2])
+        self.assertEqual(cache.get_size(), 15)
+        self.assertIn(2, cache)
+        cache.clear()
+        self.assertEqual(cache.get_size(), 0)
+        self.assertEqual(cache.get_stats().count, 0)
+
+class ScaledPixbufCacheTest(unittest.TestCase):
+
+    def test_params(self):
+        cache = pixbuf_cache.ScaledPixbufCache(100)
+        params = ((600, 900), 0, False)
+        self.assertTrue(cache.add(0, params, 'page 1', 10))
+        self.assertEqual(cache.get(0, params), 'page 1')
+        self.assertIsNone(cache.get(0, ((600, 900), 90, False)))
+        self.assertIsNone(cache.get(1, params))
+        cache.add(0, ((300, 450), 0, False), 'page 1 small', 5)
+        cache.add(1, params, 'page 2', 10)
+        cache.discard(0)
+        self.assertIsNone(cache.get(0, params))
+        self.assertEqual(cache.get(1, params), 'page 2')
+        self.assertEqual(cache.get_stats(),
+                         pixbuf_cache.Stats(10, 100, 1, 2, 3, 0))
+
+    def test_lru(self):
+        cache = pixbuf_cache.ScaledPixbufCache(20)
+        cache.add(0, (), 'page 1', 10)
+        cache.add(1, (), 'page 2', 10)
+        cache.get(0, ())
+        cache.add(2, (), 'page 3', 10)
+        self.assertIn((0, ()), cache)
+        self.assertNotIn((1, ()), cache)
+        self.assertEqual(cache.get_stats().evictions, 1)
+        # Disabled.
+        cache.set_max_size(0)
+        self.assertEqual(cache.get_size(), 0)
+        self.assertFalse(cache.add(0, (), 'page 1', 10))
+
+# vim: expandtab:sw=4:ts=4
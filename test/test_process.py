@@ -4,10 +4,14 @@ import shutil
 import stat
 import sys
 import tempfile
+import threading
+import time
+import unittest
 
 from . import MComixTest
 
 from mcomix import process
+from mcomix import worker_thread
 
 
 if 'win32' == sys.platform:
@@ -158,3 +162,20 @@ class ProcessTest(MComixTest):
             for fn in reversed(cleanup):
                 fn()
 
+class ProcessRunTest(unittest.TestCase):
+
+    def test_run(self):
+        output = process.run([sys.executable, '-c', 'print("mcomix")'],
+                             stdout=process.PIPE)
+        self.assertEqual(output.strip(), b'mcomix')
+
+    def test_run_cancelled(self):
+        token = worker_thread.OrderToken()
+        timer = threading.Timer(0.2, token.cancel)
+        timer.start()
+        start = time.monotonic()
+        with self.assertRaises(worker_thread.OrderCancelled):
+            process.run([sys.executable, '-c', 'import time; time.sleep(30)'],
+                        token=token)
+        self.assertLess(time.monotonic() - start, 10)
+
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mcomix.read_ahead import ReadAheadPlanner
+
+
+class ReadAheadPlannerTest(unittest.TestCase):
+
+    def _flip(self, planner, pages, page_width=1, interval=10.0, start=0.0):
+        now = start
+        for page in pages:
+            planner.page_changed(page, page_width, now=now)
+            now += interval
+        return now - interval
+
+    def test_forward(self):
+        planner = ReadAheadPlanner()
+        now = self._flip(planner, range(5, 11))
+        plan = planner.plan(10, 100, 1, 6, now=now)
+        self.assertEqual(plan.direction, 1)
+        # Current page, the next 2 pages, the previous page, then the rest.
+        self.assertEqual(plan.decode, [9, 10, 11, 8, 12, 13])
+        self.assertEqual(plan.extract[:len(plan.decode)], plan.decode)
+        self.assertIs(planner.last_plan, plan)
+
+    def test_backward(self):
+        planner = ReadAheadPlanner()
+        now = self._flip(planner, range(20, 14, -1))
+        plan = planner.plan(15, 100, 1, 6, now=now)
+        self.assertEqual(plan.direction, -1)
+        self.assertEqual(plan.decode, [14, 13, 12, 15, 11, 10])
+
+    def test_double_page(self):
+        planner = ReadAheadPlanner()
+        now = self._flip(planner, range(21, 9, -2), page_width=2)
+        plan = planner.plan(11, 100, 2, 8, now=now)
+        self.assertEqual(plan.direction, -1)
+        self.assertEqual(plan.decode, [10, 11, 9, 8, 7, 6, 12, 13])
+
+    def test_fast_flipping(self):
+        planner = ReadAheadPlanner()
+        now = self._flip(planner, range(1, 6))
+        slow = planner.plan(5, 100, 1, 4, now=now)
+        now = self._flip(planner, range(6, 14), interval=0.25, start=now + 10)
+        fast = planner.plan(13, 100, 1, 4, now=now)
+        self.assertGreater(fast.speed, slow.speed)
+        # Both windows are widened forward.
+        self.assertGreater(len(fast.decode), len(slow.decode))
+        self.assertGreater(len(fast.extract) - len(fast.decode),
+                           len(slow.extract) - len(slow.decode))
+        self.assertEqual(max(fast.extract), fast.extract[-1])
+        # The speed decays once flipping stops.
+        self.assertEqual(planner.get_speed(now=now + 10), 0.0)
+
+    def test_jump(self):
+        planner = ReadAheadPlanner()
+        now = self._flip(planner, range(30, 20, -1), interval=0.25)
+        self.assertGreater(planner.get_speed(now=now), 0.0)
+        planner.page_changed(80, 1, now=now)
+        self.assertEqual(planner.get_speed(now=now), 0.0)
+        # A jump does not change the reading direction.
+        self.assertEqual(planner.get_direction(), -1)
+
+    def test_bounds(self):
+        planner = ReadAheadPlanner()
+        plan = planner.plan(1, 3, 1, 6)
+        self.assertEqual(plan.decode, [0, 1, 2])
+        plan = planner.plan(2, 3, 1, 0)
+        self.assertEqual(plan.decode, [1])
+        self.assertEqual(plan.extract, [1])
+
+# vim: expandtab:sw=4:ts=4
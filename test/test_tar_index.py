@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import bz2
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mcomix import constants
+from mcomix.archive import tar_index
+
+
+class CompressedStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='tar_index.')
+        rnd = random.Random(42)
+        # Poorly compressible, so bzip2 uses several blocks.
+        self.data = bytes(rnd.getrandbits(8) for n in range(600 * 1024))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def _check_stream(self, stream):
+        ranges = [(0, 10), (1000, 5000), (300 * 1024, 100), (590 * 1024, 10 * 1024)]
+        for offset, size in ranges:
+            self.assertEqual(stream.read(offset, size),
+                             self.data[offset:offset + size])
+        self.assertEqual(list(stream.iter_read(ranges)),
+                         [self.data[offset:offset + size]
+                          for offset, size in ranges])
+
+    def _build(self, stream):
+        reader = stream.open()
+        self.assertEqual(reader.read(), self.data)
+        self.assertEqual(stream.size, len(self.data))
+
+    def test_get_compression(self):
+        self.assertEqual('gz', tar_index.get_compression(
+            self._write('test.gz', gzip.compress(self.data))))
+        self.assertEqual('bz2', tar_index.get_compression(
+            self._write('test.bz2', bz2.compress(self.data))))
+        self.assertIsNone(tar_index.get_compression(
+            self._write('test.tar', self.data)))
+
+    def test_bzip2(self):
+        path = self._write('test.bz2', bz2.compress(self.data, 1))
+        stream = tar_index.open_stream(path, 'bz2')
+        self._build(stream)
+        checkpoints = stream.get_checkpoints()
+        # One checkpoint per block.
+        self.assertGreater(len(checkpoints), 4)
+        self.assertTrue(stream.is_random_access())
+        self._check_stream(stream)
+        # Checkpoints can be restored.
+        self._check_stream(tar_index.open_stream(path, 'bz2', checkpoints, stream.size))
+
+    def test_gzip_members(self):
+        data = b''.join(gzip.compress(self.data[offset:offset + 100 * 1024])
+                        for offset in range(0, len(self.data), 100 * 1024))
+        path = self._write('test.gz', data)
+        stream = tar_index.open_stream(path, 'gz')
+        self._build(stream)
+        checkpoints = stream.get_checkpoints()
+        # One checkpoint per member.
+        self.assertEqual([checkpoint[0] for checkpoint in checkpoints],
+                         list(range(0, len(self.data), 100 * 1024)))
+        self._check_stream(tar_index.open_stream(path, 'gz', checkpoints, stream.size))
+
+    def test_gzip_snapshots(self):
+        path = self._write('test.gz', gzip.compress(self.data))
+        with mock.patch.object(tar_index, 'SNAPSHOT_INTERVAL', 64 * 1024):
+            stream = tar_index.open_stream(path, 'gz')
+            self._build(stream)
+        # Snapshots are not saved.
+        self.assertEqual(len(stream.get_checkpoints()), 1)
+        self.assertGreater(len(stream._checkpoints), 4)
+        self._check_stream(stream)
+
+    def test_save_index(self):
+        path = self._write('test.bz2', bz2.compress(self.data, 1))
+        members = [('test', 0, len(self.data))]
+        with mock.patch.object(constants, 'TAR_INDEX_PATH',
+                               os.path.join(self.tmp_dir, 'index')):
+            self.assertIsNone(tar_index.load_index(path))
+            stream = tar_index.open_stream(path, 'bz2')
+            self._build(stream)
+            tar_index.save_index(path, stream, members)
+            stream, loaded_members = tar_index.load_index(path)
+            self.assertEqual(loaded_members, members)
+            self._check_stream(stream)
+            # Outdated index.
+            os.utime(path, (0, 0))
+            self.assertIsNone(tar_index.load_index(path))
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mcomix import worker_thread
+from mcomix.worker_thread import WorkerThread
+
+
+class WorkerThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.started = threading.Event()
+        self.resume = threading.Event()
+        self.done = threading.Event()
+
+    def _process(self, order):
+        if 'block' == order:
+            # Hold the thread while the test fills the queue.
+            self.started.set()
+            self.resume.wait()
+            return
+        if 'end' == order:
+            self.done.set()
+            return
+        self.processed.append(order)
+
+    def _run(self, thread, orders, end_order='end'):
+        """Queue <orders> while the thread is busy, then
+        return the orders processed, in order."""
+        thread.append_order('block')
+        self.assertTrue(self.started.wait(5))
+        orders(thread)
+        thread.append_order(end_order)
+        self.resume.set()
+        self.assertTrue(self.done.wait(5))
+        thread.stop()
+        return self.processed
+
+    def test_fifo(self):
+        thread = WorkerThread(self._process)
+        def orders(thread):
+            thread.extend_orders([3, 1, 2])
+            thread.append_order(1)
+        self.assertEqual(self._run(thread, orders), [3, 1, 2, 1])
+
+    def test_sort_orders(self):
+        def process(order):
+            self._process(order[1])
+        thread = WorkerThread(process, sort_orders=True)
+        thread.append_order((0, 'block'))
+        self.assertTrue(self.started.wait(5))
+        thread.extend_orders([(3, 'c'), (1, 'a'), (2, 'b1')])
+        thread.append_order((2, 'b2'))
+        thread.append_order((4, 'end'))
+        self.resume.set()
+        self.assertTrue(self.done.wait(5))
+        thread.stop()
+        self.assertEqual(self.processed, ['a', 'b1', 'b2', 'c'])
+
+    def test_unique_orders(self):
+        thread = WorkerThread(self._process, unique_orders=True)
+        def orders(thread):
+            thread.extend_orders([1, 2, 1, 3])
+            # Being processed.
+            thread.append_order('block')
+            thread.append_order(2)
+            self.assertEqual(thread.get_nb_orders(), 3)
+        self.assertEqual(self._run(thread, orders), [1, 2, 3])
+
+    def test_cancel_order(self):
+        thread = WorkerThread(self._process, unique_orders=True)
+        def orders(thread):
+            thread.extend_orders(list(range(200)))
+            for n in range(0, 200, 2):
+                self.assertTrue(thread.cancel_order(n))
+            self.assertFalse(thread.cancel_order(0))
+            self.assertFalse(thread.cancel_order(1000))
+            self.assertEqual(thread.get_nb_orders(), 100)
+        self.assertEqual(self._run(thread, orders), list(range(1, 200, 2)))
+
+    def test_change_priority(self):
+        def process(order):
+            self._process(order[1])
+        thread = WorkerThread(process, sort_orders=True, unique_orders=True,
+                              order_uid=lambda order: order[1])
+        thread.append_order((0, 'block'))
+        self.assertTrue(self.started.wait(5))
+        thread.extend_orders([(1, 'a'), (2, 'b'), (3, 'c')])
+        thread.append_order((0, 'c'))
+        thread.append_order((5, 'a'))
+        self.assertEqual(thread.get_nb_orders(), 3)
+        thread.append_order((9, 'end'))
+        self.resume.set()
+        self.assertTrue(self.done.wait(5))
+        thread.stop()
+        self.assertEqual(self.processed, ['c', 'b', 'a'])
+
+    def test_clear_orders(self):
+        thread = WorkerThread(self._process, unique_orders=True)
+        def orders(thread):
+            thread.extend_orders([1, 2, 3])
+            thread.clear_orders()
+            self.assertEqual(thread.get_nb_orders(), 0)
+            thread.extend_orders([3, 4])
+        self.assertEqual(self._run(thread, orders), [3, 4])
+
+    def _process_cancellable(self, order, token):
+        if 'block' == order:
+            self.started.set()
+            while not token.is_cancelled():
+                if self.resume.wait(0.01):
+                    break
+            self.processed.append(('block', token.is_cancelled()))
+            return
+        self._process(order)
+
+    def test_clear_orders_cancels(self):
+        thread = WorkerThread(self._process_cancellable, cancellable=True)
+        thread.append_order('block')
+        self.assertTrue(self.started.wait(5))
+        thread.clear_orders()
+        thread.append_order('end')
+        self.assertTrue(self.done.wait(5))
+        thread.stop()
+        self.assertEqual(self.processed, [('block', True)])
+
+    def test_cancel_running_order(self):
+        thread = WorkerThread(self._process_cancellable, unique_orders=True,
+                              cancellable=True)
+        thread.append_order('block')
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(thread.cancel_order('block'))
+        # Wanted again: either the cancellation is revoked in time, or
+        # the order is queued again, so it ends up being processed.
+        thread.append_order('block')
+        self.resume.set()
+        for n in range(500):
+            if ('block', False) in self.processed:
+                break
+            time.sleep(0.01)
+        thread.stop()
+        self.assertEqual(self.processed[-1], ('block', False))
+
+    def test_order_cancelled_exception(self):
+        def process(order, token):
+            token.cancel()
+            self.done.set()
+            token.check()
+            self.processed.append(order)
+        thread = WorkerThread(process, cancellable=True)
+        with mock.patch.object(worker_thread.log, 'error') as error:
+            thread.append_order(1)
+            self.assertTrue(self.done.wait(5))
+            thread.stop()
+        self.assertEqual(self.processed, [])
+        error.assert_not_called()
+
+class ThreadBudgetTest(unittest.TestCase):
+
+    def _wait_for(self, condition):
+        for n in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('timeout')
+
+    def test_priority_classes(self):
+        budget = worker_thread._ThreadBudget(2)
+        self.assertTrue(budget.acquire(worker_thread.PRIORITY_LIBRARY, lambda: False))
+        # The last slot is kept for the page being shown.
+        aborted = threading.Event()
+        self.assertFalse(budget.acquire(worker_thread.PRIORITY_PREFETCH,
+                                        lambda: aborted.set() or True))
+        self.assertTrue(aborted.is_set())
+        started = []
+        def acquire(priority):
+            budget.acquire(priority, lambda: False)
+            started.append(priority)
+        threads = []
+        for priority in (worker_thread.PRIORITY_HOUSEKEEPING,
+                         worker_thread.PRIORITY_THUMBNAIL,
+                         worker_thread.PRIORITY_PREFETCH):
+            thread = threading.Thread(target=acquire, args=(priority,))
+            thread.start()
+            threads.append(thread)
+        self._wait_for(lambda: len(budget._waiting) == 3)
+        self.assertEqual(started, [])
+        # Free the only background slot: most urgent first.
+        for nb_started in range(1, 4):
+            budget.release()
+            self._wait_for(lambda: len(started) == nb_started)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(started, [worker_thread.PRIORITY_PREFETCH,
+                                   worker_thread.PRIORITY_THUMBNAIL,
+                                   worker_thread.PRIORITY_HOUSEKEEPING])
+
+    def test_page_slot(self):
+        budget = worker_thread._ThreadBudget(2)
+        self.assertTrue(budget.acquire(worker_thread.PRIORITY_LIBRARY, lambda: False))
+        self.assertTrue(budget.acquire(worker_thread.PRIORITY_PAGE, lambda: False))
+
+    def test_set_thread_budget(self):
+        max_threads = worker_thread.get_thread_budget()
+        self.addCleanup(worker_thread.set_thread_budget, max_threads)
+        worker_thread.set_thread_budget(1)
+        self.assertEqual(worker_thread.get_thread_budget(), 2)
+        worker_thread.set_thread_budget(0)
+        self.assertGreaterEqual(worker_thread.get_thread_budget(), 2)
+
+    def test_start_thread(self):
+        done = threading.Event()
+        thread = worker_thread.start_thread(done.set, name='test')
+        thread.join(5)
+        self.assertTrue(done.is_set())
+        self.assertTrue(thread.name.endswith('-test'))
+
+# vim: expandtab:sw=4:ts=4
@@ -27,6 +27,8 @@ added_files = [(os.path.join('..', path),
 added_files.extend([(os.path.join('..', path),
                      os.path.split(path)[0])
                     for path in list_files('mcomix/images', '*.png')])
+added_files.append((os.path.join('..', 'mcomix', 'archive', 'pdf_renderer.js'),
+                    os.path.join('mcomix', 'archive')))
 
 
 a = Analysis(['../mcomixstarter.py'],